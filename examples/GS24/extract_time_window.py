@@ -0,0 +1,27 @@
+import sys
+import os
+import time
+
+from cesiumtoolkit.timeindex import extract_window
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print('Usage: python extract_time_window.py input.txt output.txt "2024-09-29 23:30" "2024-09-30 01:00"')
+        print("       (G-880 .txt or proton .dat; a .tidx time index is built next to the input on first use)")
+        sys.exit(1)
+
+    input_file, output_file, start, end = sys.argv[1:5]
+
+    if not os.path.exists(input_file):
+        print(f"Error: file not found: {input_file}")
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    try:
+        n_lines = extract_window(input_file, output_file, start, end)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Done. {n_lines:,} lines from {start} to {end} written to '{output_file}' "
+          f"in {time.perf_counter() - t0:.2f} s.")
@@ -2,7 +2,8 @@ from cesiumtoolkit import (
     CESIUMRAW2ANMORG, 
     ANMORG1MIN, CABLECORRECTION,
     IGRFCORRECTION, DVCONVERT, DVCORRECTION,
-    TRKSplitter
+    TRKSplitter, BuildManifest,
+    set_headless
 )
 # PROTONRAW2ANMORG
 
@@ -16,51 +17,141 @@ if __name__ == "__main__":
     input_dir     = "../examples/GS24"
     input_dv_dir  = "../examples/GS24/dv"
 
+    # Worker processes for multi-file steps (1 = serial, None = all cores)
+    jobs = None
+
+    # Write intermediates (.anmorg … .anm_cc_igrf_dv) as binary columnar .anmc files
+    # instead of fixed-width text; .trk files are always text
+    binary = False
+
+    # Convert only this time span of the raw logs, e.g. ("2024-09-30 10:00", "2024-09-30 12:00")
+    # (a .tidx time index is built next to each log on first use); None = whole files
+    time_window = None
+
+    # Skip files/stages whose inputs and parameters are unchanged since the last run
+    # (hashes kept in <input_dir>/.cesium_manifest.json; delete it to force a full rebuild)
+    incremental = True
+
+    # --- DESPIKING (Step 2) ---
+    # None = spline filter on each 1-min batch (|Tmag - spline| >= 100 nT removed).
+    # A Despiker removes spikes from the full-rate samples before resampling instead, e.g.
+    #   from cesiumtoolkit import Despiker, HampelFilter, RollingMedianFilter, WindowedSplineFilter
+    #   despike = Despiker([HampelFilter(window=51, n_sigma=4.0),
+    #                       WindowedSplineFilter(window=600, threshold=100.0)])
+    # (windows in samples; rejection counts are printed per filter)
+    despike = None
+
+    # --- DECIMATION (Step 2) ---
+    interval  = "1min"  # bin width, e.g. "10s", "30s", "1min"
+    aggregate = None    # None = nearest sample to each mark, empty marks inside gaps < 1 h filled;
+                        # "mean" | "median" | "nearest" (to bin centre) | "first": only bins holding
+                        # samples are kept, with a per-bin sample count (<segment>.1min.counts)
+    min_count = None    # with aggregate: drop bins holding fewer samples (None = keep all)
+
+    # Full-rate mode: keep every sample (sub-second time stamps) through all stages instead of
+    # 1-min bins; cable offset and IGRF are computed per minute and interpolated in time, dv is
+    # interpolated between observatory minutes. Use with `despike` and preferably `binary = True`.
+    full_rate = False
+
+    # Max points per HTML preview (series are downsampled with LTTB, drawn with WebGL and share
+    # one plotly.min.js per folder); None = plot every point
+    preview_points = 5000
+
+    # Headless: write no HTML/PNG previews and never import plotly (same as CESIUMTOOLKIT_HEADLESS=1)
+    headless = False
+
     # --- CABLE CORRECTION ---
     wire_len = 329.95  # [m] Cable length from ship's GPS to magnetometer
     steps    = 3       # Number of steps ahead used to compute heading (azimuth)
+    layback  = "bearing"  # "bearing": wire_len back along the heading to the fix `steps` ahead
+                          # "along_track": wire_len back along the sailed track (follows turns, ignores `steps`)
 
     # Notes on `steps`:
     #   steps = 1  → short-baseline direction (sensitive to noise/turns)
     #   steps = 3  → moderate smoothing (recommended for stable track direction)
     #   steps ≥ 5 → strong smoothing (for fast or sparse data)
 
+    # --- IGRF ---
+    # None = evaluate the IGRF model at every sample; a tolerance in nT (e.g. 0.01) interpolates it
+    # from a lattice over the survey's lat/lon/time box instead (achieved error is printed)
+    igrf_lattice = None
+
+    # --- OBSERVATORY DATA (Step 5) ---
+    # Keep parsed .min files in <input_dv_dir>/.obsstore: later runs parse only new/changed files and
+    # read the needed span (time_window, if set) as a slice
+    dv_store = False
+    # Append the minutes after the end of an existing output.obsc instead of rewriting it
+    dv_append = False
+    # Several observatories in <input_dv_dir> (e.g. kny*.min and mmb*.min): their dv is aligned on one
+    # time grid (output_stations.anmc) and each sample gets the distance weighted (1/d**dv_power)
+    # combination of the stations with a value at that time; with a linear/nearest dv_join each weight
+    # also decays with the gap to the station's samples. False = first station only (output.obsc)
+    dv_stations = False
+    dv_power    = 2.0
+
+    # --- DV JOIN (Step 6) ---
+    # None = "exact" minute match ("linear" with full_rate); "linear" = dv interpolated at each sample
+    # time; "nearest" = closest observatory sample. Samples outside dv coverage are dropped and counted.
+    dv_join      = None
+    dv_tolerance = None  # e.g. "90s": max bracketing gap (linear) / distance (nearest); None = from dv spacing
+
     # --- RDP Track Simplification ---
-    epsilon           = 0.01   # RDP simplification tolerance [degrees]
+    epsilon           = 0.01   # RDP simplification tolerance [epsilon_units]
+    epsilon_units     = "deg"  # "deg" = raw lon/lat degrees; "m" = metres on a local projection
+    rdp_radial        = None   # radial pre-thinning distance [epsilon_units] for dense full-rate tracks; None = off
     min_distance_km   = 3      # Minimum segment length to keep [km]
 
     # ============================================
     #  PROCESSING PIPELINE
     # ============================================
 
+    if headless:
+        set_headless()
+    manifest = BuildManifest(input_dir) if incremental else None
+
     # Step 1: Convert raw .txt files → .anmorg (original ANM format)
-    converter = CESIUMRAW2ANMORG(input_dir=input_dir)
+    converter = CESIUMRAW2ANMORG(input_dir=input_dir, binary=binary, manifest=manifest,
+                                 time_window=time_window)
     # in proton magnetometer data by Hakuho-maru use 'PROTONRAW2ANMORG'
-    converter.convert_all(start_number=1)
+    converter.convert_all(start_number=1, jobs=jobs)
 
     # Step 2: Interpolate .anmorg to 1-minute intervals and plot
-    processor = ANMORG1MIN(input_dir=input_dir)
+    processor = ANMORG1MIN(input_dir=input_dir, binary=binary, manifest=manifest, jobs=jobs,
+                           despike=despike, interval=interval, aggregate=aggregate, full_rate=full_rate,
+                           min_count=min_count, preview_points=preview_points)
     processor.process_directory()
 
     # Step 3: Apply cable length correction (.anmorg → .anm_cc)
-    corrector = CABLECORRECTION(input_dir=input_dir, wire_len=wire_len, steps=steps)
+    corrector = CABLECORRECTION(input_dir=input_dir, wire_len=wire_len, steps=steps, binary=binary,
+                                manifest=manifest, full_rate=full_rate, layback=layback)
     corrector.process_directory()
 
     # Step 4: Subtract IGRF model (.anm_cc → .anm_cc_igrf)
-    igrf_corrector = IGRFCORRECTION(input_dir=input_dir, wire_height=0.0)  # height in km
+    igrf_corrector = IGRFCORRECTION(input_dir=input_dir, wire_height=0.0, binary=binary,
+                                    manifest=manifest, full_rate=full_rate, jobs=jobs,
+                                    lattice_tolerance=igrf_lattice)  # height in km
     igrf_corrector.process_directory()
 
     # Step 5: Convert daily variation data (.min → .obsc)
-    dv_converter = DVCONVERT(input_dir=input_dv_dir) 
+    dv_converter = DVCONVERT(input_dir=input_dv_dir, manifest=manifest, preview_points=preview_points,
+                             store=dv_store, jobs=jobs, time_window=time_window, append=dv_append,
+                             stations=dv_stations)
     dv_converter.convert()
 
     # Step 6: Apply diurnal variation correction
-    dv_corrector = DVCORRECTION(anm_folder=input_dir, obsc_folder=input_dv_dir)
+    dv_corrector = DVCORRECTION(anm_folder=input_dir, obsc_folder=input_dv_dir, binary=binary,
+                                manifest=manifest, full_rate=full_rate, preview_points=preview_points,
+                                join=dv_join, tolerance=dv_tolerance, jobs=jobs,
+                                stations=dv_stations, power=dv_power)
     dv_corrector.run()
 
     # Step 7: Split tracks using RDP algorithm (save to main/skipped folders)
     main_trk_dir = TRKSplitter(
         input_dir=input_dir,
         epsilon=epsilon,
+        units=epsilon_units,
+        radial=rdp_radial,
         min_distance_km=min_distance_km,
+        manifest=manifest,
+        preview_points=preview_points,
     )
\ No newline at end of file
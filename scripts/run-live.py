@@ -0,0 +1,34 @@
+from cesiumtoolkit import LIVETAIL
+
+if __name__ == "__main__":
+
+    # ============================================
+    #  SETTINGS: Growing raw log and parameters
+    # ============================================
+
+    # G-880 export (.txt) or proton log (.dat) that is still being written
+    input_path    = "../examples/GS24/Export.G-880.txt"
+    output_dir    = "../examples/GS24/live"
+    input_dv_dir  = "../examples/GS24/dv"   # folder with output.obsc, or None
+
+    wire_len = 329.95  # [m] Cable length from ship's GPS to magnetometer
+    steps    = 3       # Look-ahead minutes used to compute heading (azimuth)
+    poll     = 5.0     # [s] Polling interval
+
+    # Despiking of the full-rate samples, as in run-cesium.py (same filters → same minutes as the
+    # batch run); None = running median of the last 5 minutes (rejects >= 100 nT)
+    #   from cesiumtoolkit import Despiker, HampelFilter
+    #   despike = Despiker([HampelFilter(window=51, n_sigma=4.0)])
+    despike = None
+    # None = IGRF model for every minute; a tolerance in nT (e.g. 0.01) interpolates it from a
+    # lattice over a rolling box around the ship
+    igrf_lattice = None
+
+    # ============================================
+    #  FOLLOW: append .anm_cc_igrf / .trk rows as data arrive (Ctrl-C to stop)
+    # ============================================
+
+    follower = LIVETAIL(input_path, output_dir=output_dir, obsc_folder=input_dv_dir,
+                        wire_len=wire_len, steps=steps, despike=despike,
+                        lattice_tolerance=igrf_lattice)
+    follower.follow(poll=poll)
@@ -1,20 +1,69 @@
-from .cesiumraw2anmorg import CESIUMRAW2ANMORG
-from .protonraw2anmorg import PROTONRAW2ANMORG
-from .anmorg1min import ANMORG1MIN
-from .cablecorr import CABLECORRECTION
-from .igrfcorrection import IGRFCORRECTION
-from .dv_min2obsc import DVCONVERT
-from .dvcorrection import DVCORRECTION
-from .trksplitter import TRKSplitter, splitter
+"""
+Stage classes are imported on first use (``cesiumtoolkit.ANMORG1MIN`` loads
+``anmorg1min`` and its dependencies only then), so ``import cesiumtoolkit``
+stays cheap for batch jobs that need a single stage.
+"""
+
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .cesiumraw2anmorg import CESIUMRAW2ANMORG
+    from .protonraw2anmorg import PROTONRAW2ANMORG
+    from .anmorg1min import ANMORG1MIN
+    from .cablecorr import CABLECORRECTION
+    from .igrfcorrection import IGRFCORRECTION
+    from .igrflattice import IGRFLattice
+    from .dv_min2obsc import DVCONVERT
+    from .dvcorrection import DVCORRECTION
+    from .dvstations import StationGrid
+    from .trksplitter import TRKSplitter, splitter
+    from .survey import Survey
+    from .manifest import BuildManifest
+    from .livetail import LIVETAIL
+    from .obsstore import ObservatoryStore
+    from .despike import Despiker, HampelFilter, RollingMedianFilter, WindowedSplineFilter
+    from .preview import set_headless
+
+# public name -> submodule defining it
+_LAZY = {
+    "CESIUMRAW2ANMORG": "cesiumraw2anmorg",
+    "PROTONRAW2ANMORG": "protonraw2anmorg",
+    "ANMORG1MIN": "anmorg1min",
+    "CABLECORRECTION": "cablecorr",
+    "IGRFCORRECTION": "igrfcorrection",
+    "IGRFLattice": "igrflattice",
+    "DVCONVERT": "dv_min2obsc",
+    "DVCORRECTION": "dvcorrection",
+    "StationGrid": "dvstations",
+    "TRKSplitter": "trksplitter",
+    "splitter": "trksplitter",
+    "Survey": "survey",
+    "BuildManifest": "manifest",
+    "LIVETAIL": "livetail",
+    "ObservatoryStore": "obsstore",
+    "Despiker": "despike",
+    "HampelFilter": "despike",
+    "RollingMedianFilter": "despike",
+    "WindowedSplineFilter": "despike",
+    "set_headless": "preview",
+}
 
 __all__ = [
-    "CESIUMRAW2ANMORG",
-    "PROTONRAW2ANMORG",
-    "ANMORG1MIN",
-    "CABLECORRECTION",
-    "IGRFCORRECTION",
-    "DVCONVERT",
-    "DVCORRECTION",
-    "TRKSplitter",
-    "splitter",
-]
+    "CESIUMRAW2ANMORG", "PROTONRAW2ANMORG", "ANMORG1MIN", "CABLECORRECTION", "IGRFCORRECTION",
+    "IGRFLattice", "DVCONVERT", "DVCORRECTION", "StationGrid", "TRKSplitter", "splitter", "Survey",
+    "BuildManifest", "LIVETAIL", "ObservatoryStore", "Despiker", "HampelFilter", "RollingMedianFilter",
+    "WindowedSplineFilter", "set_headless",
+]  # the keys of _LAZY, as a literal for linters
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,40 +1,73 @@
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from scipy.interpolate import UnivariateSpline
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import tempfile
 import warnings
+
+from .decimate import decimate, interval_ns
+from .columnar import find_stage_files, read_columnar, text_path, write_columnar, write_stage
+from .fixedwidth import ANMORG_FIELDS, COUNTS_FIELDS, RAW_ANMORG_FIELDS, subsecond
+from .manifest import manifest_step
+from .preview import DEFAULT_MAX_POINTS, is_headless, line_trace, share_points, write_html
+from .survey import Survey
+
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+_MINUTE = 60 * 10**9  # ns
+
+
+def _run_chunk(processor, source, start, stop):
+    # worker entry point: source is the columnar spool file (memory-mapped here) or the arrays
+    if isinstance(source, (str, Path)):
+        columns, _ = read_columnar(source)
+        source = (columns['time'], columns['Latitude'], columns['Longitude'], columns['Tmag'])
+    return processor.process_chunk(*source, start, stop)
+
+
 class ANMORG1MIN:
-    def __init__(self, input_dir, batch_size=100000):
+    def __init__(self, input_dir, batch_size=100000, binary=False, manifest=None, overlap=30, jobs=None,
+                 despike=None, interval="1min", aggregate=None, full_rate=False, min_count=None,
+                 preview_points=DEFAULT_MAX_POINTS):
         self.input_dir = Path(input_dir)
-        self.batch_size = batch_size
+        self.batch_size = batch_size  # samples per chunk; chunks are cut on minute boundaries
+        self.overlap = overlap        # minutes resampled/filtered on each side of a chunk, then trimmed
+        self.jobs = jobs              # worker processes (None = all cores)
+        # Despiker run on the full-rate samples before resampling; replaces the batch spline filter
+        self.despike = despike
+        # aggregate=None: legacy resample(interval).nearest(), which fills empty bins inside gaps;
+        # "mean"/"median"/"nearest"/"first": decimate.decimate, only bins holding samples, with counts
+        # (written per segment to <segment>.1min.counts)
+        self.interval = interval
+        self.aggregate = aggregate
+        self.min_count = min_count  # with aggregate: bins of fewer samples are dropped (None = keep all)
+        self.step = interval_ns(interval)
+        # full_rate: no resampling; every (despiked) sample is kept with its sub-second time stamp
+        self.full_rate = full_rate
+        self.preview_points = preview_points  # cap on points in the HTML preview (None = all)
+        self.binary = binary  # write .1min.anmorg as a columnar .anmc intermediate
+        self.manifest = manifest  # BuildManifest: skip files whose outputs are up to date
 
     def process_directory(self):
-        files = sorted(self.input_dir.glob("*.txt.anmorg"))
+        files = find_stage_files(self.input_dir, "*.txt.anmorg")
         for file_path in files:
+            step = manifest_step(self.manifest, "1min", [file_path], code=__file__,
+                                 params={"batch_size": self.batch_size, "overlap": self.overlap,
+                                         "binary": self.binary, "despike": self.despike_params(),
+                                         "interval": self.interval, "aggregate": self.aggregate,
+                                         "full_rate": self.full_rate, "min_count": self.min_count})
+            if step.fresh:
+                print(f"> Up to date, skipped: {file_path.name}")
+                continue
             print(f"\nProcessing: {file_path}")
-            split_dfs = self.main_processing(file_path)
+            split_dfs = self.split_frames(self.process_survey(Survey.read(file_path, RAW_ANMORG_FIELDS)))
             self.plot_with_plotly(split_dfs, file_path)
-            self.save_processed_data(file_path, split_dfs)
-
-    def process_batch(self, df):
-        try:
-            df['DateTime'] = pd.to_datetime(df[['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second']])
-            df.set_index('DateTime', inplace=True)
-            df.drop(['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second'], axis=1, inplace=True)
-            df_resampled = self.resample_df(df)
-            df_filtered = self.spline_filter(df_resampled)
-            return df_filtered
-        except Exception as e:
-            print(f"Error in process_batch: {e}")
-            return pd.DataFrame()
+            step.done(self.save_processed_data(file_path, split_dfs))
 
     def spline_filter(self, data, threshold=100, s=0.5):
+        from scipy.interpolate import UnivariateSpline
+
         x = np.arange(len(data))
         y = data['Tmag'].values
         spline = UnivariateSpline(x, y, s=s)
@@ -43,86 +76,174 @@ class ANMORG1MIN:
 
     def resample_df(self, data):
         data = data.astype({'Latitude': 'float32', 'Longitude': 'float32', 'Tmag': 'float32'})
-        return data.resample('1min').nearest()
+        return data.resample(pd.Timedelta(self.step)).nearest()
+
+    def decimate_df(self, time, lat, lon, tmag):
+        bin_time, values, counts = decimate(time, {'Latitude': lat, 'Longitude': lon, 'Tmag': tmag},
+                                            pd.Timedelta(self.step), self.aggregate)
+        df = pd.DataFrame(values, index=pd.DatetimeIndex(bin_time.view('datetime64[ns]'), name='DateTime'))
+        df['count'] = counts
+        return df
 
-    def split_df_on_gaps(self, data, gap):
-        indices = np.where(np.diff(data.index) > gap)[0] + 1
-        return np.split(data, indices)
+    def split_indices(self, data, gap):
+        return np.where(np.diff(data.index) > gap)[0] + 1
 
     def main_processing(self, file_path):
-        df = pd.read_csv(file_path, sep="\s+", header=None, 
-                         names=['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'Latitude', 'Longitude', 'Tmag'])
-        batches = [df.iloc[i*self.batch_size:(i+1)*self.batch_size] for i in range((len(df) + self.batch_size - 1) // self.batch_size)]
+        return self.split_frames(self.process_survey(Survey.read(file_path, RAW_ANMORG_FIELDS)))
+
+    def process_survey(self, survey: Survey) -> Survey:
+        # 1-min resampling + despiking (batch spline, or self.despike at full rate); samples after a gap > 1 h start a new segment
+        survey = survey.take(np.argsort(survey.time, kind='stable'))
+        if self.despike is not None:
+            survey = self.despike.process_survey(survey)
+        if self.full_rate:
+            keep = np.ones(len(survey), dtype=bool)
+            keep[1:] = np.diff(survey.time) > 0  # drop repeated time stamps
+            survey = survey.take(keep)
+            gap = np.zeros(len(survey), dtype=np.int64)
+            gap[1:] = np.diff(survey.time) > pd.Timedelta('1h').value
+            return survey.replace(segment=np.cumsum(gap)).with_step("1min", full_rate=True)
+        columns = (survey.time, survey.lat, survey.lon, survey.field)
+        chunks = self.chunk_bounds(columns[0])
 
         resampled_dfs = []
-        with ProcessPoolExecutor() as executor:
-            futures = [executor.submit(self.process_batch, batch) for batch in batches]
-            for future in tqdm(futures, desc="Processing Batches"):
-                try:
-                    result = future.result()
-                    if not result.empty:
-                        resampled_dfs.append(result)
-                except Exception as e:
-                    print(f"Error in batch processing: {e}")
+        if len(chunks) == 1 or self.jobs == 1:
+            for start, stop in tqdm(chunks, desc="Processing Batches"):
+                resampled_dfs.append(self.process_chunk(*columns, start, stop))
+        else:
+            # workers memory-map one columnar spool file instead of receiving pickled slices
+            with tempfile.TemporaryDirectory(prefix="anmorg1min-") as tmp:
+                spool = write_columnar(Path(tmp) / "samples.anmc", dict(zip(
+                    ('time', 'Latitude', 'Longitude', 'Tmag'), columns)), stage="1min-spool")
+                with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                    futures = [executor.submit(_run_chunk, self, str(spool), start, stop) for start, stop in chunks]
+                    for future in tqdm(futures, desc="Processing Batches"):
+                        try:
+                            resampled_dfs.append(future.result())
+                        except Exception as e:
+                            print(f"Error in batch processing: {e}")
+        resampled_dfs = [df for df in resampled_dfs if not df.empty]
 
         if resampled_dfs:
             combined_df = pd.concat(resampled_dfs)
-            combined_df.sort_index(inplace=True)
-            return self.split_df_on_gaps(combined_df, pd.Timedelta('1h'))
         else:
+            combined_df = survey.to_frame()[['DateTime', 'Latitude', 'Longitude', 'Tmag']].iloc[:0].set_index('DateTime')
+        if 'count' in combined_df and len(combined_df):
+            counts = combined_df['count'].to_numpy()
+            print(f"> {len(survey):,} samples → {len(counts):,} bins of {self.interval} ({self.aggregate}); "
+                  f"samples per bin min {counts.min()}, median {int(np.median(counts))}, max {counts.max()}")
+            if self.min_count:
+                sparse = counts < self.min_count
+                print(f"> Dropped {int(sparse.sum()):,} bins of fewer than {self.min_count} samples")
+                combined_df = combined_df[~sparse]
+        segment = np.zeros(len(combined_df), dtype=np.int64)
+        segment[self.split_indices(combined_df, pd.Timedelta('1h'))] = 1
+        combined_df['segment'] = np.cumsum(segment)
+        return Survey.from_frame(combined_df.reset_index(), name=survey.name,
+                                 provenance=survey.provenance).with_step("1min", batch_size=self.batch_size,
+                                                                         overlap=self.overlap,
+                                                                         interval=str(self.interval),
+                                                                         aggregate=self.aggregate)
+
+    def despike_params(self):
+        return None if self.despike is None else [repr(f) for f in self.despike.filters]
+
+    def chunk_bounds(self, time):
+        """Bin-aligned ``[start, stop)`` label ranges of about ``batch_size`` samples each."""
+        if not len(time):
             return []
+        marks = time[::self.batch_size] // self.step * self.step
+        bounds = np.unique(np.append(marks, time[-1] // self.step * self.step + self.step))
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def process_chunk(self, time, lat, lon, tmag, start, stop):
+        """
+        Resample and filter the minute labels ``[start, stop)``.
+
+        The chunk is processed with ``overlap`` extra minutes on each side
+        (plus the neighbouring samples needed by ``nearest``) and trimmed, so
+        resampled values are exactly those of a single-chunk run and the
+        spline filter sees no cut edge.  The spline itself is fitted to the
+        chunk plus overlap, so its residuals are not those of one fit over
+        the whole file: they differ by up to ~0.25 nT (7 days of 1 Hz data,
+        ``batch_size`` 5000 to 100000), which changes the kept minutes only
+        for residuals that close to ``threshold``.  A ``despike`` filter is
+        local and gives the same result for any chunking.
+        """
+        margin = self.overlap * _MINUTE
+        try:
+            if self.aggregate is None:
+                lo = max(np.searchsorted(time, start - margin, side='right') - 1, 0)
+                hi = np.searchsorted(time, stop - self.step + margin, side='left') + 1
+                df = pd.DataFrame({'Latitude': np.array(lat[lo:hi]), 'Longitude': np.array(lon[lo:hi]),
+                                   'Tmag': np.array(tmag[lo:hi])},
+                                  index=pd.DatetimeIndex(np.array(time[lo:hi]).view('datetime64[ns]'),
+                                                         name='DateTime'))
+                df_resampled = self.resample_df(df)
+            else:
+                lo = np.searchsorted(time, start - margin, side='left')
+                hi = np.searchsorted(time, stop + margin, side='left')
+                df_resampled = self.decimate_df(time[lo:hi], lat[lo:hi], lon[lo:hi], tmag[lo:hi])
+            labels = df_resampled.index.asi8
+            df_resampled = df_resampled[(labels >= start - margin) & (labels < stop + margin)]
+            df_filtered = self.spline_filter(df_resampled) if self.despike is None else df_resampled
+        except Exception as e:
+            print(f"Error in process_chunk: {e}")
+            return pd.DataFrame()
+        labels = df_filtered.index.asi8
+        return df_filtered[(labels >= start) & (labels < stop)]
+
+    def split_frames(self, survey: Survey):
+        columns = ['Latitude', 'Longitude', 'Tmag'] + (['count'] if 'count' in survey.extra else [])
+        return [s.to_frame().set_index('DateTime')[columns] for s in survey.segments()]
 
     def plot_with_plotly(self, split_dfs, file_path):
+        if is_headless():
+            return
         if not split_dfs:
             print("No data to plot.")
             return
+        from plotly.subplots import make_subplots
 
         fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.1,
                             subplot_titles=("Original Data", "Resampled Data"))
 
-        combined_df = pd.concat(split_dfs)
-        customdata = np.stack((combined_df['Tmag'],), axis=-1)
-
         fig.add_trace(
-            go.Scatter(name='Original Data', mode='lines', x=split_dfs[0].index, y=split_dfs[0]['Tmag'],
-                       customdata=customdata, hovertemplate='<br>'.join([
-                           'Datetime: %{x}', '<b>Original</b>: %{y:.2f}', '<extra></extra>']),), row=1, col=1)
+            line_trace(split_dfs[0].index, split_dfs[0]['Tmag'], max_points=self.preview_points,
+                       name='Original Data', hovertemplate='<br>'.join([
+                           'Datetime: %{x}', '<b>Original</b>: %{y:.2f}', '<extra></extra>'])), row=1, col=1)
 
-        for df in split_dfs:
+        budgets = share_points([len(df) for df in split_dfs], self.preview_points)
+        for df, max_points in zip(split_dfs, budgets):
             fig.add_trace(
-                go.Scatter(name='Resampled Data', mode='lines', x=df.index, y=df['Tmag'],
-                           customdata=customdata, hovertemplate='<br>'.join([
-                               'Datetime: %{x}', '<b>Resampled</b>: %{y:.2f}', '<extra></extra>']),), row=2, col=1)
+                line_trace(df.index, df['Tmag'], max_points=max_points,
+                           name='Resampled Data', hovertemplate='<br>'.join([
+                               'Datetime: %{x}', '<b>Resampled</b>: %{y:.2f}', '<extra></extra>'])), row=2, col=1)
 
         fig.update_layout(height=600, width=1000, hovermode='x unified',
                           legend_traceorder="normal", title_text="Original and Resampled Data")
         fig.update_traces(xaxis='x2')
 
-        output_html = file_path.with_suffix(".1min_plot.html")
-        fig.write_html(str(output_html))
+        output_html = write_html(fig, text_path(file_path).with_suffix(".1min_plot.html"))
         print(f"Saved plot to {output_html}")
 
     def save_processed_data(self, file_path, split_dfs):
         print("Saving processed data...")
+        file_path = text_path(file_path)
+        written = []
         for i, df_resampled in enumerate(split_dfs, start=1):
-            df_resampled['Latitude'] = pd.to_numeric(df_resampled['Latitude'], errors='coerce')
-            df_resampled['Longitude'] = pd.to_numeric(df_resampled['Longitude'], errors='coerce')
-            df_resampled['Tmag'] = pd.to_numeric(df_resampled['Tmag'], errors='coerce')
-
-            df_resampled['Year'] = df_resampled.index.year.map('{:4d}'.format)
-            df_resampled['Month'] = df_resampled.index.month.map('{:02d}'.format)
-            df_resampled['Day'] = df_resampled.index.day.map('{:02d}'.format)
-            df_resampled['Hour'] = df_resampled.index.hour.map('{:02d}'.format)
-            df_resampled['Minute'] = df_resampled.index.minute.map('{:02d}'.format)
-            df_resampled['Second'] = df_resampled.index.second.map('{:02d}'.format)
-
-            df_resampled['Latitude'] = df_resampled['Latitude'].map('{:2.8f}'.format)
-            df_resampled['Longitude'] = df_resampled['Longitude'].map('{:3.8f}'.format)
-            df_resampled['Tmag'] = df_resampled['Tmag'].map('{:5.3f}'.format)
-
-            df_to_save = df_resampled[['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'Latitude', 'Longitude', 'Tmag']]
+            df_out = df_resampled.reset_index()
+            for col in ['Latitude', 'Longitude', 'Tmag']:
+                df_out[col] = pd.to_numeric(df_out[col], errors='coerce')
             output_filename = file_path.with_name(file_path.stem + f"_{i:02d}.1min.anmorg")
-            with open(output_filename, 'w') as file:
-                for row in df_to_save.itertuples(index=False, name=None):
-                    file.write(' '.join(map(str, row)) + '\n')
-            print(f"Saved {output_filename}")
\ No newline at end of file
+            fields = subsecond(ANMORG_FIELDS) if self.full_rate else ANMORG_FIELDS
+            output_filename = write_stage(output_filename, df_out, fields, binary=self.binary,
+                                          stage="1min", meta={"source": file_path.name, "segment": i})
+            print(f"Saved {output_filename}")
+            written.append(output_filename)
+            if 'count' in df_out:
+                counts_filename = write_stage(file_path.with_name(file_path.stem + f"_{i:02d}.1min.counts"),
+                                              df_out, COUNTS_FIELDS, binary=self.binary, stage="1min-counts",
+                                              meta={"source": file_path.name, "segment": i})
+                written.append(counts_filename)
+        return written
@@ -0,0 +1,92 @@
+"""
+batchconvert.py — Run a converter's ``convert_file`` over many files, optionally in a process pool.
+
+Output names are fixed by the caller before anything is submitted, so the
+``_{idx:02d}`` numbering does not depend on completion order.  Messages
+printed by each conversion are captured and shown in one ordered summary.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+__all__ = ["convert_many", "print_summary"]
+
+
+def _convert_one(converter, src: Path, dst: Path) -> dict:
+    log = io.StringIO()
+    t0 = time.perf_counter()
+    rows = None
+    error = None
+    with contextlib.redirect_stdout(log):
+        try:
+            rows = converter.convert_file(src, dst)
+        except Exception as exc:  # noqa: BLE001
+            error = f"{type(exc).__name__}: {exc}"
+    messages = [line for line in log.getvalue().splitlines() if line.strip()]
+    if error:
+        messages.append(error)
+    ok = error is None and rows is not None and Path(dst).exists()
+    return {
+        "input": Path(src),
+        "output": Path(dst),
+        "status": "ok" if ok else "failed",
+        "rows": rows or 0,
+        "seconds": time.perf_counter() - t0,
+        "messages": messages,
+    }
+
+
+def convert_many(converter, pairs: list[tuple[Path, Path]], jobs: int | None = 1) -> list[dict]:
+    """
+    Convert every ``(input, output)`` pair with ``converter.convert_file``.
+
+    Parameters
+    ----------
+    converter : object
+        Picklable converter exposing ``convert_file(input_path, output_path)``.
+    pairs : list of (Path, Path)
+        Inputs and their already-numbered output paths.
+    jobs : int or None, default 1
+        Worker processes; ``1`` converts in this process, ``None`` or ``0``
+        uses every core.
+
+    Returns
+    -------
+    list of dict
+        One result per pair, in input order, with ``status``, ``rows``,
+        ``seconds`` and the captured ``messages``.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    jobs = min(jobs, len(pairs)) if pairs else 1
+    if jobs == 1:
+        return [_convert_one(converter, src, dst) for src, dst in pairs]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_convert_one, converter, src, dst) for src, dst in pairs]
+        results = []
+        for (src, dst), future in zip(pairs, futures):
+            try:
+                results.append(future.result())
+            except Exception as exc:  # noqa: BLE001  (worker died, unpicklable result, ...)
+                results.append({"input": Path(src), "output": Path(dst), "status": "failed",
+                                "rows": 0, "seconds": 0.0, "messages": [f"{type(exc).__name__}: {exc}"]})
+    return results
+
+
+def print_summary(results: list[dict], elapsed: float, jobs: int | None) -> None:
+    n_ok = sum(r["status"] == "ok" for r in results)
+    rows = sum(r["rows"] for r in results)
+    print(f"> Converted {n_ok}/{len(results)} file(s), {rows:,} rows in {elapsed:.2f} s "
+          f"(jobs={jobs or os.cpu_count()})")
+    for r in results:
+        flag = "ok    " if r["status"] == "ok" else "FAILED"
+        print(f"  {flag} {r['input'].name} → {r['output'].name}: {r['rows']:,} rows, {r['seconds']:.2f} s")
+        for msg in r["messages"]:
+            print(f"         {msg}")
@@ -1,82 +1,147 @@
-import pandas as pd
-from geopy.distance import geodesic
-from geographiclib.geodesic import Geodesic
-import matplotlib.pyplot as plt
+import numpy as np
 import os
 from pathlib import Path
 
+from .columnar import columnar_path, find_stage_files, text_path
+from .fixedwidth import ANMORG_FIELDS, ANM_CC_FIELDS, subsecond
+from .geodesy import direct, inverse
+from .manifest import manifest_step
+from .preview import is_headless
+from .survey import Survey
+
+LAYBACK_MODES = ("bearing", "along_track")
+
+
 class CABLECORRECTION:
-    def __init__(self, input_dir, wire_len=329.95, steps=3):
+    def __init__(self, input_dir, wire_len=329.95, steps=3, binary=False, manifest=None, full_rate=False,
+                 layback="bearing"):
         self.input_dir = Path(input_dir)
         self.wire_len = wire_len / 1000  # convert to kilometers
         self.steps = steps
+        # "bearing": wire_len straight back from the bearing to the fix `steps` ahead;
+        # "along_track": wire_len back along the ship's own track (no `steps`, follows turns)
+        if layback not in LAYBACK_MODES:
+            raise ValueError(f"unknown layback {layback!r}; expected one of {LAYBACK_MODES}")
+        self.layback_mode = layback
+        # full_rate: sub-minute input; the offset is computed on the first sample of each minute
+        # (so `steps` still counts minutes) and interpolated in time to every sample
+        self.full_rate = full_rate
+        self.binary = binary  # write .anm_cc as a columnar .anmc intermediate
+        self.manifest = manifest  # BuildManifest: skip files whose outputs are up to date
 
 
     def get_bearing(self, lat1, lon1, lat2, lon2):
-        return Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2)['azi1']
+        # scalars or arrays; WGS84 forward azimuth [deg]
+        return inverse(lat1, lon1, lat2, lon2)[1][()]
 
     def calculate_new_position(self, lat1, lon1, distance_km, bearing_degrees):
-        origin = (lat1, lon1)
-        destination = geodesic(kilometers=distance_km).destination(origin, bearing_degrees)
-        return destination.latitude, destination.longitude
+        lat2, lon2, _ = direct(lat1, lon1, bearing_degrees, np.asarray(distance_km) * 1000)
+        return lat2[()], lon2[()]
+
+    def layback(self, lat, lon, lat_ahead, lon_ahead):
+        """Sensor positions ``wire_len`` behind ``(lat, lon)``, opposite to the bearing towards the fix ahead."""
+        bearing = self.get_bearing(lat, lon, lat_ahead, lon_ahead)
+        return self.calculate_new_position(lat, lon, self.wire_len, (bearing + 180) % 360)
     
     def process_directory(self):
-        for file_path in self.input_dir.glob("*.1min.anmorg"):
+        for file_path in find_stage_files(self.input_dir, "*.1min.anmorg"):
+            step = manifest_step(self.manifest, "anm_cc", [file_path], code=__file__,
+                                 params={"wire_len": self.wire_len, "steps": self.steps, "binary": self.binary,
+                                         "full_rate": self.full_rate, "layback": self.layback_mode})
+            if step.fresh:
+                print(f"> Up to date, skipped: {file_path.name}")
+                continue
             df = self.process_file(file_path)
-            self.plot_preview(df, file_path)
+            self.plot_preview(df, text_path(file_path))
+            step.done([self.output_path(file_path)])
 
 
     def process_file(self, file_path):
         file_name = os.path.basename(file_path)
         print(f"Processing: {file_name}")
 
-        df = pd.read_csv(file_path, sep="\s+", header=None)
-        df.columns = ['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'Latitude', 'Longitude', 'Tmag']
-        df['DateTime'] = pd.to_datetime(df[['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second']])
-        df.set_index('DateTime', inplace=True)
-
-        df['Lat1'] = df['Latitude'].shift(-1 * self.steps)
-        df['Lon1'] = df['Longitude'].shift(-1 * self.steps)
-
-        for index, row in df.iterrows():
-            if not pd.isna(row['Lat1']) and not pd.isna(row['Lon1']):
-                bearing = self.get_bearing(row['Latitude'], row['Longitude'], row['Lat1'], row['Lon1'])
-                if not pd.isna(bearing):
-                    new_lat, new_lon = self.calculate_new_position(
-                        row['Latitude'], row['Longitude'], self.wire_len, (bearing + 180) % 360)
-                    df.at[index, 'Lat3'] = new_lat
-                    df.at[index, 'Lon3'] = new_lon
-
-        df.dropna(subset=['Lat1', 'Lon1'], inplace=True)
-        df.drop(['Lat1', 'Lon1'], axis=1, inplace=True)
+        survey = self.process_survey(Survey.read(file_path, ANMORG_FIELDS))
 
-        new_df = df.copy().reset_index()
-        new_df['Year'] = new_df['DateTime'].dt.year
-        new_df['Month'] = new_df['DateTime'].dt.month
-        new_df['Day'] = new_df['DateTime'].dt.day
-        new_df['Hour'] = new_df['DateTime'].dt.hour
-        new_df['Minute'] = new_df['DateTime'].dt.minute
-        new_df['Second'] = new_df['DateTime'].dt.second
-
-        new_df['Latitude'] = new_df['Lat3']
-        new_df['Longitude'] = new_df['Lon3']
-
-        new_df['Latitude'] = new_df['Latitude'].map('{:2.8f}'.format)
-        new_df['Longitude'] = new_df['Longitude'].map('{:3.8f}'.format)
-        new_df['Tmag'] = new_df['Tmag'].map('{:5.3f}'.format)
-
-        for col in ['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second']:
-            new_df[col] = new_df[col].map(lambda x: f"{x:02d}" if col != 'Year' else f"{x:4d}")
-
-        new_df.drop(['DateTime', 'Lat3', 'Lon3'], axis=1, inplace=True)
-
-        output_filename = file_path.with_suffix('.anmorg.anm_cc')
-        new_df.to_csv(output_filename, sep=' ', index=False, header=False)
+        output_filename = text_path(self.output_path(file_path))
+        fields = subsecond(ANM_CC_FIELDS) if self.full_rate else ANM_CC_FIELDS
+        output_filename = survey.write(output_filename, fields, binary=self.binary, stage="anm_cc",
+                                       meta={"source": text_path(file_path).name})
         print(f"Saved to: {output_filename}")
 
-        return df  # return original df with Lat3/Lon3 for optional plotting
+        # original (GPS) and modified (sensor) positions for optional plotting
+        df = survey.to_frame().set_index('DateTime')
+        df['Lat3'], df['Lon3'] = df['Latitude'], df['Longitude']
+        df['Latitude'], df['Longitude'] = df.pop('gps_lat'), df.pop('gps_lon')
+        return df
+
+    def output_path(self, file_path):
+        output_filename = text_path(file_path).with_suffix('.anmorg.anm_cc')
+        return columnar_path(output_filename) if self.binary else output_filename
+
+    def process_survey(self, survey: Survey) -> Survey:
+        # Move each position wire_len behind the ship along the heading towards the
+        # fix `steps` samples ahead; the last `steps` samples of each segment are dropped.
+        # layback="along_track": wire_len back along the sailed track instead; samples closer
+        # than wire_len to the start of their segment are dropped.
+        # Samples without a finite position are dropped first, in both modes.
+        located = np.isfinite(survey.lat) & np.isfinite(survey.lon)
+        if not located.all():
+            print(f"> Dropped {int((~located).sum()):,} samples without a finite position")
+            survey = survey.take(located)
+        if self.layback_mode == "along_track":
+            correct = self._correct_along_track  # works on every sample, full rate or not
+        else:
+            correct = self._correct_full_rate if self.full_rate else self._correct_segment
+        parts = [correct(segment) for segment in survey.segments()]
+        if not parts:  # empty survey
+            parts = [survey.with_columns(gps_lat=survey.lat, gps_lon=survey.lon)]
+        return Survey.concat(parts).with_step("anm_cc", wire_len_km=self.wire_len, steps=self.steps,
+                                              full_rate=self.full_rate, layback=self.layback_mode)
+
+    def _correct_full_rate(self, survey):
+        minute = survey.time // (60 * 10**9)
+        first = np.flatnonzero(np.diff(minute, prepend=minute[0] - 1))
+        ticks = self._correct_segment(survey.take(first))
+        if not len(ticks):
+            return ticks
+        # samples after the last corrected minute have no look-ahead, as in 1-min mode
+        part = survey.take(survey.time <= ticks.time[-1])
+        t, t_ticks = part.time - ticks.time[0], ticks.time - ticks.time[0]
+        dlat = ticks.lat - ticks.extra['gps_lat']
+        dlon = (ticks.lon - ticks.extra['gps_lon'] + 180) % 360 - 180
+        lon = part.lon + np.interp(t, t_ticks, dlon)
+        lon = np.where(lon > 180, lon - 360, np.where(lon < -180, lon + 360, lon))
+        return part.replace(lat=part.lat + np.interp(t, t_ticks, dlat), lon=lon) \
+            .with_columns(gps_lat=part.lat, gps_lon=part.lon)
+
+    def _correct_segment(self, survey):
+        # whole segment at once: bearing to the fix `steps` ahead, then wire_len back along it
+        lat, lon = survey.lat.astype(np.float64), survey.lon.astype(np.float64)
+        n = max(len(lat) - self.steps, 0)
+        keep = np.arange(len(lat)) < n
+        lat3, lon3 = self.layback(lat[keep], lon[keep], lat[self.steps:], lon[self.steps:])
+        return survey.take(keep).replace(lat=lat3, lon=lon3) \
+            .with_columns(gps_lat=survey.lat[keep], gps_lon=survey.lon[keep])
+
+    def _correct_along_track(self, survey):
+        # cumulative sailed distance s; the sensor of a fix at s is at s - wire_len on the
+        # track, found by binary search and placed along the geodesic of that track leg
+        lat, lon = survey.lat.astype(np.float64), survey.lon.astype(np.float64)
+        leg, azimuth, _ = inverse(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        along = np.concatenate([[0.0], np.cumsum(leg)])
+        target = along - self.wire_len * 1000
+
+        keep = (target >= 0) & (len(lat) > 1)  # a full wire length of track already sailed
+        start = np.minimum(np.searchsorted(along, target[keep], side='right') - 1, len(leg) - 1)
+        lat3, lon3, _ = direct(lat[start], lon[start], azimuth[start], target[keep] - along[start])
+        return survey.take(keep).replace(lat=lat3, lon=lon3) \
+            .with_columns(gps_lat=survey.lat[keep], gps_lon=survey.lon[keep])
 
     def plot_preview(self, df, file_name, n=20, outdir=None):
+        if is_headless():
+            return
+        import matplotlib.pyplot as plt
+
         df_subset = df.iloc[:n]
 
         plt.figure(figsize=(10, 8))
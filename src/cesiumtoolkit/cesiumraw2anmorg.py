@@ -1,72 +1,174 @@
 from pathlib import Path
-import pandas as pd
+import io
+import time
 import numpy as np
+import pandas as pd
+
+from .batchconvert import convert_many, print_summary
+from .columnar import ColumnarWriter, columnar_path
+from .manifest import manifest_step
+from .fixedwidth import RAW_ANMORG_FIELDS, format_block
+from .survey import Survey
+from .timeindex import window_bytes
+
+# only these columns of the G-880 export are needed for .anmorg
+G880_COLUMNS = ["DATE", "TIME", "POS_1_Y", "POS_1_X", "G-880_1"]
+
 
 class CESIUMRAW2ANMORG:
-    def __init__(self, input_dir: str, output_dir: str = None, output_ext: str = ".txt.anmorg", file_ext: str = ".txt"):
+    def __init__(self, input_dir: str, output_dir: str = None, output_ext: str = ".txt.anmorg", file_ext: str = ".txt",
+                 chunksize: int = 500_000, binary: bool = False, manifest=None, time_window=None):
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir) if output_dir else self.input_dir
         self.output_ext = output_ext
         self.file_ext = file_ext
+        self.chunksize = chunksize  # rows per streamed chunk; bounds peak memory
+        self.binary = binary        # write a columnar .anmc intermediate instead of ASCII
+        self.manifest = manifest    # BuildManifest: skip files whose output is up to date
+        self.time_window = time_window  # (start, end): convert only this span, via the .tidx index
 
-    def convert_all(self, start_number: int = 1):
+    def convert_all(self, start_number: int = 1, jobs: int | None = 1):
+        # jobs > 1 converts files in a process pool; None/0 uses every core
         files = sorted(self.input_dir.glob(f"*{self.file_ext}"))
         if not files:
             print("!! No input files found.")
-            return
+            return []
+
+        pairs = [(old_file, self.output_dir / f"{old_file.stem}_{idx:02d}{self.output_ext}")
+                 for idx, old_file in enumerate(files, start=start_number)]
+        if self.binary:
+            pairs = [(old_file, columnar_path(new_path)) for old_file, new_path in pairs]
+        print(f"> Converting {len(pairs)} file(s) to {self.output_ext}")
 
-        for idx, old_file in enumerate(files, start=start_number):
-            new_name = f"{old_file.stem}_{idx:02d}{self.output_ext}"
-            new_path = self.output_dir / new_name
-            print(f"> Converting {old_file.name} to {new_name}")
+        steps = {old_file: manifest_step(self.manifest, "anmorg", [old_file], code=__file__,
+                                         params={"output": new_path.name, "binary": self.binary,
+                                                 "time_window": self.time_window})
+                 for old_file, new_path in pairs}
+        todo = [(old_file, new_path) for old_file, new_path in pairs if not steps[old_file].fresh]
+        for old_file, new_path in pairs:
+            if steps[old_file].fresh:
+                print(f"> Up to date, skipped: {new_path.name}")
 
-            self.convert_file(old_file, new_path)
-            if new_path.exists():
-                print(f"> Preview of {new_name}")
-                print(new_path.read_text().splitlines()[:5])
-            else:
-                print(f"!! File {new_name} was not created.")
+        t0 = time.perf_counter()
+        results = convert_many(self, todo, jobs=jobs)
+        for result in results:
+            if result["status"] == "ok":
+                steps[result["input"]].done([result["output"]])
+        print_summary(results, time.perf_counter() - t0, jobs)
+
+        for result in results:
+            if result["status"] == "ok" and not self.binary:
+                print(f"> Preview of {result['output'].name}")
+                with open(result["output"]) as f:
+                    print([line.rstrip("\n") for _, line in zip(range(5), f)])
+        return results
 
     def convert_file(self, input_path: Path, output_path: Path):
+        # Stream the export in chunks: read with the C engine, keep only the
+        # five needed columns, and append each formatted chunk to a temporary
+        # file which replaces output_path once the whole input has been read
+        # (or to a columnar .anmc file when binary=True).
+        input_path, output_path = Path(input_path), Path(output_path)
+        tmp_path = output_path.with_name(output_path.name + ".part")
+        t0 = time.perf_counter()
+        n_rows = 0
+
         try:
-            df = pd.read_csv(input_path, sep=r"\s+", engine="python")
+            reader = self.open_reader(input_path)
         except Exception as e:
             print(f"XXX Failed to read {input_path.name}: {e}")
-            return
-
-        if df.empty:
-            print(f"!! Skipped {input_path.name} (empty after read)")
-            return
+            return None
 
         try:
-            dt = pd.to_datetime(df["DATE"] + " " + df["TIME"], format="%m/%d/%y %H:%M:%S.%f")
-
-            out_df = pd.DataFrame({
-                "year": dt.dt.year.astype(str).str.zfill(4),
-                "month": dt.dt.month.astype(str).str.zfill(2),
-                "day": dt.dt.day.astype(str).str.zfill(2),
-                "hour": dt.dt.hour.astype(str).str.zfill(2),
-                "minute": dt.dt.minute.astype(str).str.zfill(2),
-                "second": dt.dt.second + dt.dt.microsecond / 1e6,
-                "lat": df["POS_1_Y"],
-                "lon": df["POS_1_X"],
-                "mag": df["G-880_1"],
-            })
-
-            # numpy vectorize
-            lines = np.char.add.reduce([
-                out_df["year"] + " ",
-                out_df["month"] + " ",
-                out_df["day"] + " ",
-                out_df["hour"] + " ",
-                out_df["minute"] + " ",
-                out_df["second"].map(lambda x: f"{x:.3f}") + " ",
-                out_df["lat"].map(lambda x: f"{x:.7f}") + " ",
-                out_df["lon"].map(lambda x: f"{x:.7f}") + " ",
-                out_df["mag"].map(lambda x: f"{x:.6f}")
-            ], axis=0)
-
-            output_path.write_text("\n".join(lines) + "\n")
-
+            with reader:
+                if self.binary:
+                    output_path = columnar_path(output_path)
+                    meta = {"source": input_path.name}
+                    with ColumnarWriter(output_path, stage="anmorg", meta=meta) as writer:
+                        for chunk in reader:
+                            chunk, dt = self.window_filter(chunk, self.chunk_times(chunk))
+                            writer.append(self.chunk_columns(chunk, dt))
+                            n_rows += len(chunk)
+                else:
+                    with open(tmp_path, "wb") as f:
+                        for chunk in reader:
+                            chunk, dt = self.window_filter(chunk, self.chunk_times(chunk))
+                            if chunk.empty:
+                                continue
+                            f.write(self.format_chunk(chunk, dt))
+                            n_rows += len(chunk)
         except Exception as e:
+            tmp_path.unlink(missing_ok=True)
             print(f"XXX Error while processing {input_path.name}: {e}")
+            return None
+
+        if n_rows == 0:
+            (output_path if self.binary else tmp_path).unlink(missing_ok=True)
+            print(f"!! Skipped {input_path.name} (empty after read)")
+            return None
+
+        if not self.binary:
+            tmp_path.replace(output_path)
+        elapsed = time.perf_counter() - t0
+        print(f"> {input_path.name}: {n_rows:,} rows in {elapsed:.2f} s "
+              f"({n_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+        return n_rows
+
+    def load_survey(self, input_path: Path) -> Survey:
+        # Whole export as an in-memory Survey (same columns as the .anmorg output)
+        input_path = Path(input_path)
+        with self.open_reader(input_path) as reader:
+            parts = [self.chunk_columns(*self.window_filter(chunk, self.chunk_times(chunk)))
+                     for chunk in reader]
+        columns = {name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0)
+                   for name in ("time", "Latitude", "Longitude", "Tmag")}
+        return Survey(time=columns["time"], lat=columns["Latitude"], lon=columns["Longitude"],
+                      field=columns["Tmag"], name=input_path.name,
+                      provenance=[{"stage": "anmorg", "source": input_path.name}])
+
+    def open_reader(self, input_path: Path):
+        if self.time_window is not None:  # seek to the window instead of reading the whole log
+            input_path = io.BytesIO(window_bytes(input_path, *self.time_window))
+        return pd.read_csv(input_path, sep=r"\s+", engine="c", usecols=G880_COLUMNS,
+                           dtype={"DATE": str, "TIME": str}, float_precision="round_trip",
+                           chunksize=self.chunksize)
+
+    def chunk_times(self, df) -> pd.DatetimeIndex:
+        # DATE/TIME of a chunk, parsed once and handed on to window_filter and the writers
+        return pd.DatetimeIndex(pd.to_datetime(df["DATE"] + " " + df["TIME"], format="%m/%d/%y %H:%M:%S.%f"))
+
+    def window_filter(self, df, dt):
+        """Rows of *df* (and their times *dt*) inside ``time_window``."""
+        if self.time_window is None:
+            return df, dt
+        start, end = self.time_window
+        keep = np.ones(len(df), dtype=bool)
+        if start is not None:
+            keep &= dt >= pd.Timestamp(start)
+        if end is not None:
+            keep &= dt <= pd.Timestamp(end)
+        return df[keep], dt[keep]
+
+    def chunk_columns(self, df, dt=None):
+        dt = self.chunk_times(df) if dt is None else dt
+        return {
+            "time": dt.as_unit("ns").asi8,
+            "Latitude": df["POS_1_Y"].to_numpy(dtype=float),
+            "Longitude": df["POS_1_X"].to_numpy(dtype=float),
+            "Tmag": df["G-880_1"].to_numpy(dtype=float),
+        }
+
+    def format_chunk(self, df, dt=None):
+        dt = self.chunk_times(df) if dt is None else dt
+
+        return format_block({
+            "Year": dt.year,
+            "Month": dt.month,
+            "Day": dt.day,
+            "Hour": dt.hour,
+            "Minute": dt.minute,
+            "Second": dt.second + dt.microsecond / 1e6,
+            "Latitude": df["POS_1_Y"],
+            "Longitude": df["POS_1_X"],
+            "Tmag": df["G-880_1"],
+        }, RAW_ANMORG_FIELDS)
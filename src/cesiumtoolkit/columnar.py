@@ -0,0 +1,247 @@
+"""
+columnar.py — Binary columnar intermediate format for the stages between raw logs and ``.trk``.
+
+A ``*.anmc`` file sits next to (and is named after) the ASCII file it replaces,
+e.g. ``foo_01.1min.anmorg.anm_cc.anmc``.  Layout::
+
+    b"ANMCOL1\\n" | uint64 header length | JSON header | 64-byte aligned columns
+
+The header records the stage, row count, per-column dtype/offset and free
+metadata (source file, stage parameters).  Columns are raw little-endian
+arrays, so :func:`read_columnar` returns read-only memory maps.  Time is
+stored as ``time``: int64 nanoseconds since 1970-01-01 UTC; values are
+float64 and use the same names as the fixed-width fields
+(``Latitude``, ``Longitude``, ``Tmag``, ``anm`` ...).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+from typing import Mapping
+
+import numpy as np
+import pandas as pd
+
+from .fixedwidth import write_fixed_width
+
+
+__all__ = [
+    "SUFFIX",
+    "ColumnarWriter",
+    "write_columnar",
+    "read_columnar",
+    "is_columnar",
+    "columnar_path",
+    "text_path",
+    "find_stage_files",
+    "read_stage",
+    "write_stage",
+]
+
+SUFFIX = ".anmc"
+MAGIC = b"ANMCOL1\n"
+_ALIGN = 64
+TIME_PARTS = ["Year", "Month", "Day", "Hour", "Minute", "Second"]
+
+
+def is_columnar(path: str | Path) -> bool:
+    return Path(path).suffix == SUFFIX
+
+
+def columnar_path(path: str | Path) -> Path:
+    """``foo.anm_cc`` → ``foo.anm_cc.anmc`` (unchanged if already columnar)."""
+    path = Path(path)
+    return path if is_columnar(path) else path.with_name(path.name + SUFFIX)
+
+
+def text_path(path: str | Path) -> Path:
+    """``foo.anm_cc.anmc`` → ``foo.anm_cc``; used to derive the next stage's name."""
+    path = Path(path)
+    return path.with_suffix("") if is_columnar(path) else path
+
+
+def find_stage_files(directory: str | Path, pattern: str, recursive: bool = False) -> list[Path]:
+    """
+    Glob *pattern* (e.g. ``"*.anm_cc"``) and its columnar twin in *directory*.
+
+    When both ``foo.anm_cc`` and ``foo.anm_cc.anmc`` exist the newer one is
+    returned, so switching ``binary`` on or off never picks up stale output.
+    """
+    directory = Path(directory)
+    glob = directory.rglob if recursive else directory.glob
+    found: dict[Path, Path] = {}
+    for path in list(glob(pattern)) + list(glob(pattern + SUFFIX)):
+        key = text_path(path)
+        if key not in found or path.stat().st_mtime > found[key].stat().st_mtime:
+            found[key] = path
+    return [found[key] for key in sorted(found)]
+
+
+class ColumnarWriter:
+    """
+    Build a columnar file from row blocks without holding all rows in memory.
+
+    Each column is spooled to its own temporary file by :meth:`append` and
+    the final file is assembled by :meth:`close`.  Use as a context manager;
+    on error the partial output is discarded.
+    """
+
+    def __init__(self, path: str | Path, stage: str, meta: Mapping | None = None) -> None:
+        self.path = Path(path)
+        self.stage = stage
+        self.meta = dict(meta or {})
+        self.nrows = 0
+        self._dtypes: dict[str, np.dtype] = {}
+        self._spool = tempfile.TemporaryDirectory(dir=self.path.parent, prefix=".anmc-")
+        self._files: dict[str, object] = {}
+
+    def append(self, columns: Mapping[str, np.ndarray]) -> None:
+        columns = {name: np.ascontiguousarray(values) for name, values in columns.items()}
+        if not self._dtypes:
+            for name, values in columns.items():
+                self._dtypes[name] = values.dtype.newbyteorder("<")
+                self._files[name] = open(Path(self._spool.name) / f"{len(self._files)}.bin", "wb")
+        if set(columns) != set(self._dtypes):
+            raise ValueError(f"columns {sorted(columns)} do not match {sorted(self._dtypes)}")
+        lengths = {len(v) for v in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("all columns must have the same length")
+        for name, values in columns.items():
+            self._files[name].write(values.astype(self._dtypes[name], copy=False).tobytes())
+        self.nrows += lengths.pop() if lengths else 0
+
+    def close(self) -> Path:
+        for fh in self._files.values():
+            fh.close()
+        layout, offset = [], 0
+        for name, dtype in self._dtypes.items():
+            layout.append({"name": name, "dtype": dtype.str, "offset": offset})
+            offset += _aligned(self.nrows * dtype.itemsize)
+        header = json.dumps({"stage": self.stage, "nrows": self.nrows,
+                             "columns": layout, "meta": self.meta}).encode("utf-8")
+        data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+        tmp = self.path.with_name(self.path.name + ".part")
+        with open(tmp, "wb") as out:
+            out.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for col in layout:
+                out.seek(data_start + col["offset"])
+                with open(self._files[col["name"]].name, "rb") as src:
+                    shutil.copyfileobj(src, out, 16 << 20)
+            out.truncate(data_start + offset)
+        os.replace(tmp, self.path)
+        self._spool.cleanup()
+        return self.path
+
+    def abort(self) -> None:
+        for fh in self._files.values():
+            fh.close()
+        self._spool.cleanup()
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _aligned(n: int) -> int:
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def write_columnar(path: str | Path, columns: Mapping[str, np.ndarray], stage: str,
+                   meta: Mapping | None = None) -> Path:
+    """Write all *columns* (equal-length arrays) to *path* in one go."""
+    with ColumnarWriter(path, stage, meta) as writer:
+        writer.append(columns)
+    return writer.path
+
+
+def read_columnar(path: str | Path, mmap: bool = True) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Read a columnar file.
+
+    Returns
+    -------
+    columns : dict of str to ndarray
+        Read-only memory maps (or in-memory copies with ``mmap=False``).
+    header : dict
+        ``stage``, ``nrows``, ``columns`` layout and ``meta``.
+    """
+    path = Path(path)
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a columnar ({SUFFIX}) file")
+        (header_len,) = struct.unpack("<Q", fh.read(8))
+        header = json.loads(fh.read(header_len))
+    data_start = _aligned(len(MAGIC) + 8 + header_len)
+    nrows = header["nrows"]
+
+    columns = {}
+    for col in header["columns"]:
+        dtype = np.dtype(col["dtype"])
+        if nrows == 0:
+            columns[col["name"]] = np.empty(0, dtype=dtype)
+        elif mmap:
+            columns[col["name"]] = np.memmap(path, dtype=dtype, mode="r",
+                                             offset=data_start + col["offset"], shape=(nrows,))
+        else:
+            columns[col["name"]] = np.fromfile(path, dtype=dtype, count=nrows,
+                                               offset=data_start + col["offset"])
+    return columns, header
+
+
+def read_stage(path: str | Path, fields) -> pd.DataFrame:
+    """
+    Read an intermediate stage file, ASCII or columnar.
+
+    Returns a DataFrame with a ``DateTime`` column followed by the value
+    columns of *fields* (the six time parts of the ASCII layout are folded
+    into ``DateTime``).
+    """
+    if is_columnar(path):
+        columns, _ = read_columnar(path)
+        df = pd.DataFrame({"DateTime": pd.to_datetime(np.asarray(columns["time"]), unit="ns")})
+        for field in fields:
+            if field.name in columns:
+                df[field.name] = np.asarray(columns[field.name])
+        return df
+
+    names = [field.name for field in fields]
+    df = pd.read_csv(path, sep=r"\s+", header=None, names=names)
+    df.insert(0, "DateTime", pd.to_datetime(df[TIME_PARTS]))
+    return df.drop(columns=TIME_PARTS)
+
+
+def write_stage(path: str | Path, df: pd.DataFrame, fields, *, binary: bool = False,
+                stage: str = "", meta: Mapping | None = None) -> Path:
+    """
+    Write *df* (``DateTime`` plus value columns) as the ASCII layout *fields*,
+    or as ``path + ".anmc"`` when *binary* is true.  Returns the written path.
+    """
+    dt = pd.DatetimeIndex(df["DateTime"]).as_unit("ns")
+    values = [field.name for field in fields if field.name not in TIME_PARTS]
+    if binary:
+        columns = {"time": dt.asi8}
+        columns.update({name: np.asarray(df[name], dtype=np.int64 if pd.api.types.is_integer_dtype(df[name])
+                                         else np.float64) for name in values})
+        return write_columnar(columnar_path(path), columns, stage, meta)
+
+    second = next(field for field in fields if field.name == "Second")
+    if second.precision is not None and second.precision < 9:
+        dt = dt.round(pd.Timedelta(10 ** (9 - second.precision), "ns"))  # "59.9996" → next minute, not "60.000"
+    columns = {
+        "Year": dt.year, "Month": dt.month, "Day": dt.day, "Hour": dt.hour, "Minute": dt.minute,
+        "Second": dt.second if second.precision is None else dt.second + dt.microsecond / 1e6,
+    }
+    columns.update({name: df[name] for name in values})
+    write_fixed_width(path, columns, fields)
+    return Path(path)
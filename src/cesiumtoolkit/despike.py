@@ -0,0 +1,260 @@
+"""
+despike.py — Streaming rolling-window despiking for full-rate magnetometer samples.
+
+A :class:`Despiker` runs one or more filters in sequence, each seeing only
+the samples the previous one kept.  Every filter judges a sample from a
+fixed window of neighbouring samples, so the work is linear in the number
+of samples and independent of how the data are chunked: feeding a log in
+pieces (:meth:`Despiker.feed` / :meth:`Despiker.flush`) gives the same
+mask as one call on the whole array.
+
+Filters:
+
+* :class:`HampelFilter` — reject ``|y - median| > n_sigma * 1.4826 * MAD``
+  (running median and running MAD of the deviations).
+* :class:`RollingMedianFilter` — reject ``|y - median| >= threshold`` nT.
+* :class:`WindowedSplineFilter` — the ``ANMORG1MIN`` spline test
+  (``UnivariateSpline``, reject ``>= threshold`` nT) fitted on
+  fixed-length blocks instead of a whole 100k-row batch.
+
+Windows are counted in samples (e.g. ``window=51`` ≈ 5 s of 10 Hz data).
+"""
+
+from __future__ import annotations
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import LSQUnivariateSpline, UnivariateSpline
+
+from .survey import Survey
+
+
+__all__ = ["HampelFilter", "RollingMedianFilter", "WindowedSplineFilter", "Despiker"]
+
+
+def _rolling_median(y: np.ndarray, window: int) -> np.ndarray:
+    # centred; truncated windows at the ends
+    return pd.Series(y).rolling(window, center=True, min_periods=1).median().to_numpy()
+
+
+class RollingMedianFilter:
+    """Reject samples ``threshold`` nT or more away from the centred running median."""
+
+    name = "median"
+
+    def __init__(self, window: int = 11, threshold: float = 100.0) -> None:
+        self.window = window | 1  # odd, so the window is centred
+        self.threshold = threshold
+
+    @property
+    def context(self) -> int:
+        """Samples on each side that influence one decision."""
+        return self.window // 2
+
+    def mask(self, y: np.ndarray, start: int = 0) -> np.ndarray:
+        """Boolean keep-mask of *y* (*start* is the position of ``y[0]`` in the stream)."""
+        return np.abs(y - _rolling_median(y, self.window)) < self.threshold
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(window={self.window}, threshold={self.threshold})"
+
+
+class HampelFilter(RollingMedianFilter):
+    """
+    Hampel identifier: reject samples more than ``n_sigma`` robust standard
+    deviations (``1.4826 * MAD``) from the running median.  *min_delta* [nT]
+    keeps quiet stretches, where the MAD is ~0, from losing ordinary noise.
+    """
+
+    name = "hampel"
+
+    def __init__(self, window: int = 11, n_sigma: float = 3.0, min_delta: float = 1.0) -> None:
+        super().__init__(window)
+        self.n_sigma = n_sigma
+        self.min_delta = min_delta
+
+    @property
+    def context(self) -> int:
+        return 2 * (self.window // 2)  # the MAD window spans deviations from other medians
+
+    def mask(self, y: np.ndarray, start: int = 0) -> np.ndarray:
+        deviation = np.abs(y - _rolling_median(y, self.window))
+        mad = _rolling_median(deviation, self.window)
+        return deviation <= np.maximum(self.n_sigma * 1.4826 * mad, self.min_delta)
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(window={self.window}, n_sigma={self.n_sigma}, "
+                f"min_delta={self.min_delta})")
+
+
+class WindowedSplineFilter:
+    """
+    Cubic spline fitted per block of *window* samples (plus *window* // 2
+    samples of padding on each side); samples ``threshold`` nT or more from
+    the fit are rejected.  Blocks are aligned to the stream position, so the
+    result does not depend on chunking.
+
+    By default the spline is a least-squares fit with a knot every
+    *knot_spacing* samples, refitted once without the samples the first
+    fit rejected, so a spike cannot pull the curve onto itself.  Passing
+    *s* uses ``UnivariateSpline(s=s)`` instead, as ``ANMORG1MIN.spline_filter``
+    does with ``s=0.5``.
+    """
+
+    name = "spline"
+
+    def __init__(self, window: int = 600, threshold: float = 100.0, knot_spacing: int = 20,
+                 s: float | None = None) -> None:
+        self.window = window
+        self.threshold = threshold
+        self.knot_spacing = knot_spacing
+        self.s = s
+
+    @property
+    def context(self) -> int:
+        return self.window + self.window // 2
+
+    def mask(self, y: np.ndarray, start: int = 0) -> np.ndarray:
+        keep = np.ones(len(y), dtype=bool)
+        pad = self.window // 2
+        first = -(start % self.window)  # block boundaries at multiples of window in the stream
+        for lo in range(first, len(y), self.window):
+            a, b = max(lo, 0), min(lo + self.window, len(y))
+            fa, fb = max(lo - pad, 0), min(lo + self.window + pad, len(y))
+            if fb - fa <= 3:  # too short for a cubic spline
+                continue
+            x = np.arange(fa, fb, dtype=np.float64)
+            fit = self._fit(x, y[fa:fb])
+            keep[a:b] = np.abs(y[a:b] - fit[a - fa:b - fa]) < self.threshold
+        return keep
+
+    def _fit(self, x, y):
+        if self.s is not None:
+            with warnings.catch_warnings():  # FITPACK warns when s cannot be met exactly
+                warnings.simplefilter("ignore", UserWarning)
+                return UnivariateSpline(x, y, s=self.s)(x)
+        knots = x[self.knot_spacing:-self.knot_spacing:self.knot_spacing]
+        if len(knots) == 0:
+            return np.full(len(y), np.median(y))
+        fit = LSQUnivariateSpline(x, y, knots)(x)
+        weight = (np.abs(y - fit) < self.threshold).astype(np.float64)
+        if weight.all():
+            return fit
+        try:
+            return LSQUnivariateSpline(x, y, knots, w=weight + 1e-6)(x)
+        except ValueError:  # too few kept samples between knots
+            return fit
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(window={self.window}, threshold={self.threshold}, "
+                f"knot_spacing={self.knot_spacing}, s={self.s})")
+
+
+class _Stage:
+    """One filter applied incrementally: holds ``context`` decided samples plus the undecided tail."""
+
+    def __init__(self, filt) -> None:
+        self.filt = filt
+        self.idx = np.empty(0, dtype=np.int64)
+        self.y = np.empty(0, dtype=np.float64)
+        self.start = 0     # stream position of self.y[0]
+        self.decided = 0   # leading buffered samples already reported
+
+    def feed(self, idx, y, final=False):
+        self.idx = np.concatenate([self.idx, idx])
+        self.y = np.concatenate([self.y, y])
+        context = self.filt.context
+        lo = self.decided
+        hi = len(self.y) if final else max(len(self.y) - context, lo)
+        if hi > lo:
+            keep = self.filt.mask(self.y, start=self.start)[lo:hi]
+        else:
+            keep = np.empty(0, dtype=bool)
+        out = self.idx[lo:hi], self.y[lo:hi], keep
+        cut = max(hi - context, 0)
+        self.idx, self.y = self.idx[cut:], self.y[cut:]
+        self.start += cut
+        self.decided = hi - cut
+        return out
+
+
+class Despiker:
+    """
+    Chain of despiking filters applied to a stream of samples.
+
+    Parameters
+    ----------
+    filters : list, optional
+        Filter objects applied in order (default: ``[HampelFilter()]``).
+
+    Attributes
+    ----------
+    counts : dict
+        Number of samples rejected so far by each filter, keyed by filter name.
+    """
+
+    def __init__(self, filters=None) -> None:
+        self.filters = list(filters) if filters is not None else [HampelFilter()]
+        names = [f.name for f in self.filters]
+        self.names = [name if names.count(name) == 1 else f"{name}{i}" for i, name in enumerate(names, 1)]
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages = [_Stage(f) for f in self.filters]
+        self.counts = dict.fromkeys(self.names, 0)
+        self.n_in = 0
+        self.base = 0  # first sample not yet returned by feed()
+        self.known = np.empty(0, dtype=bool)
+        self.keep = np.empty(0, dtype=bool)
+
+    def feed(self, values, final: bool = False) -> np.ndarray:
+        """
+        Add the next samples; returns the keep-mask of the samples decided
+        so far and not yet returned (an in-order prefix of the stream).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        idx = np.arange(self.n_in, self.n_in + len(values))
+        self.n_in += len(values)
+        self.known = np.concatenate([self.known, np.zeros(len(values), dtype=bool)])
+        self.keep = np.concatenate([self.keep, np.zeros(len(values), dtype=bool)])
+
+        y = values
+        for name, stage in zip(self.names, self.stages):
+            idx, y, keep = stage.feed(idx, y, final)
+            rejected = idx[~keep] - self.base
+            self.known[rejected] = True
+            self.counts[name] += len(rejected)
+            idx, y = idx[keep], y[keep]
+        self.known[idx - self.base] = True
+        self.keep[idx - self.base] = True
+
+        n = len(self.known) if self.known.all() else int(np.argmin(self.known))
+        out = self.keep[:n]
+        self.known, self.keep = self.known[n:], self.keep[n:]
+        self.base += n
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Decide the remaining samples (end of stream)."""
+        return self.feed(np.empty(0), final=True)
+
+    def apply(self, values, chunk_size: int = 1_000_000) -> np.ndarray:
+        """Keep-mask of a whole array, streamed in chunks of *chunk_size* samples."""
+        values = np.asarray(values, dtype=np.float64)
+        self.reset()
+        masks = [self.feed(values[i:i + chunk_size]) for i in range(0, len(values), chunk_size)]
+        masks.append(self.flush())
+        return np.concatenate(masks)
+
+    def report(self) -> str:
+        rejected = ", ".join(f"{name} {count:,}" for name, count in self.counts.items())
+        return f"> Despike: {self.n_in:,} samples, rejected {rejected}"
+
+    def process_survey(self, survey: Survey) -> Survey:
+        """Drop the samples rejected from ``survey.field``; counts go to the provenance."""
+        keep = self.apply(survey.field)
+        print(self.report())
+        return survey.take(keep).with_step("despike", filters=[repr(f) for f in self.filters],
+                                           rejected=dict(self.counts))
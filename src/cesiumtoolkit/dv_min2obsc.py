@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import os
 import re
 from glob import glob
@@ -7,12 +8,31 @@ import numpy as np
 import pandas as pd
 from scipy.signal import medfilt
 from ppigrf import igrf
-import plotly.express as px
+
+from .dvstations import STATIONS_FILE, StationGrid
+from .fixedwidth import OBSC_FIELDS, format_block, write_fixed_width
+from .manifest import manifest_step
+from .obsstore import ObservatoryStore, parse_min_file, read_min_files
+from .preview import DEFAULT_MAX_POINTS, is_headless, line_trace, write_html
+
+REFERENCE_FILE = "output.obsc.json"  # IGRF reference time per station of output.obsc
+_REFILTER = pd.Timedelta("10min")    # end of output.obsc converted again when appending
 
 
 class DVFileReader:
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, store=None, jobs=None, time_window=None, reference=None):
         self.folder_path = folder_path
+        # store: None/False = parse every .min file on each run; True = keep them in the persisted
+        # ObservatoryStore of the folder (only new/changed files are parsed); or an ObservatoryStore
+        self.store = ObservatoryStore(folder_path, jobs=jobs) if store is True else (store or None)
+        self.jobs = jobs  # worker processes for parsing .min files (None = all cores)
+        self.time_window = time_window  # (start, end): only this span of the series (None = all)
+        # reference: time of the station IGRF subtracted from the field, {station: time} or one time for
+        # all; stations without one use the start of their whole record, also when time_window is set,
+        # so that any window gives the dv of a full conversion. The times used end up in .references
+        self.reference = reference
+        self.references = {}
+        self._record_start = {}
 
     def extract_metadata(self, lines):
         lat = lon = elev = None
@@ -28,68 +48,223 @@ class DVFileReader:
         return lat, lon, elev
 
     def read_single_min_file(self, filepath):
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
+        df, meta = parse_min_file(filepath)
+        field = f"{meta['station']}F"
+        return df[["datetime", field]], meta["latitude"], meta["longitude"], meta["elevation"]
 
-        lat, lon, elev = self.extract_metadata(lines)
+    def load_all(self):
+        # dv of the station of the first file: the single-observatory output.obsc
+        station, (df, meta) = next(iter(self.read_series().items()))
+        return self.station_dv(df, station, meta), pd.DataFrame([meta])
 
-        for i, line in enumerate(lines):
-            if line.startswith("DATE"):
-                header_line = i
-                break
-        else:
-            raise ValueError(f"'DATE' line not found in file: {filepath}")
-
-        df = pd.read_csv(
-            filepath,
-            sep=r'\s+',
-            skiprows=header_line + 1,
-            names=lines[header_line].strip().split()
-        )
-        df["datetime"] = pd.to_datetime(df["DATE"] + " " + df["TIME"])
-        df = df[["datetime", "KNYF"]]
-        return df, lat, lon, elev
+    def load_stations(self) -> dict:
+        """dv frame and position of every station in the folder, ``{station: (df, meta)}``."""
+        return {station: (self.station_dv(df, station, meta), meta)
+                for station, (df, meta) in self.read_series(all_stations=True).items()}
 
-    def load_all(self):
-        files = glob(os.path.join(self.folder_path, "*.min"))
-        if not files:
+    def read_series(self, all_stations=False) -> dict:
+        # {station: (df[datetime, <ST>F], meta)} with the station of the first file first
+        files = sorted(glob(os.path.join(self.folder_path, "*.min")))
+        if not files and self.store is None:
             raise FileNotFoundError(f"No .min files found in '{self.folder_path}'")
+        if self.store is not None:
+            return self.load_from_store(files, all_stations)
+
+        parsed = {}
+        for df, meta in read_min_files(files, self.jobs):
+            station = meta["station"]
+            if station not in parsed:
+                if parsed and not all_stations:
+                    continue
+                parsed[station] = ([], {k: meta[k] for k in ("latitude", "longitude", "elevation")})
+            parsed[station][0].append(df[["datetime", f"{station}F"]])
 
-        all_data = []
-        meta_info = None
+        series = {}
+        for station, (frames, meta_info) in parsed.items():
+            df_all = pd.concat(frames, ignore_index=True)
+            df_all.sort_values("datetime", inplace=True)
+            self._record_start[station] = df_all["datetime"].min()
+            series[station] = (self.window(df_all), meta_info)
+        return series
 
-        for f in files:
-            df, lat, lon, elev = self.read_single_min_file(f)
-            all_data.append(df)
-            if meta_info is None:
-                meta_info = {"latitude": lat, "longitude": lon, "elevation": elev}
+    def reference_time(self, station, df_all):
+        if isinstance(self.reference, dict) and station in self.reference:
+            return pd.Timestamp(self.reference[station])
+        if self.reference is not None and not isinstance(self.reference, dict):
+            return pd.Timestamp(self.reference)
+        return self._record_start.get(station, df_all["datetime"].min())
 
-        df_all = pd.concat(all_data, ignore_index=True)
-        df_all.sort_values("datetime", inplace=True)
-        df_all["KNYF_filtered"] = medfilt(df_all["KNYF"], kernel_size=7)
+    def station_dv(self, df_all, station, meta_info):
+        # median-filtered total field minus the IGRF at the station (at the start of the record)
+        field = f"{station}F"
+        df_all[f"{field}_filtered"] = medfilt(df_all[field], kernel_size=7)
 
-        dt = df_all["datetime"].min()
+        dt = self.reference_time(station, df_all)
+        self.references[station] = dt
         lat = meta_info["latitude"]
         lon = meta_info["longitude"]
         h_km = meta_info["elevation"] / 1000.0
-        Be, Bn, Bu = igrf(lon, lat, h_km, dt)
+        Be, Bn, Bu = igrf(lon, lat, h_km, dt)  # one evaluation per station: no IGRFLattice needed
         Btotal = np.sqrt(Be**2 + Bn**2 + Bu**2)
 
-        df_all["dv"] = df_all["KNYF_filtered"] - Btotal
-        return df_all, pd.DataFrame([meta_info])
+        df_all["dv"] = df_all[f"{field}_filtered"] - Btotal
+        if self.time_window is not None:  # drop the median-filter margin
+            df_all = self.window(df_all, margin=pd.Timedelta(0))
+        return df_all
+
+    def window(self, df, margin=pd.Timedelta("10min")):
+        # rows inside time_window, plus `margin` on each side for the median filter
+        if self.time_window is None:
+            return df
+        start, end = self.time_window
+        keep = np.ones(len(df), dtype=bool)
+        if start is not None:
+            keep &= (df["datetime"] >= pd.Timestamp(start) - margin).to_numpy()
+        if end is not None:
+            keep &= (df["datetime"] <= pd.Timestamp(end) + margin).to_numpy()
+        return df[keep]
+
+    def load_from_store(self, files, all_stations=False):
+        # station of the first file (as the metadata of the parse-everything path) first, else the only one
+        self.store.update()
+        stations = self.store.stations()
+        if not stations:
+            raise FileNotFoundError(f"No .min files found in '{self.folder_path}'")
+        first = Path(files[0]).name if files else None
+        station = next((st for st in stations if first in self.store.metadata(st).get("files", {})), stations[0])
+        start, end = self.time_window or (None, None)
+        margin = pd.Timedelta("10min")
+        series = {}
+        for st in [station] + ([s for s in stations if s != station] if all_stations else []):
+            df = self.store.series(st, None if start is None else pd.Timestamp(start) - margin,
+                                   None if end is None else pd.Timestamp(end) + margin)
+            meta = self.store.metadata(st)
+            self._record_start[st] = self.store.span(st)[0]
+            series[st] = (df[["datetime", f"{st}F"]], {k: meta[k] for k in ("latitude", "longitude", "elevation")})
+        return series
+
+
+def _obsc_time(line: bytes) -> int:
+    # time stamp [ns] of an .obsc line ("2024 09 29 23 30   -12.3")
+    year, month, day, hour, minute = (int(x) for x in line.split()[:5])
+    return pd.Timestamp(year=year, month=month, day=day, hour=hour, minute=minute).value
+
+
+def _line_start(fh, pos: int) -> int:
+    # offset of the first line starting at or after byte pos
+    if pos == 0:
+        return 0
+    fh.seek(pos - 1)
+    fh.readline()
+    return fh.tell()
+
+
+def _last_obsc_time(fh, size: int):
+    # time of the last line, from the end of the file only (None for an empty file)
+    fh.seek(max(size - 4096, 0))
+    lines = [line for line in fh.read().splitlines() if len(line.split()) >= 6]
+    return _obsc_time(lines[-1]) if lines else None
+
+
+def _first_obsc_line_at(fh, size: int, time_ns: int) -> int:
+    # offset of the first line with time >= time_ns: binary search over byte offsets of the sorted file
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        fh.seek(_line_start(fh, mid))
+        line = fh.readline()
+        if len(line.split()) < 6 or _obsc_time(line) >= time_ns:
+            hi = mid
+        else:
+            lo = mid + 1
+    return _line_start(fh, lo)
+
+
+def read_reference(path, fh=None):
+    """
+    IGRF reference times ({station: Timestamp}) of the conversion that wrote
+    ``output.obsc`` from the sidecar *path*; without one, the time of the
+    first line of the open ``output.obsc`` *fh* (one time for all stations).
+    """
+    path = Path(path)
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            return {st: pd.Timestamp(t) for st, t in json.load(f)["igrf_reference"].items()}
+    if fh is None:
+        return None
+    fh.seek(0)
+    for line in fh:
+        if len(line.split()) >= 6:
+            return pd.Timestamp(_obsc_time(line))
+    return None
+
+
+def write_reference(path, references):
+    # merged into the existing sidecar: stations not converted this time keep their reference
+    references = {st: pd.Timestamp(t).isoformat() for st, t in references.items()}
+    path = Path(path)
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            references = {**json.load(f)["igrf_reference"], **references}
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"igrf_reference": references}, f, indent=2)
+    os.replace(tmp, path)
+    return path
 
 
 class  DVCONVERT:
-    def __init__(self, input_dir, output_dir=None, start_number=1):
+    def __init__(self, input_dir, output_dir=None, start_number=1, manifest=None,
+                 preview_points=DEFAULT_MAX_POINTS, store=False, jobs=None, time_window=None,
+                 append=False, stations=False):
         self.input_dir = Path(input_dir)
+        self.store = store  # keep parsed .min files in <input_dir>/.obsstore (see DVFileReader)
+        self.jobs = jobs
+        self.time_window = time_window  # (start, end): convert only this span of the observatory series
+        # append: merge new minutes into an existing output.obsc instead of rewriting it; only the lines
+        # from the first new minute on are read back (found by binary search over the sorted file).
+        # The last minutes already written are converted again (their median filter saw the end of the
+        # series), and the IGRF reference times of the first conversion, kept in output.obsc.json, are
+        # reused, so an appended output.obsc equals a full rewrite
+        self.append = append
+        # stations: also write the dv of every station in the folder on a common time grid, with
+        # their positions, to output_stations.anmc for DVCORRECTION(stations=True) (see dvstations)
+        self.stations = stations
+        self.preview_points = preview_points  # cap on points in output_plot.html (None = all)
         self.output_dir = Path(output_dir) if output_dir else self.input_dir
-        self.start_number = start_number
+        self.start_number = start_number  # unused: output.obsc is written directly, without per-day files
+        self.manifest = manifest  # BuildManifest: skip when output.obsc is up to date
 
     def convert(self):
+        min_files = sorted(self.input_dir.glob("*.min"))
+        step = manifest_step(self.manifest, "obsc", min_files, code=__file__,
+                             params={"output_dir": str(self.output_dir),
+                                     "time_window": self.time_window, "append": self.append,
+                                     "stations": self.stations})
+        if min_files and step.fresh:
+            print("> Up to date, skipped: output.obsc")
+            return
+
+        combined_path = self.output_dir / "output.obsc"
+        reference_path = self.output_dir / REFERENCE_FILE
+        last = reference = None
+        if self.append and combined_path.exists():
+            with open(combined_path, "rb") as fh:
+                last = _last_obsc_time(fh, combined_path.stat().st_size)
+                reference = read_reference(reference_path, fh)
+
         # === Load DV data ===
-        reader = DVFileReader(folder_path=self.input_dir)
+        time_window = self.time_window
+        if last is not None and time_window is None:  # only the end of output.obsc and the minutes after it
+            time_window = (pd.Timestamp(last) - _REFILTER, None)
+        reader = DVFileReader(folder_path=self.input_dir, store=self.store, jobs=self.jobs,
+                              time_window=time_window, reference=reference)
         try:
-            df_all, _ = reader.load_all()
+            if self.stations:
+                per_station = reader.load_stations()
+                df_all = next(iter(per_station.values()))[0]
+            else:
+                df_all, _ = reader.load_all()
         except FileNotFoundError:
             print("!! No .min files found in input folder.")
             print("!! Please provide 'output.obsc' in input_dv_dir manually")
@@ -97,64 +272,77 @@ class  DVCONVERT:
             return  # or: raise if you want to force stop
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
-        # === Export individual .obsc files by date ===
-        grouped = df_all.groupby(df_all["datetime"].dt.date)
-        number = self.start_number
-        for date, group in grouped:
-            outfile = self.output_dir / f"{number:02d}.obsc"
-            YY, MM, DD = date.year % 100, date.month, date.day
-            with open(outfile, 'w') as f:
-                for _, row in group.iterrows():
-                    HH, MI, DV = row["datetime"].hour, row["datetime"].minute, row["dv"]
-                    f.write(f"{2000+YY:04d} {MM:02d} {DD:02d} {HH:02d} {MI:02d} {DV:7.1f}\n")
-            print(f"Saved: {outfile}")
-            number += 1
-
-        # === Combine .obsc files ===
-        all_obsc_files = sorted(self.output_dir.glob("*.obsc"))
-        combined_lines = []
-        for file in all_obsc_files:
-            with open(file, "r") as f:
-                combined_lines.extend(f.readlines())
-
-        # Sort by datetime
-        def extract_dt(line):
-            try:
-                return pd.to_datetime(" ".join(line.strip().split()[:5]))
-            except Exception:
-                return pd.NaT
-
-        combined_lines.sort(key=extract_dt)
+        # === Write output.obsc from the sorted minutes in one pass ===
+        df_out = df_all[["datetime", "dv"]].sort_values("datetime", kind="stable")
+        time = df_out["datetime"].to_numpy().astype("datetime64[ns]")
+        columns = {"Year": (time.astype("datetime64[Y]").astype(np.int64) + 1970) % 100 + 2000,
+                   "Month": time.astype("datetime64[M]").astype(np.int64) % 12 + 1,
+                   "Day": (time.astype("datetime64[D]") - time.astype("datetime64[M]")).astype(np.int64) + 1,
+                   "Hour": time.astype("datetime64[h]").astype(np.int64) % 24,
+                   "Minute": time.astype("datetime64[m]").astype(np.int64) % 60,
+                   "dv": df_out["dv"].to_numpy(dtype=np.float64)}
 
-        combined_path = self.output_dir / "output.obsc"
-        if combined_path.exists():
-            print(f"⚠️ Warning: Overwriting existing {combined_path.name}")
-
-        with open(combined_path, "w") as f:
-            f.writelines(combined_lines)
-        print(f"Combined output saved: {combined_path}")
-
-        # === Remove intermediate .obsc files ===
-        for file in all_obsc_files:
-            if file != combined_path:
-                file.unlink()
-        print("Intermediate .obsc files deleted.")
-
-        # === Plot DV time series ===
-        valid_lines = [line for line in combined_lines if len(line.strip().split()) == 6]
-        df_plot = pd.DataFrame(
-            [line.strip().split() for line in valid_lines],
-            columns=["year", "month", "day", "hour", "minute", "dv"]
-        )
-        df_plot[["year", "month", "day", "hour", "minute"]] = df_plot[["year", "month", "day", "hour", "minute"]].astype(int)
-        df_plot["dv"] = df_plot["dv"].astype(float)
-        df_plot["datetime"] = pd.to_datetime(df_plot[["year", "month", "day", "hour", "minute"]])
-
-        fig = px.line(df_plot, x="datetime", y="dv",
-                      title="Combined Diurnal Variation (DV)",
-                      labels={"datetime": "Time", "dv": "DV (nT)"})
-        fig.update_layout(template="plotly_white")
-
-        output_html_path = self.output_dir / "output_plot.html"
-        fig.write_html(str(output_html_path))
+        if last is not None:
+            written = self.merge_into(combined_path, columns, time.view(np.int64))
+            print(f"Appended to {combined_path}: {written:,} minutes")
+        else:
+            if combined_path.exists():
+                print(f"⚠️ Warning: Overwriting existing {combined_path.name}")
+            write_fixed_width(combined_path, columns, OBSC_FIELDS)
+            print(f"Combined output saved: {combined_path} ({len(df_out):,} minutes)")
+        write_reference(reference_path, reader.references)
+        outputs = [combined_path, reference_path]
+
+        if self.stations:
+            grid = StationGrid.from_frames({st: df for st, (df, _) in per_station.items()},
+                                           {st: meta for st, (_, meta) in per_station.items()})
+            grid_path = self.output_dir / STATIONS_FILE
+            if last is not None and grid_path.exists():
+                grid = StationGrid.read(grid_path).merge(grid)
+            outputs.append(grid.write(grid_path))
+            print(f"Station grid saved: {grid_path} ({', '.join(grid.stations)}; {len(grid.time):,} minutes)")
+        step.done(outputs)
+
+        # === Plot DV time series (the minutes written by this run) ===
+        if is_headless():
+            return
+        import plotly.graph_objects as go
+
+        fig = go.Figure(line_trace(df_out["datetime"], df_out["dv"], max_points=self.preview_points,
+                                   name="dv"))
+        fig.update_layout(template="plotly_white", title="Combined Diurnal Variation (DV)",
+                          xaxis_title="Time", yaxis_title="DV (nT)")
+
+        output_html_path = write_html(fig, self.output_dir / "output_plot.html")
         print(f"Interactive plot saved: {output_html_path}")
+
+    def merge_into(self, path, columns, time):
+        """
+        Merge the minutes *columns* (sorted *time* [ns]) into the sorted
+        ``.obsc`` file *path*: lines before the first new minute are left
+        untouched, later ones are read back and merged, new values winning
+        on equal minutes.  Returns the number of new minutes.
+        """
+        if not len(time):
+            return 0
+        with open(path, "rb+") as fh:
+            size = fh.seek(0, os.SEEK_END)
+            offset = _first_obsc_line_at(fh, size, int(time[0]))
+            fh.seek(offset)
+            tail = [line for line in fh.read().splitlines() if len(line.split()) >= 6]
+            if offset == size and size:
+                fh.seek(size - 1)
+                if fh.read(1) != b"\n":  # file without a final newline
+                    fh.write(b"\n")
+                    offset += 1
+            block = format_block(columns, OBSC_FIELDS).splitlines(keepends=True)
+            if tail:
+                old_time = np.array([_obsc_time(line) for line in tail], dtype=np.int64)
+                keep = ~np.isin(old_time, time)
+                lines = [line + b"\n" for line, k in zip(tail, keep) if k] + block
+                order = np.argsort(np.r_[old_time[keep], time], kind="stable")
+                block = [lines[i] for i in order]
+            fh.seek(offset)
+            fh.truncate()
+            fh.writelines(block)
+        return len(time)
@@ -1,24 +1,60 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
+
+from .columnar import find_stage_files, read_columnar, text_path, write_columnar, write_stage
+from .decimate import interval_ns
+from .dvstations import STATIONS_FILE, StationGrid
+from .fixedwidth import ANM_CC_IGRF_DV_FIELDS, ANM_CC_IGRF_FIELDS, TRK_FIELDS, subsecond, write_fixed_width
+from .manifest import manifest_step
+from .preview import DEFAULT_MAX_POINTS, is_headless, line_trace, share_points, write_html
+from .survey import Survey
+
+JOIN_MODES = ("exact", "linear", "nearest")
+
+
+def _run_file(corrector, spool, anm_path):
+    # worker entry point: the observatory index (or station grid) is memory-mapped from a columnar file
+    if corrector.stations:
+        return corrector.process_single_file(anm_path, StationGrid.read(spool))
+    columns, _ = read_columnar(spool)
+    return corrector.process_single_file(anm_path, (columns["time"], columns["dv"]))
+
 
 class DVCORRECTION:
-    def __init__(self, anm_folder: str, obsc_folder: str, output_dir: str = None):
+    def __init__(self, anm_folder: str, obsc_folder: str, output_dir: str = None, binary: bool = False,
+                 manifest=None, full_rate: bool = False, preview_points: int = DEFAULT_MAX_POINTS,
+                 join: str = None, tolerance=None, jobs=None, stations: bool = False, power: float = 2.0):
         self.anm_folder = Path(anm_folder)
+        self.jobs = jobs  # worker processes, one file each (None = all cores)
+        self.preview_points = preview_points  # cap on points in the HTML preview (None = all)
+        # full_rate: keep sub-minute samples and interpolate dv linearly between observatory minutes
+        self.full_rate = full_rate
+        # join: "exact" = samples floored to the minute and matched to observatory minutes (default);
+        # "linear" = dv interpolated at each sample time (default with full_rate); "nearest" = dv of
+        # the closest observatory sample. tolerance ("90s", seconds ...): largest gap between the two
+        # bracketing observatory samples for "linear" (default 1.5x their median spacing), largest
+        # distance to the closest one for "nearest" (default half the median spacing)
+        join = join or ("linear" if full_rate else "exact")
+        if join not in JOIN_MODES:
+            raise ValueError(f"unknown join {join!r}; expected one of {JOIN_MODES}")
+        self.join = join
+        self.tolerance = tolerance
+        self.binary = binary  # write .anm_cc_igrf_dv as a columnar .anmc file (.trk stays ASCII)
+        self.manifest = manifest  # BuildManifest: skip files whose outputs are up to date
         self.obsc_file = Path(obsc_folder) / "output.obsc"
+        # stations: dv from every station of output_stations.anmc (DVCONVERT(stations=True)), joined in
+        # time as above and combined per sample with weights 1/d**power, times exp(-gap/tau) for the
+        # linear/nearest joins (gap to the station's samples, tau the observatory interval; see dvstations)
+        self.stations = stations
+        self.power = power
+        self.dv_file = Path(obsc_folder) / STATIONS_FILE if stations else self.obsc_file
         self.output_dir = Path(output_dir) if output_dir else self.anm_folder
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
-    def load_anm_cc_igrf(self, filepath):
-        df = pd.read_csv(filepath, sep=r'\s+', header=None, names=[
-            "year", "month", "day", "hour", "minute", "second",
-            "lat", "lon", "F_obs", "F_anm"
-        ])
-        df["second"] = 0  # clear secound!!!!
-        df["datetime"] = pd.to_datetime(df[["year", "month", "day", "hour", "minute", "second"]])
-        return df
-
-
     def load_obsc(self):
         df = pd.read_csv(
             self.obsc_file, sep=r"\s+", header=None,
@@ -30,48 +66,202 @@ class DVCORRECTION:
         df = df.drop_duplicates("datetime")                # reset duplication
         return df[["datetime", "dv"]]
 
+    def load_dv(self):
+        """The observatory record: ``load_obsc()``, or the StationGrid with *stations*."""
+        return StationGrid.read(self.dv_file) if self.stations else self.load_obsc()
+
+    @staticmethod
+    def obsc_index(df_dv):
+        """
+        Observatory times [ns, sorted, unique] and dv of *df_dv* (``load_obsc``);
+        pairs pass through, a StationGrid gives its ``times × stations`` values.
+        """
+        if isinstance(df_dv, tuple):
+            return df_dv
+        if isinstance(df_dv, StationGrid):
+            return df_dv.time, df_dv.values
+        dv_time = pd.DatetimeIndex(df_dv["datetime"]).as_unit("ns").asi8
+        order = np.argsort(dv_time, kind="stable")
+        return dv_time[order], df_dv["dv"].to_numpy(dtype=float)[order]
 
     def process_single_file(self, anm_path, df_dv):
-        df_anm = self.load_anm_cc_igrf(anm_path)
-        df_anm      = df_anm.drop_duplicates("datetime") 
-        df_joined   = pd.merge(df_anm, df_dv,
-                        on="datetime", how="inner",
-                        validate="one_to_one") 
-        df_joined["F_last"] = df_joined["F_anm"] - df_joined["dv"]
-        df_joined["unixtime"] = df_joined["datetime"].astype("int64") // 10**9
-
-        output_path = self.output_dir / f"{anm_path.stem}.anm_cc_igrf_dv"
-        with open(output_path, "w") as f:
-            for _, row in df_joined.iterrows():
-                f.write(
-                    f"{int(row.year):04d} {int(row.month):02d} {int(row.day):02d} "
-                    f"{int(row.hour):02d} {int(row.minute):02d} {int(row.second):02d} "
-                    f"{row.lat:.8f} {row.lon:.8f} {row.F_obs:.3f} {row.F_anm:.3f} "
-                    f"{row.dv:.6f} {row.F_last:.3f}\n"
-                )
+        survey = self.process_survey(Survey.read(anm_path, ANM_CC_IGRF_FIELDS), df_dv)
+        df_joined = survey.to_frame().rename(columns={
+            "DateTime": "datetime", "Latitude": "lat", "Longitude": "lon", "Tmag": "F_obs", "anm": "F_anm"})
+        df_joined["unixtime"] = survey.time / 10**9 if self.full_rate else survey.time // 10**9
+        dv_fields, trk_fields = ANM_CC_IGRF_DV_FIELDS, TRK_FIELDS
+        if self.full_rate:
+            dv_fields, trk_fields = subsecond(dv_fields), subsecond(trk_fields)
+
+        output_path = self.output_dir / f"{text_path(anm_path).stem}.anm_cc_igrf_dv"
+        written = write_stage(output_path, pd.DataFrame({
+            "DateTime": df_joined["datetime"],
+            "Latitude": df_joined["lat"], "Longitude": df_joined["lon"],
+            "F_obs": df_joined["F_obs"], "F_anm": df_joined["F_anm"],
+            "dv": df_joined["dv"], "F_last": df_joined["F_last"],
+        }), dv_fields, binary=self.binary, stage="anm_cc_igrf_dv",
+            meta={"source": text_path(anm_path).name, "provenance": survey.provenance})
 
         output_trk = output_path.with_suffix(".trk")
-        with open(output_trk, "w") as f:
-            for _, row in df_joined.iterrows():
-                f.write(f"{int(row.unixtime)} {row.lon:.7f} {row.lat:.7f} {row.F_last:.1f}\n")
-
-        fig = px.line(
-            df_joined,
-            x="datetime",
-            y=["F_obs", "F_last"],
-            title=f"{anm_path.name}: Observed vs. Diurnal Corrected Magnetic Field",
-            labels={"value": "nT", "variable": "Data Type"}
-        )
-        fig.write_html(str(output_path.with_suffix(".html")))
+        write_fixed_width(output_trk, {
+            "unixtime": df_joined["unixtime"], "lon": df_joined["lon"],
+            "lat": df_joined["lat"], "mag": df_joined["F_last"],
+        }, trk_fields)
+
+        if not is_headless():
+            self.plot(df_joined, anm_path, output_path.with_suffix(".html"))
+        return [written, output_trk]
+
+    def plot(self, df_joined, anm_path, html_path):
+        import plotly.graph_objects as go
+
+        fig = go.Figure([
+            line_trace(df_joined["datetime"], df_joined[column], max_points=max_points, name=column)
+            for column, max_points in zip(["F_obs", "F_last"], share_points([len(df_joined)] * 2, self.preview_points))
+        ])
+        fig.update_layout(title=f"{text_path(anm_path).name}: Observed vs. Diurnal Corrected Magnetic Field",
+                          yaxis_title="nT", legend_title_text="Data Type")
+        write_html(fig, html_path)
+
+    def process_survey(self, survey: Survey, df_dv=None) -> Survey:
+        # Times are floored to the minute (first sample per minute kept) and joined
+        # with the observatory variation; samples without a dv value are dropped.
+        if df_dv is None:
+            df_dv = self.load_dv()
+        grid = df_dv if isinstance(df_dv, StationGrid) else None
+        dv_time, dv_value = self.obsc_index(df_dv)
+        if self.join != "exact":
+            return self._join_interpolated(survey, dv_time, dv_value, grid)
+        minute = survey.datetime.floor("min")  # clear secound!!!!
+        keep = ~minute.duplicated()
+        n_samples = len(survey)
+        survey = survey.take(keep).replace(time=minute[keep].asi8)
+
+        pos = np.searchsorted(dv_time, survey.time)
+        hit = pos < len(dv_time)
+        hit[hit] = dv_time[pos[hit]] == survey.time[hit]
+        survey = survey.take(hit)
+        dv_at = np.asarray(dv_value)[pos[hit]]
+        coverage = {"samples": n_samples, "duplicate_minutes": int((~keep).sum()), "no_dv": int((~hit).sum())}
+        print(f"> dv join (exact): {len(survey):,} of {n_samples:,} samples kept; "
+              f"{coverage['duplicate_minutes']:,} repeated minutes, {coverage['no_dv']:,} minutes without dv")
+        if grid is not None:
+            survey, dv_at = self._combine_stations(survey, dv_at, grid, coverage)
+        return survey.with_columns(dv=dv_at, F_last=survey.extra["anm"] - dv_at) \
+            .with_step("anm_cc_igrf_dv", obsc=str(self.obsc_file), join="exact", coverage=coverage)
+
+    def _join_interpolated(self, survey: Survey, dv_time, dv_value, grid=None) -> Survey:
+        # dv at each sample time from a binary search of the sorted observatory times:
+        # linear between the two bracketing samples, or the closest one; samples outside
+        # the record, in observatory gaps or beyond the tolerance are dropped and counted
+        dv_time, dv_value = np.asarray(dv_time), np.asarray(dv_value)
+        n = len(dv_time)
+        step = int(np.median(np.diff(dv_time))) if n > 1 else 60 * 10**9
+
+        hi = np.searchsorted(dv_time, survey.time, side="left")        # first dv sample at/after the sample
+        lo = np.searchsorted(dv_time, survey.time, side="right") - 1   # last one at/before it (== hi on a hit)
+        inside = (lo >= 0) & (hi < n)
+        if self.join == "linear":
+            tolerance = interval_ns(self.tolerance) if self.tolerance is not None else step * 3 // 2
+        else:
+            tolerance = interval_ns(self.tolerance) if self.tolerance is not None else step // 2
+        gap = None
+        if grid is not None:  # each station on its own samples, with the gap to them
+            dv_at, gap = grid.sample(survey.time, self.join, tolerance)
+            keep = ~np.isnan(dv_at).all(axis=1)
+            if self.join == "nearest":
+                inside |= keep
+            survey = survey.take(keep)
+            dv_at, gap = dv_at[keep], gap[keep]
+        elif self.join == "linear":
+            keep = inside.copy()
+            keep[inside] = dv_time[hi[inside]] - dv_time[lo[inside]] <= tolerance
+            survey = survey.take(keep)
+            dv_at = np.interp(survey.time - dv_time[0], dv_time - dv_time[0], dv_value) if n else np.zeros(0)
+        else:
+            before, after = np.clip(lo, 0, max(n - 1, 0)), np.clip(hi, 0, max(n - 1, 0))
+            if n:
+                d_before, d_after = np.abs(survey.time - dv_time[before]), np.abs(dv_time[after] - survey.time)
+                closest = np.where(d_after < d_before, after, before)  # earlier one on ties
+                keep = np.minimum(d_before, d_after) <= tolerance
+            else:
+                closest, keep = lo, np.zeros(len(survey), dtype=bool)
+            inside |= keep  # within tolerance of either end of the record
+            survey = survey.take(keep)
+            dv_at = dv_value[closest[keep]]
+
+        coverage = {"samples": len(keep), "outside_record": int((~inside).sum()),
+                    "in_gaps": int((inside & ~keep).sum()), "tolerance_s": tolerance / 10**9}
+        print(f"> dv join ({self.join}): {len(survey):,} of {len(keep):,} samples kept; "
+              f"{coverage['outside_record']:,} outside the dv record, {coverage['in_gaps']:,} in dv gaps "
+              f"(> {coverage['tolerance_s']:g} s)")
+        if grid is not None:
+            survey, dv_at = self._combine_stations(survey, dv_at, grid, coverage, gap, step)
+        return survey.with_columns(dv=dv_at, F_last=survey.extra["anm"] - dv_at) \
+            .with_step("anm_cc_igrf_dv", obsc=str(self.obsc_file), full_rate=self.full_rate, join=self.join,
+                       coverage=coverage)
+
+    def _combine_stations(self, survey: Survey, dv_at, grid: StationGrid, coverage, gap=None, tau=None):
+        # samples x stations -> one time-and-distance weighted dv per sample (no time term
+        # for the exact join); samples where no station has a value at that time are dropped
+        # and counted
+        dv_at = grid.combine(dv_at, survey.lat, survey.lon, self.power, gap, tau)
+        has = ~np.isnan(dv_at)
+        coverage.update(stations=grid.stations, power=self.power, no_station=int((~has).sum()))
+        weights = f"1/d**{self.power:g}"
+        if gap is not None:
+            coverage["tau_s"] = tau / 10**9
+            weights += f" * exp(-gap/{coverage['tau_s']:g} s)"
+        print(f"> dv stations ({', '.join(grid.stations)}; {weights}): "
+              f"{coverage['no_station']:,} samples without a station value")
+        return survey.take(has), dv_at[has]
 
     def run(self):
-        df_dv = self.load_obsc()
-        anm_files = sorted(self.anm_folder.glob("*.anm_cc_igrf"))
+        anm_files = find_stage_files(self.anm_folder, "*.anm_cc_igrf")
 
         if not anm_files:
             print("No .anm_cc_igrf files found.")
             return
 
+        pending = []
         for anm_file in anm_files:
-            self.process_single_file(anm_file, df_dv)
-            print(f"Processed: {anm_file.name}")
+            step = manifest_step(self.manifest, "anm_cc_igrf_dv", [anm_file, self.dv_file], code=__file__,
+                                 params={"output_dir": str(self.output_dir), "binary": self.binary,
+                                         "full_rate": self.full_rate, "join": self.join,
+                                         "tolerance": self.tolerance, "stations": self.stations,
+                                         "power": self.power})
+            if step.fresh:
+                print(f"> Up to date, skipped: {anm_file.name}")
+                continue
+            pending.append((anm_file, step))
+        if not pending:
+            return
+
+        # the observatory record is parsed, sorted and indexed once for all files
+        dv = self.load_dv()
+        if not self.stations:
+            dv = self.obsc_index(dv)
+        if len(pending) == 1 or self.jobs == 1:
+            for anm_file, step in pending:
+                try:
+                    step.done(self.process_single_file(anm_file, dv))
+                except Exception as e:
+                    print(f"!! Error in DV correction of {anm_file.name}: {e}")
+                    continue
+                print(f"Processed: {anm_file.name}")
+            return
+
+        # workers memory-map one columnar file of the index instead of receiving it pickled per file:
+        # the station grid already is one, a single-station index is spooled
+        with tempfile.TemporaryDirectory(prefix="dvcorrection-") as tmp:
+            spool = self.dv_file if self.stations else write_columnar(
+                Path(tmp) / "obsc.anmc", {"time": dv[0], "dv": dv[1]}, stage="obsc-spool")
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(_run_file, self, str(spool), anm_file) for anm_file, _ in pending]
+                for (anm_file, step), future in zip(pending, futures):
+                    try:
+                        step.done(future.result())
+                    except Exception as e:
+                        print(f"!! Error in DV correction of {anm_file.name}: {e}")
+                        continue
+                    print(f"Processed: {anm_file.name}")
@@ -0,0 +1,174 @@
+"""
+dvstations.py — Diurnal variation from several observatories, weighted by time and distance.
+
+A long cruise passes more than one observatory, and the variation recorded
+at a distant station differs from the one seen at the ship.
+:class:`StationGrid` holds the dv series of several IAGA-2002 stations
+aligned once on a common time grid (one row per observatory minute, NaN
+where a station has no value) together with the station positions; it is
+written by ``DVCONVERT(stations=True)`` to ``<output_dir>/output_stations.anmc``
+(see :mod:`columnar`) and read by ``DVCORRECTION(stations=True)``.
+
+The correction joins each sample to the grid in time (the ``join`` of
+``DVCORRECTION``): "exact" matches the sample minute to a grid row, while
+"linear" and "nearest" (:meth:`StationGrid.sample`) join every station on
+its own samples, linear between its bracketing samples or its closest one,
+and record the gap to the nearer of them.  This gives ``samples × stations``
+matrices of dv values and gaps, which :meth:`StationGrid.combine` reduces
+with time-and-distance weights,
+
+    dv = sum_s w_s * dv_s / sum_s w_s,    w_s = exp(-gap_s / tau) / d_s**power,
+
+where ``d_s`` is the great-circle distance [km] from the sample to station
+*s*, ``gap_s`` the time to the observatory sample the value comes from and
+``tau`` the observatory sampling interval; stations without a value at that
+time get no weight.  The exact join has no gap, so its weights are
+``1 / d_s**power`` alone.  Weights and the weighted sum are computed on
+blocks of samples as array operations.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .columnar import read_columnar, write_columnar
+
+
+__all__ = ["STATIONS_FILE", "StationGrid"]
+
+STATIONS_FILE = "output_stations.anmc"
+_EARTH_RADIUS_KM = 6371.0088  # mean radius; weights need no ellipsoidal accuracy
+_BLOCK = 100_000              # samples per weight block
+_AT_STATION_KM = 1e-3         # closer than this a sample takes the station's dv alone
+
+
+class StationGrid:
+    """
+    dv [nT] of ``stations`` on the common times ``time`` (int64 ns, sorted,
+    unique): ``values[i, s]`` is the dv of station *s* at ``time[i]`` (NaN
+    when it has none); ``lat``/``lon`` are the station positions [deg].
+    """
+
+    def __init__(self, time, values, stations, lat, lon):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.time), len(stations))
+        self.stations = list(stations)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+
+    @classmethod
+    def from_frames(cls, frames, meta) -> "StationGrid":
+        """
+        Grid of the ``datetime``/``dv`` frames in *frames* (station -> frame),
+        with positions from *meta* (station -> ``latitude``, ``longitude`` …).
+        """
+        stations = list(frames)
+        times = [pd.DatetimeIndex(frames[st]["datetime"]).as_unit("ns").asi8 for st in stations]
+        time = np.unique(np.concatenate(times)) if times else np.zeros(0, dtype=np.int64)
+        values = np.full((len(time), len(stations)), np.nan)
+        for s, (st, t) in enumerate(zip(stations, times)):
+            values[np.searchsorted(time, t), s] = frames[st]["dv"].to_numpy(dtype=float)
+        return cls(time, values, stations, [meta[st]["latitude"] for st in stations],
+                   [meta[st]["longitude"] for st in stations])
+
+    @classmethod
+    def read(cls, path) -> "StationGrid":
+        columns, header = read_columnar(path)
+        positions = header["meta"]["stations"]
+        stations = list(positions)
+        values = np.column_stack([columns[st] for st in stations] or [np.zeros((len(columns["time"]), 0))])
+        return cls(columns["time"], values, stations, [positions[st]["latitude"] for st in stations],
+                   [positions[st]["longitude"] for st in stations])
+
+    def write(self, path) -> Path:
+        columns = {"time": self.time}
+        columns.update({st: self.values[:, s] for s, st in enumerate(self.stations)})
+        positions = {st: {"latitude": float(la), "longitude": float(lo)}
+                     for st, la, lo in zip(self.stations, self.lat, self.lon)}
+        return write_columnar(path, columns, stage="obsc-stations", meta={"stations": positions})
+
+    def merge(self, other: "StationGrid") -> "StationGrid":
+        """Union of both grids; values of *other* win where it has them."""
+        stations = self.stations + [st for st in other.stations if st not in self.stations]
+        time = np.union1d(self.time, other.time)
+        values = np.full((len(time), len(stations)), np.nan)
+        lat, lon = np.zeros(len(stations)), np.zeros(len(stations))
+        for grid in (self, other):
+            rows = np.searchsorted(time, grid.time)
+            for s, st in enumerate(grid.stations):
+                k = stations.index(st)
+                have = ~np.isnan(grid.values[:, s])
+                values[rows[have], k] = grid.values[have, s]
+                lat[k], lon[k] = grid.lat[s], grid.lon[s]
+        return StationGrid(time, values, stations, lat, lon)
+
+    def distances(self, lat, lon) -> np.ndarray:
+        """Great-circle distance [km] from each point to each station, ``len(lat) × len(stations)``."""
+        lat1 = np.radians(np.asarray(lat, dtype=np.float64))[:, None]
+        lon1 = np.radians(np.asarray(lon, dtype=np.float64))[:, None]
+        lat2, lon2 = np.radians(self.lat)[None, :], np.radians(self.lon)[None, :]
+        h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * _EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+    def sample(self, time, join, tolerance):
+        """
+        dv of each station at *time* (int64 ns) and the gap [ns] to the nearer
+        of the station samples it comes from, both ``len(time) × stations``.
+        ``join`` is "linear" (between the station's bracketing samples, which
+        may be at most *tolerance* [ns] apart) or "nearest" (its closest
+        sample, at most *tolerance* away); NaN (gap inf) where neither holds.
+        """
+        time = np.asarray(time, dtype=np.int64)
+        dv = np.full((len(time), len(self.stations)), np.nan)
+        gap = np.full(dv.shape, np.inf)
+        for s in range(len(self.stations)):
+            have = ~np.isnan(self.values[:, s])
+            t, v = self.time[have], self.values[have, s]
+            n = len(t)
+            if not n:
+                continue
+            hi = np.searchsorted(t, time, side="left")
+            lo = np.searchsorted(t, time, side="right") - 1
+            before, after = np.clip(lo, 0, n - 1), np.clip(hi, 0, n - 1)
+            d_before, d_after = np.abs(time - t[before]), np.abs(t[after] - time)
+            if join == "linear":
+                ok = (lo >= 0) & (hi < n)
+                ok[ok] = t[hi[ok]] - t[lo[ok]] <= tolerance
+                span = t[after] - t[before]
+                frac = np.divide(time - t[before], span, out=np.zeros(len(time)), where=span > 0)
+                value = v[before] * (1 - frac) + v[after] * frac
+            else:
+                ok = np.minimum(d_before, d_after) <= tolerance
+                value = v[np.where(d_after < d_before, after, before)]  # earlier one on ties
+            dv[ok, s] = value[ok]
+            gap[ok, s] = np.minimum(d_before, d_after)[ok]
+        return dv, gap
+
+    def combine(self, dv, lat, lon, power=2.0, gap=None, tau=None) -> np.ndarray:
+        """
+        Time-and-distance weighted dv at the points ``(lat, lon)`` from the
+        ``points × stations`` matrix *dv*; *gap* (same shape, ns) scales each
+        weight by ``exp(-gap / tau)``, without it the weights are
+        ``1 / d**power``.  NaN where no station has a value.
+        """
+        dv = np.asarray(dv, dtype=np.float64)
+        out = np.full(len(dv), np.nan)
+        for start in range(0, len(dv), _BLOCK):
+            block = slice(start, start + _BLOCK)
+            d = self.distances(np.asarray(lat)[block], np.asarray(lon)[block])
+            valid = ~np.isnan(dv[block])
+            at_station = (d < _AT_STATION_KM) & valid
+            with np.errstate(divide="ignore", invalid="ignore"):
+                w = d ** -float(power)
+                if gap is not None:
+                    w = w * np.exp(-np.asarray(gap, dtype=np.float64)[block] / float(tau))
+            w = np.where(at_station.any(axis=1, keepdims=True), at_station.astype(float), w)
+            w = np.where(valid, w, 0.0)
+            total = w.sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[block] = np.einsum("ij,ij->i", w, np.where(valid, dv[block], 0.0)) / total
+            out[block][total == 0] = np.nan
+        return out
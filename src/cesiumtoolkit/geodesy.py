@@ -0,0 +1,182 @@
+"""
+geodesy.py — Vectorized geodesic inverse and direct problems on the WGS84 ellipsoid.
+
+Vincenty's iterative solutions evaluated on whole NumPy arrays, so that
+``CABLECORRECTION`` moves every fix of a segment in a few array passes
+instead of one ``geographiclib`` / ``geopy`` call per row.  Over the
+distances used here (cable lengths, a few km of track) they agree with
+Karney's algorithms in ``geographiclib`` to well below a millimetre.
+
+Points the iteration does not settle for (coincident or near-antipodal
+pairs) are solved with ``geographiclib`` one by one, so the results,
+including the azimuth conventions for degenerate pairs, are those of
+``Geodesic.WGS84``.
+
+Angles are in degrees, distances in metres.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+__all__ = ["WGS84_A", "WGS84_F", "inverse", "direct"]
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+_B = WGS84_A * (1 - WGS84_F)
+_EP2 = (WGS84_A**2 - _B**2) / _B**2  # second eccentricity squared
+
+_TOL = 1e-12    # convergence of lambda / sigma [rad], ~0.006 mm on the ground
+_MAX_ITER = 200
+
+
+def _wrap180(x):
+    return (np.asarray(x) + 180.0) % 360.0 - 180.0
+
+
+def _flat(*arrays):
+    # broadcast to a common shape and work on 1-d float copies
+    arrays = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in arrays))
+    return arrays[0].shape, [np.array(a, dtype=np.float64).ravel() for a in arrays]
+
+
+def _coefficients(cos2_alpha):
+    u2 = cos2_alpha * _EP2
+    big_a = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    big_b = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    return big_a, big_b
+
+
+def _delta_sigma(big_b, sin_s, cos_s, cos_2sm):
+    return big_b * sin_s * (cos_2sm + big_b / 4 * (
+        cos_s * (-1 + 2 * cos_2sm**2) - big_b / 6 * cos_2sm * (-3 + 4 * sin_s**2) * (-3 + 4 * cos_2sm**2)))
+
+
+def _lambda_correction(cos2_alpha, sin_alpha, sigma, sin_s, cos_s, cos_2sm):
+    c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+    return (1 - c) * WGS84_F * sin_alpha * (sigma + c * sin_s * (cos_2sm + c * cos_s * (-1 + 2 * cos_2sm**2)))
+
+
+def inverse(lat1, lon1, lat2, lon2):
+    """
+    Distance and azimuths of the geodesics between two arrays of points.
+
+    Parameters
+    ----------
+    lat1, lon1, lat2, lon2 : array_like
+        End points [deg]; broadcast against each other.
+
+    Returns
+    -------
+    distance : ndarray
+        Geodesic distance [m].
+    azi1, azi2 : ndarray
+        Forward azimuth at the first and at the second point [deg, -180..180]
+        (``azi1`` / ``azi2`` of ``Geodesic.WGS84.Inverse``).
+
+    NaN inputs give NaN outputs.
+    """
+    shape, (lat1, lon1, lat2, lon2) = _flat(lat1, lon1, lat2, lon2)
+    big_l = np.radians(_wrap180(lon2 - lon1))
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2)
+
+    lam = big_l.copy()
+    pending = np.isfinite(lam) & np.isfinite(u1) & np.isfinite(u2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(_MAX_ITER):
+            sin_l, cos_l = np.sin(lam), np.cos(lam)
+            sin_s = np.hypot(cos_u2 * sin_l, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_l)
+            cos_s = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_l
+            sigma = np.arctan2(sin_s, cos_s)
+            sin_alpha = cos_u1 * cos_u2 * sin_l / sin_s
+            cos2_alpha = 1 - sin_alpha**2
+            # equatorial lines: cos2_alpha = 0 and cos_2sm is irrelevant
+            cos_2sm = np.where(cos2_alpha != 0, cos_s - 2 * sin_u1 * sin_u2 / cos2_alpha, 0.0)
+            lam_next = big_l + _lambda_correction(cos2_alpha, sin_alpha, sigma, sin_s, cos_s, cos_2sm)
+            step = np.abs(lam_next - lam)
+            lam = np.where(pending, lam_next, lam)
+            pending &= ~(step <= _TOL)
+            if not pending.any():
+                break
+
+        big_a, big_b = _coefficients(cos2_alpha)
+        distance = _B * big_a * (sigma - _delta_sigma(big_b, sin_s, cos_s, cos_2sm))
+        azi1 = np.degrees(np.arctan2(cos_u2 * sin_l, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_l))
+        azi2 = np.degrees(np.arctan2(cos_u1 * sin_l, -sin_u1 * cos_u2 + cos_u1 * sin_u2 * cos_l))
+
+    # not converged, or coincident points (sin_s = 0): geographiclib row by row
+    fallback = np.flatnonzero((pending | (sin_s == 0)) & np.isfinite(lat1 + lon1 + lat2 + lon2))
+    if len(fallback):
+        from geographiclib.geodesic import Geodesic
+
+        for i in fallback:
+            g = Geodesic.WGS84.Inverse(lat1[i], lon1[i], lat2[i], lon2[i])
+            distance[i], azi1[i], azi2[i] = g['s12'], g['azi1'], g['azi2']
+    return distance.reshape(shape), azi1.reshape(shape), azi2.reshape(shape)
+
+
+def direct(lat1, lon1, azi1, distance):
+    """
+    End points of geodesics of given start point, azimuth and length.
+
+    Parameters
+    ----------
+    lat1, lon1 : array_like
+        Start points [deg].
+    azi1 : array_like
+        Azimuth at the start point [deg, clockwise from north].
+    distance : array_like
+        Geodesic length [m]; broadcast against the other arguments.
+
+    Returns
+    -------
+    lat2, lon2 : ndarray
+        End points [deg, longitude in -180..180] (``lat2`` / ``lon2`` of
+        ``Geodesic.WGS84.Direct``, as returned by ``geopy``'s ``destination``).
+    azi2 : ndarray
+        Forward azimuth at the end point [deg].
+    """
+    shape, (lat1, lon1, azi1, distance) = _flat(lat1, lon1, azi1, distance)
+    alpha1 = np.radians(azi1)
+    sin_a1, cos_a1 = np.sin(alpha1), np.cos(alpha1)
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sigma1 = np.arctan2(np.tan(u1), cos_a1)
+    sin_alpha = cos_u1 * sin_a1
+    cos2_alpha = 1 - sin_alpha**2
+    big_a, big_b = _coefficients(cos2_alpha)
+
+    sigma0 = distance / (_B * big_a)
+    sigma = sigma0.copy()
+    pending = np.isfinite(sigma) & np.isfinite(sigma1)
+    for _ in range(_MAX_ITER):
+        cos_2sm = np.cos(2 * sigma1 + sigma)
+        sin_s, cos_s = np.sin(sigma), np.cos(sigma)
+        sigma_next = sigma0 + _delta_sigma(big_b, sin_s, cos_s, cos_2sm)
+        step = np.abs(sigma_next - sigma)
+        sigma = np.where(pending, sigma_next, sigma)
+        pending &= ~(step <= _TOL)
+        if not pending.any():
+            break
+    cos_2sm = np.cos(2 * sigma1 + sigma)
+    sin_s, cos_s = np.sin(sigma), np.cos(sigma)
+
+    tmp = sin_u1 * sin_s - cos_u1 * cos_s * cos_a1
+    lat2 = np.degrees(np.arctan2(sin_u1 * cos_s + cos_u1 * sin_s * cos_a1,
+                                 (1 - WGS84_F) * np.hypot(sin_alpha, tmp)))
+    lam = np.arctan2(sin_s * sin_a1, cos_u1 * cos_s - sin_u1 * sin_s * cos_a1)
+    big_l = lam - _lambda_correction(cos2_alpha, sin_alpha, sigma, sin_s, cos_s, cos_2sm)
+    lon2 = _wrap180(lon1 + np.degrees(big_l))
+    azi2 = np.degrees(np.arctan2(sin_alpha, -tmp))
+
+    fallback = np.flatnonzero(pending)
+    if len(fallback):
+        from geographiclib.geodesic import Geodesic
+
+        for i in fallback:
+            g = Geodesic.WGS84.Direct(lat1[i], lon1[i], azi1[i], distance[i])
+            lat2[i], lon2[i], azi2[i] = g['lat2'], _wrap180(g['lon2']), g['azi2']
+    return lat2.reshape(shape), lon2.reshape(shape), azi2.reshape(shape)
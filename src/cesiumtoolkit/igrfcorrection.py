@@ -1,11 +1,18 @@
 import pandas as pd
 import numpy as np
 import datetime
+import functools
 from pathlib import Path
 from tqdm import tqdm
 from ppigrf import igrf
+from ppigrf.ppigrf import read_shc
 from concurrent.futures import ProcessPoolExecutor
 
+from .columnar import find_stage_files, text_path
+from .fixedwidth import ANM_CC_FIELDS, ANM_CC_IGRF_FIELDS, subsecond
+from .manifest import manifest_step
+from .survey import Survey
+
 
 def calc_single_igrf(row_dict, wire_height):
     dt = datetime.datetime(int(row_dict["Year"]), int(row_dict["Month"]), int(row_dict["Day"]),
@@ -15,58 +22,145 @@ def calc_single_igrf(row_dict, wire_height):
     return float(row_dict["Tmag"]) - Bt
 
 
+# rows per ppigrf call: its design matrices take ~10 kB per row
+IGRF_CHUNK = 10000
+
+
+@functools.lru_cache(maxsize=None)
+def _model_epochs():
+    g, _ = read_shc()
+    return pd.DatetimeIndex(g.index).as_unit('ns')
+
+
+def igrf_total(lon, lat, height, time):
+    """
+    IGRF total field [nT] at many points in one pass.
+
+    ppigrf interpolates the Gauss coefficients linearly between the 5-year
+    model epochs, and the field is linear in the coefficients, so the field
+    at time t is the same interpolation of the fields at the two bracketing
+    epochs.  Rows are grouped by epoch interval and each group costs one
+    ``igrf`` call with two dates (in chunks of ``IGRF_CHUNK`` rows) instead
+    of one call per row; results equal ``calc_single_igrf`` (whole seconds,
+    coefficients held after the last epoch) to rounding.
+
+    *time* is in ns since the epoch; *height* in km above the ellipsoid.
+    """
+    lon, lat, time = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64), np.asarray(time)
+    epochs = _model_epochs()
+    nodes = epochs.asi8
+    t = time // 10**9 * 10**9  # calc_single_igrf builds a datetime of whole seconds
+    k = np.clip(np.searchsorted(nodes, t, side='right') - 1, 0, len(nodes) - 2)
+    w = np.clip((t - nodes[k]) / (nodes[k + 1] - nodes[k]), 0.0, 1.0)
+
+    total = np.empty(len(t))
+    for interval in np.unique(k):
+        rows = np.flatnonzero(k == interval)
+        dates = [epochs[interval].to_pydatetime(), epochs[interval + 1].to_pydatetime()]
+        for start in range(0, len(rows), IGRF_CHUNK):
+            chunk = rows[start:start + IGRF_CHUNK]
+            Be, Bn, Bu = (b[0] + w[chunk] * (b[1] - b[0])
+                          for b in igrf(lon[chunk], lat[chunk], height, dates))
+            total[chunk] = np.sqrt(Bn**2 + Be**2 + Bu**2)
+    return total
+
+
 class IGRFCORRECTION:
-    def __init__(self, input_dir: str, wire_height: float = 0.0):
+    def __init__(self, input_dir: str, wire_height: float = 0.0, binary: bool = False, manifest=None,
+                 full_rate: bool = False, jobs=None, lattice_tolerance=None):
         self.input_dir = Path(input_dir)
         self.wire_height = wire_height  # in km
+        self.jobs = jobs  # worker processes for surveys of several IGRF_CHUNK blocks (None = all cores)
+        # lattice_tolerance [nT]: interpolate IGRF from an IGRFLattice over the survey box built to this
+        # max error instead of evaluating the model at every sample; the last lattice is kept in
+        # self.lattice (reused while it covers the next file)
+        self.lattice_tolerance = lattice_tolerance
+        self.lattice = None
+        # full_rate: evaluate IGRF at the first sample of each minute (and the last of each segment)
+        # and interpolate it in time; the ship covers < 1 km per minute, where IGRF changes by < 0.1 nT
+        self.full_rate = full_rate
+        self.binary = binary  # write .anm_cc_igrf as a columnar .anmc intermediate
+        self.manifest = manifest  # BuildManifest: skip files whose outputs are up to date
 
     def process_directory(self):
-        files = list(self.input_dir.rglob("*.anm_cc"))
+        files = find_stage_files(self.input_dir, "*.anm_cc", recursive=True)
         if not files:
             print("No .anm_cc files found.")
             return
 
         for file in sorted(files):
-            self.correct_file(file)
+            step = manifest_step(self.manifest, "anm_cc_igrf", [file], code=__file__,
+                                 params={"wire_height": self.wire_height, "binary": self.binary,
+                                         "full_rate": self.full_rate, "lattice_tolerance": self.lattice_tolerance})
+            if step.fresh:
+                print(f"> Up to date, skipped: {file.name}")
+                continue
+            step.done([self.correct_file(file)])
 
-    def calculate_anomaly(self):
-        with ProcessPoolExecutor() as executor:
-            row_dicts = self.df.to_dict(orient="records")
-            anms = list(tqdm(executor.map(calc_single_igrf, row_dicts, [self.wire_height] * len(row_dicts)),
-                             total=len(row_dicts), desc="Calculating magnetic anomaly"))
-        self.df["anm"] = anms
+    def calculate_anomaly(self, survey: Survey) -> np.ndarray:
+        # magnetic anomaly = Tmag - IGRF total field; large surveys are split over worker processes
+        args = (survey.lon, survey.lat, self.wire_height, survey.time)
+        blocks = list(range(0, len(survey), 4 * IGRF_CHUNK))
+        if len(blocks) <= 1 or self.jobs == 1:
+            return survey.field - igrf_total(*args)
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(igrf_total, *(a if np.ndim(a) == 0 else a[b:b + 4 * IGRF_CHUNK]
+                                                     for a in args)) for b in blocks]
+            reference = np.concatenate([f.result() for f in tqdm(futures, desc="Calculating magnetic anomaly")])
+        return survey.field - reference
 
     def correct_file(self, file_path):
         file_path = Path(file_path)
-        self.df = pd.read_csv(file_path, sep="\s+", header=None)
-        self.df.columns = ['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'Latitude', 'Longitude', 'Tmag']
+        survey = self.process_survey(Survey.read(file_path, ANM_CC_FIELDS))
 
-        self.df["Latitude"] = pd.to_numeric(self.df["Latitude"], errors="coerce")
-        self.df["Longitude"] = pd.to_numeric(self.df["Longitude"], errors="coerce")
-        self.df["Tmag"] = pd.to_numeric(self.df["Tmag"], errors="coerce")
+        output_path = file_path.with_name(text_path(file_path).stem + ".anm_cc_igrf")
+        fields = subsecond(ANM_CC_IGRF_FIELDS) if self.full_rate else ANM_CC_IGRF_FIELDS
+        output_path = survey.write(output_path, fields, binary=self.binary,
+                                   stage="anm_cc_igrf", meta={"source": text_path(file_path).name})
 
+        print(f"Saved: {output_path}")
+        return output_path
+
+    def process_survey(self, survey: Survey) -> Survey:
         # Drop rows with NaN before calculation
-        self.df = self.df.dropna(subset=["Latitude", "Longitude", "Tmag"])
+        survey = survey.take(np.isfinite(survey.lat) & np.isfinite(survey.lon) & np.isfinite(survey.field))
+        if self.lattice_tolerance is not None and len(survey):
+            return self._process_lattice(survey)
+        if self.full_rate:
+            return self._process_full_rate(survey)
 
-        self.calculate_anomaly()
+        anm = self.calculate_anomaly(survey)
+        return survey.with_columns(anm=anm.astype(float)) \
+            .with_step("anm_cc_igrf", wire_height_km=self.wire_height)
 
-        # format
-        self.df['Latitude'] = self.df['Latitude'].map('{:2.8f}'.format)
-        self.df['Longitude'] = self.df['Longitude'].map('{:3.8f}'.format)
-        self.df['Tmag'] = self.df['Tmag'].map('{:5.3f}'.format)
-        self.df['anm'] = self.df['anm'].map('{:5.3f}'.format)
+    def _process_lattice(self, survey: Survey) -> Survey:
+        from .igrflattice import IGRFLattice
 
-        self.df['Year'] = self.df['Year'].map('{:4d}'.format)
-        self.df['Month'] = self.df['Month'].map('{:02d}'.format)
-        self.df['Day'] = self.df['Day'].map('{:02d}'.format)
-        self.df['Hour'] = self.df['Hour'].map('{:02d}'.format)
-        self.df['Minute'] = self.df['Minute'].map('{:02d}'.format)
-        self.df['Second'] = self.df['Second'].map('{:02d}'.format)
+        if self.lattice is None or not self.lattice.covers(survey.lon, survey.lat, survey.time).all():
+            self.lattice = IGRFLattice.build(survey.lon, survey.lat, survey.time, self.wire_height,
+                                             tolerance=self.lattice_tolerance)
+            print(f"> {self.lattice.describe()}")
+            if self.lattice.report["max_error"] > self.lattice_tolerance:
+                print(f"!! IGRF lattice error above tolerance ({self.lattice.report['max_error']:.3g} nT)")
+        reference = self.lattice(survey.lon, survey.lat, survey.time)
+        return survey.with_columns(anm=survey.field - reference) \
+            .with_step("anm_cc_igrf", wire_height_km=self.wire_height, full_rate=self.full_rate,
+                       lattice=self.lattice.report)
 
-        output_path = file_path.with_name(file_path.stem + ".anm_cc_igrf")
-        with open(output_path, 'w') as f:
-            for row in self.df.itertuples(index=False):
-                f.write(" ".join(row) + "\n")
+    def _process_full_rate(self, survey: Survey) -> Survey:
+        if not len(survey):
+            return survey.with_columns(anm=np.zeros(0)).with_step("anm_cc_igrf", wire_height_km=self.wire_height,
+                                                                  full_rate=True)
+        minute = survey.time // (60 * 10**9)
+        nodes = np.zeros(len(survey), dtype=bool)
+        nodes[:1] = True
+        nodes[1:] = (minute[1:] != minute[:-1]) | (survey.segment[1:] != survey.segment[:-1])
+        nodes[:-1] |= survey.segment[1:] != survey.segment[:-1]
+        nodes[-1:] = True
+        ticks = IGRFCORRECTION(self.input_dir, self.wire_height, jobs=self.jobs).process_survey(survey.take(nodes))
+        reference = ticks.field - ticks.extra["anm"]  # IGRF total field at the ticks
 
-        print(f"Saved: {output_path}")
-        return output_path
\ No newline at end of file
+        t0 = survey.time[0]
+        igrf_t = np.interp(survey.time - t0, ticks.time - t0, reference)
+        return survey.with_columns(anm=survey.field - igrf_t) \
+            .with_step("anm_cc_igrf", wire_height_km=self.wire_height, full_rate=True, ticks=len(ticks))
@@ -0,0 +1,170 @@
+"""
+igrflattice.py — IGRF total field precomputed on a lon/lat/time lattice.
+
+Over a cruise box of a few degrees and a few weeks the main field is
+smooth, so :class:`IGRFLattice` evaluates the spherical-harmonic model
+(:func:`~cesiumtoolkit.igrfcorrection.igrf_total`) only at the nodes of a
+regular lattice at one height and interpolates trilinearly to the samples.
+
+The spacing along each axis is chosen from the error bound of
+multilinear interpolation,
+
+    |f - f_lin| <= 1/8 * sum_i h_i**2 * max|d2f/dx_i2|,
+
+with the second derivatives measured by finite differences of the model
+around the box and a safety factor of 2, so that the bound stays below the
+requested ``tolerance``.  IGRF model epochs inside the time span are always
+lattice nodes (the coefficients have a kink there).  After building, the
+lattice is checked against the full model on a validation sample of the
+points; the spacing is halved until the achieved maximum error is within
+tolerance, and the result is kept in :attr:`IGRFLattice.report`.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from .igrfcorrection import _model_epochs, igrf_total
+
+
+__all__ = ["IGRFLattice"]
+
+_SAFETY = 2.0
+_MAX_REFINE = 4
+_MIN_PROBE_DEG = 0.05       # finite-difference step for d2f/dlon2, d2f/dlat2
+_MIN_PROBE_S = 86400.0      # ... and for d2f/dt2
+_PAD_DEG = 1e-3             # boxes are at least this wide (single point, straight N-S line ...)
+_PAD_S = 60.0
+
+
+def _unwrap(lon, centre):
+    # longitudes continuous around the box centre (cruises across 180 deg)
+    return (np.asarray(lon, dtype=np.float64) - centre + 180.0) % 360.0 - 180.0 + centre
+
+
+def _axis(lo, hi, spacing, extra=()):
+    n = max(int(np.ceil((hi - lo) / spacing)), 1) + 1
+    return np.unique(np.concatenate([np.linspace(lo, hi, n), [x for x in extra if lo < x < hi]]))
+
+
+class IGRFLattice:
+    """
+    IGRF total field [nT] at height *height* [km] on the lattice
+    ``lon_nodes × lat_nodes × time_nodes`` (time in s since 1970), with
+    trilinear interpolation; build one with :meth:`build`.
+    """
+
+    def __init__(self, lon_nodes, lat_nodes, time_nodes, height, values, centre=0.0, report=None):
+        from scipy.interpolate import RegularGridInterpolator
+
+        self.lon_nodes, self.lat_nodes, self.time_nodes = lon_nodes, lat_nodes, time_nodes
+        self.height = height
+        self.values = values
+        self.centre = centre  # longitude the box is unwrapped around
+        self.report = report or {}
+        self._interp = RegularGridInterpolator((lon_nodes, lat_nodes, time_nodes), values,
+                                               method="linear", bounds_error=False, fill_value=np.nan)
+
+    @classmethod
+    def build(cls, lon, lat, time, height=0.0, tolerance=0.01, validate=1000, seed=0) -> "IGRFLattice":
+        """
+        Lattice over the bounding box of the points ``(lon, lat, time)``
+        (degrees, ns since 1970) whose interpolation error stays below
+        *tolerance* [nT], checked on *validate* of the points.
+        """
+        lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+        time = np.asarray(time, dtype=np.int64)
+        if not len(lon):
+            raise ValueError("IGRFLattice.build needs at least one point")
+        centre = float(np.degrees(np.arctan2(np.sin(np.radians(lon)).mean(), np.cos(np.radians(lon)).mean())))
+        lon = _unwrap(lon, centre)
+        seconds = time // 10**9
+        box = [(lon.min() - _PAD_DEG, lon.max() + _PAD_DEG), (lat.min() - _PAD_DEG, lat.max() + _PAD_DEG),
+               (float(seconds.min()) - _PAD_S, float(seconds.max()) + _PAD_S)]
+        box[1] = (max(box[1][0], -90.0), min(box[1][1], 90.0))
+
+        curvature = cls._curvature(box, height)
+        with np.errstate(divide="ignore"):
+            # each axis gets a third of the tolerance: h_i**2 * |f_ii| / 8 <= tolerance / 3 / safety
+            spacing = np.sqrt(8 * tolerance / 3 / _SAFETY / curvature)
+        spacing = np.minimum(spacing, [hi - lo for lo, hi in box])
+
+        epochs = _model_epochs().asi8 // 10**9
+        rng = np.random.default_rng(seed)
+        check = rng.choice(len(lon), size=min(validate, len(lon)), replace=False)
+        exact = igrf_total(lon[check], lat[check], height, time[check])
+        for refine in range(_MAX_REFINE + 1):
+            nodes = [_axis(*box[0], spacing[0]), _axis(*box[1], spacing[1]),
+                     np.unique(np.round(_axis(*box[2], spacing[2], extra=epochs.astype(np.float64))))]
+            grid = np.meshgrid(*nodes, indexing="ij")
+            values = igrf_total(grid[0].ravel(), grid[1].ravel(), height,
+                                grid[2].ravel().astype(np.int64) * 10**9).reshape(grid[0].shape)
+            lattice = cls(*nodes, height, values, centre=centre)
+            error = np.abs(lattice(lon[check], lat[check], time[check]) - exact)
+            if error.max(initial=0.0) <= tolerance:
+                break
+            spacing = spacing / 2
+
+        lattice.report = {
+            "tolerance": tolerance,
+            "bound": float(np.sum(spacing**2 * curvature) / 8),
+            "max_error": float(error.max(initial=0.0)),
+            "rms_error": float(np.sqrt(np.mean(error**2))) if len(error) else 0.0,
+            "validated": int(len(check)),
+            "nodes": tuple(len(n) for n in nodes),
+            "spacing": (float(spacing[0]), float(spacing[1]), float(spacing[2]) / 3600),  # deg, deg, h
+            "refinements": refine,
+        }
+        return lattice
+
+    @staticmethod
+    def _curvature(box, height):
+        # max |d2f/dx2| per axis from second differences of the model on a probe grid around the box
+        (lon0, lon1), (lat0, lat1), (t0, t1) = box
+        dx = max((lon1 - lon0) / 8, _MIN_PROBE_DEG)
+        dy = max((lat1 - lat0) / 8, _MIN_PROBE_DEG)
+        dt = max((t1 - t0) / 2, _MIN_PROBE_S)
+        lon_p = np.linspace(lon0, lon1, 5)
+        lat_p = np.clip(np.linspace(lat0, lat1, 5), -89.0, 89.0)
+        # time probes stay inside one model epoch interval: the kink at an epoch is a lattice node
+        epochs = _model_epochs().asi8 / 10**9
+        t_p = np.array([t0, (t0 + t1) / 2, t1])
+        k = np.clip(np.searchsorted(epochs, t_p, side="right") - 1, 0, len(epochs) - 2)
+        dt = min(dt, float(np.min(epochs[k + 1] - epochs[k])) / 4)
+        t_p = np.clip(t_p, epochs[k] + dt, epochs[k + 1] - dt)
+        lo, la, t = (a.ravel() for a in np.meshgrid(lon_p, lat_p, t_p, indexing="ij"))
+
+        def f(dlon=0.0, dlat=0.0, dtime=0.0):
+            return igrf_total(lo + dlon, np.clip(la + dlat, -89.9, 89.9), height,
+                              ((t + dtime) * 10**9).astype(np.int64))
+
+        centre = f()
+        curvature = [np.abs(f(dlon=dx) - 2 * centre + f(dlon=-dx)).max() / dx**2,
+                     np.abs(f(dlat=dy) - 2 * centre + f(dlat=-dy)).max() / dy**2,
+                     np.abs(f(dtime=dt) - 2 * centre + f(dtime=-dt)).max() / dt**2]
+        return np.maximum(curvature, 1e-30)
+
+    def covers(self, lon, lat, time) -> np.ndarray:
+        """True where ``(lon, lat, time)`` lies inside the lattice."""
+        lon = _unwrap(lon, self.centre)
+        seconds = np.asarray(time, dtype=np.int64) // 10**9
+        inside = ((lon >= self.lon_nodes[0]) & (lon <= self.lon_nodes[-1])
+                  & (np.asarray(lat) >= self.lat_nodes[0]) & (np.asarray(lat) <= self.lat_nodes[-1])
+                  & (seconds >= self.time_nodes[0]) & (seconds <= self.time_nodes[-1]))
+        return inside
+
+    def __call__(self, lon, lat, time) -> np.ndarray:
+        """Interpolated total field [nT]; NaN outside the lattice."""
+        lon = _unwrap(lon, self.centre)
+        seconds = (np.asarray(time, dtype=np.int64) // 10**9).astype(np.float64)
+        points = np.column_stack(np.broadcast_arrays(lon, np.asarray(lat, dtype=np.float64), seconds))
+        return self._interp(points).reshape(np.shape(lon))
+
+    def describe(self) -> str:
+        r = self.report
+        if not r:
+            return "IGRF lattice"
+        nx, ny, nt = r["nodes"]
+        return (f"IGRF lattice {nx}x{ny}x{nt} nodes ({r['spacing'][0]:.3g}°, {r['spacing'][1]:.3g}°, "
+                f"{r['spacing'][2]:.3g} h): max error {r['max_error']:.2g} nT, rms {r['rms_error']:.2g} nT "
+                f"on {r['validated']} samples (tolerance {r['tolerance']:g} nT)")
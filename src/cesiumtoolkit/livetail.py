@@ -0,0 +1,416 @@
+"""
+livetail.py — Follow a growing G-880 export (or proton ``.dat``) and append anomaly values as they arrive.
+
+Only bytes appended since the previous poll are parsed (up to the last
+complete line).  G-880 header lines (``DATE TIME ...``) are recognised
+wherever they appear, e.g. after a logger restart; lines before the first
+one are skipped.  Each sample goes through a small state machine that
+mirrors the batch stages, one step per finished minute:
+
+* despiking: with ``despike`` (a :class:`~cesiumtoolkit.despike.Despiker`)
+  the full-rate samples are fed to it as they arrive and only kept samples
+  go on, exactly as ``ANMORG1MIN(despike=...)``; samples wait for the
+  filters' look-ahead (their ``context``).  Without it, the batch spline
+  filter (which needs the whole batch) is replaced by a causal test: a
+  minute is rejected when it differs from the running median of the last
+  ``despike_window`` accepted minutes by ``despike_threshold`` nT or more.
+  Both reject spikes of 100 nT and more, but the minutes kept near a spike
+  can differ from a batch run.
+* 1-min bin (``ANMORG1MIN``): the minute mark ``t`` is emitted as soon as a
+  sample at or after ``t`` arrives, using the sample nearest to ``t``
+  (ties go to the later sample, as ``resample('1min').nearest()``).  Minutes
+  inside a gap longer than ``gap`` are not fabricated; a new segment starts.
+* cable correction (``CABLECORRECTION``): the last ``steps`` minutes of the
+  segment are held back until the look-ahead position is known.
+* IGRF (``IGRFCORRECTION``): one ``igrf_total`` call for the minutes of a
+  poll, or with ``lattice_tolerance`` an :class:`~cesiumtoolkit.igrflattice.IGRFLattice`
+  over a rolling box (0.5° around the ship, one day ahead), rebuilt when
+  the ship leaves it.
+* DV (``DVCORRECTION``): ``output.obsc`` is re-read when it changes; minutes
+  without a DV value wait up to ``dv_wait`` minutes for it.
+
+Rows are appended to ``<stem>.anm_cc_igrf`` and ``<stem>.trk`` in *output_dir*,
+so CPU cost per new record is constant and latency is about one minute
+plus ``steps`` minutes of cable look-ahead.  A follower started on outputs
+that already hold rows (after a crash, Ctrl-C or relaunch) re-reads the log
+from the start to rebuild its state but writes only the minutes after the
+last row of each output; a partial last line is cut off first.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import re
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .cablecorr import CABLECORRECTION
+from .cesiumraw2anmorg import G880_COLUMNS, CESIUMRAW2ANMORG
+from .fixedwidth import ANM_CC_IGRF_FIELDS, TRK_FIELDS, write_fixed_width
+from .igrfcorrection import igrf_total
+from .protonraw2anmorg import _record_columns, tokenize_proton
+
+
+__all__ = ["LIVETAIL"]
+
+_MINUTE = 60 * 10**9  # ns
+_HEADER = re.compile(rb"^DATE[ \t]+TIME\b[^\n]*\n", re.M)  # G-880 column header line
+_BOX_DEG = 0.5                             # rolling IGRF lattice: half-width around the ship [deg]
+_BOX_SPAN = pd.Timedelta("1D").value       # ... and time ahead of the newest minute [ns]
+
+
+def _anm_time(line: bytes) -> int:
+    # "2024 09 29 23 33 00 ..." of an .anm_cc_igrf row
+    return pd.Timestamp(*(int(x) for x in line.split()[:6])).value
+
+
+def _trk_time(line: bytes) -> int:
+    # unixtime of a .trk row
+    return int(float(line.split()[0])) * 10**9
+
+
+def _written_until(path, row_time):
+    """
+    Time [ns] of the last row of an output being appended to (None when it
+    has none); a partial last line left by an interrupted write is removed.
+    """
+    try:
+        fh = open(path, "rb+")
+    except FileNotFoundError:
+        return None
+    with fh:
+        size = fh.seek(0, os.SEEK_END)
+        fh.seek(max(size - 4096, 0))
+        tail = fh.read()
+        if tail and not tail.endswith(b"\n"):
+            cut = tail.rfind(b"\n") + 1
+            fh.truncate(size - len(tail) + cut)
+            tail = tail[:cut]
+    for line in reversed(tail.splitlines()):
+        try:
+            return row_time(line)
+        except (ValueError, IndexError, TypeError):
+            continue
+    return None
+
+
+class LIVETAIL:
+    """
+    Real-time processor for one growing raw log.
+
+    Parameters
+    ----------
+    input_path : str or Path
+        G-880 export (``.txt``) or proton log (``.dat``) being written.
+    output_dir : str or Path, optional
+        Where ``<stem>.anm_cc_igrf`` / ``<stem>.trk`` are appended; defaults
+        to the input folder.
+    obsc_folder : str or Path, optional
+        Folder with ``output.obsc``; without it ``F_last`` = IGRF anomaly.
+    wire_len, steps, wire_height :
+        As for ``CABLECORRECTION`` [m] and ``IGRFCORRECTION`` [km].
+    gap : str, default "1h"
+        Sample gap that starts a new segment.
+    despike : Despiker, optional
+        Streaming despiking of the full-rate samples, as ``ANMORG1MIN(despike=...)``.
+    despike_window, despike_threshold :
+        Without *despike*: running-median despiking of the minute values.
+    lattice_tolerance : float, optional
+        Interpolate the IGRF from a rolling :class:`IGRFLattice` built to this
+        max error [nT] instead of evaluating the model for every minute.
+    dv_wait : int, default 30
+        Minutes a row waits for its DV value before it is dropped from ``.trk``.
+    """
+
+    def __init__(self, input_path, output_dir=None, obsc_folder=None, wire_len=329.95, steps=3,
+                 wire_height=0.0, gap="1h", despike=None, despike_window=5, despike_threshold=100.0,
+                 dv_wait=30, lattice_tolerance=None):
+        self.input_path = Path(input_path)
+        self.output_dir = Path(output_dir) if output_dir else self.input_path.parent
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.obsc_file = Path(obsc_folder) / "output.obsc" if obsc_folder else None
+        self.converter = CESIUMRAW2ANMORG(self.input_path.parent)
+        self.cable = CABLECORRECTION(self.output_dir, wire_len=wire_len, steps=steps)
+        self.steps = steps
+        self.wire_height = wire_height
+        self.gap = pd.Timedelta(gap).value
+        self.despike = despike
+        self.despike_window = despike_window
+        self.despike_threshold = despike_threshold
+        self.lattice_tolerance = lattice_tolerance
+        self.lattice = None
+        self.dv_wait = dv_wait
+        self.proton = self.input_path.suffix == ".dat"
+
+        stem = self.input_path.stem
+        self.anm_path = self.output_dir / f"{stem}.anm_cc_igrf"
+        self.trk_path = self.output_dir / f"{stem}.trk"
+
+        self.dv = {}
+        self.dv_mtime = None
+        self.stats = {"samples": 0, "minutes": 0, "spikes": 0, "rows": 0, "dv_dropped": 0}
+        # minutes already in the outputs (restarted follower) are not written again
+        self.anm_until = _written_until(self.anm_path, _anm_time)
+        self.trk_until = _written_until(self.trk_path, _trk_time)
+        if self.anm_until is not None or self.trk_until is not None:
+            after = [pd.Timestamp(t) if t is not None else "the start" for t in (self.anm_until, self.trk_until)]
+            print(f"> Resuming {self.anm_path.name} after {after[0]}, {self.trk_path.name} after {after[1]}")
+        self.reset()
+
+    def reset(self):
+        # reader state
+        self.offset = 0
+        self.line_no = 1
+        self.header = None
+        # full-rate samples waiting for the despiker's decision: time, lat, lon, tmag
+        self.undecided = [np.empty(0, dtype=np.int64)] + [np.empty(0)] * 3
+        if self.despike is not None:
+            self.despike.reset()
+        # 1-min bin state: last sample before the open minute mark
+        self.prev = None          # (time, lat, lon, tmag)
+        self.next_minute = None   # next minute mark (ns) to emit
+        # despike / cable look-ahead / DV state
+        self.recent = deque(maxlen=self.despike_window)
+        self.lookahead = deque()
+        self.pending_dv = deque()
+
+    # -- polling ----------------------------------------------------------------
+    def follow(self, poll=5.0, idle_timeout=None):
+        """
+        Poll the input every *poll* seconds until interrupted (Ctrl-C) or, with
+        *idle_timeout*, until the file has not grown for that many seconds.
+        """
+        print(f"> Following {self.input_path} → {self.anm_path.name}, {self.trk_path.name}")
+        idle_since = time.monotonic()
+        try:
+            while True:
+                if self.poll_once():
+                    idle_since = time.monotonic()
+                elif idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                    break
+                time.sleep(poll)
+        except KeyboardInterrupt:
+            pass
+        print(f"> Stopped following {self.input_path.name}: {self.stats}")
+        return self.stats
+
+    def poll_once(self):
+        """Process newly appended complete lines; returns the number of new samples."""
+        try:
+            size = os.path.getsize(self.input_path)
+        except FileNotFoundError:
+            return 0
+        if size < self.offset:
+            print(f"!! {self.input_path.name} shrank; restarting from the beginning")
+            self.reset()
+        if size == self.offset:
+            return 0
+
+        with open(self.input_path, "rb") as fh:
+            fh.seek(self.offset)
+            data = fh.read(size - self.offset)
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return 0  # no complete line yet
+        data = data[:end]
+        self.offset += end
+
+        columns = self.parse(data)
+        n_samples = len(columns[0])
+        if self.despike is not None:
+            columns = self.despiked(*columns)
+        time_ns, lat, lon, tmag = columns
+        # float32 as in ANMORG1MIN.resample_df
+        lat, lon, tmag = lat.astype(np.float32), lon.astype(np.float32), tmag.astype(np.float32)
+        self.reload_dv()
+        anm_rows = []
+        for sample in zip(time_ns.tolist(), lat.tolist(), lon.tolist(), tmag.tolist()):
+            anm_rows.extend(self.add_sample(sample))
+        anm_rows = [row for row in anm_rows if not self.written(row["time"], self.trk_until)
+                    or not self.written(row["time"], self.anm_until)]
+        self.igrf(anm_rows)
+        self.pending_dv.extend(row for row in anm_rows if not self.written(row["time"], self.trk_until))
+        anm_rows = [row for row in anm_rows if not self.written(row["time"], self.anm_until)]
+        trk_rows = self.release_dv()
+        self.write(anm_rows, trk_rows)
+        self.stats["samples"] += n_samples
+        return n_samples
+
+    @staticmethod
+    def written(t, until):
+        return until is not None and t <= until
+
+    # -- parsing ---------------------------------------------------------------
+    def parse(self, data):
+        n_lines = data.count(b"\n")
+        if self.proton:
+            records, bad, _ = tokenize_proton(data, self.line_no)
+            if bad:
+                print(f"!! {self.input_path.name}: skipped {len(bad)} malformed line(s)")
+            columns = _record_columns(records) if len(records) else None
+        else:
+            columns = self.parse_g880(data)
+        self.line_no += n_lines
+        if columns is None:
+            return (np.empty(0, dtype=np.int64),) + (np.empty(0),) * 3
+        return (columns["time"], np.asarray(columns["Latitude"], dtype=np.float64),
+                np.asarray(columns["Longitude"], dtype=np.float64), np.asarray(columns["Tmag"], dtype=np.float64))
+
+    def parse_g880(self, data):
+        # blocks between header lines, each read with the header before it
+        parts, pos = [], 0
+        for match in [*_HEADER.finditer(data), None]:
+            block = data[pos:match.start() if match else len(data)]
+            if block.strip() and self.header is None:
+                n_skipped = block.count(b"\n")
+                print(f"!! {self.input_path.name}: skipped {n_skipped} line(s) before the G-880 header")
+            elif block.strip():
+                df = pd.read_csv(io.BytesIO(block), sep=r"\s+", header=None, names=self.header,
+                                 usecols=G880_COLUMNS, dtype={"DATE": str, "TIME": str},
+                                 float_precision="round_trip").dropna()
+                if len(df):
+                    parts.append(self.converter.chunk_columns(df))
+            if match:
+                header = match.group().decode().split()
+                missing = [name for name in G880_COLUMNS if name not in header]
+                if missing:
+                    print(f"!! {self.input_path.name}: header without {', '.join(missing)}; data skipped")
+                self.header = None if missing else header
+                pos = match.end()
+        if not parts:
+            return None
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    def despiked(self, *columns):
+        """Samples the despiker has decided on since the last poll, rejected ones dropped."""
+        keep = self.despike.feed(columns[3])
+        self.undecided = [np.concatenate([held, new]) for held, new in zip(self.undecided, columns)]
+        n = len(keep)
+        decided = [held[:n][keep] for held in self.undecided]
+        self.undecided = [held[n:] for held in self.undecided]
+        self.stats["spikes"] += int(n - keep.sum())
+        return decided
+
+    # -- per-sample state machine ----------------------------------------------
+    def add_sample(self, sample):
+        """Feed one raw sample; yields finished ``.anm_cc_igrf`` rows."""
+        t = sample[0]
+        if self.prev is not None and t <= self.prev[0]:
+            return  # duplicate or out of order
+        if self.prev is None or t - self.prev[0] > self.gap:
+            self.lookahead.clear()  # new segment
+            self.next_minute = t - t % _MINUTE
+            self.prev = None
+        while self.next_minute <= t:
+            mark = self.next_minute
+            if self.prev is not None and mark - self.prev[0] < t - mark:
+                nearest = self.prev
+            else:
+                nearest = sample
+            self.next_minute += _MINUTE
+            row = self.add_minute(mark, nearest)
+            if row is not None:
+                yield row
+        self.prev = sample
+
+    def add_minute(self, mark, nearest):
+        _, lat, lon, tmag = nearest
+        self.stats["minutes"] += 1
+        if self.despike is None:
+            if len(self.recent) and abs(tmag - float(np.median(self.recent))) >= self.despike_threshold:
+                self.stats["spikes"] += 1
+                return None
+            self.recent.append(tmag)
+
+        self.lookahead.append((mark, lat, lon, tmag))
+        if len(self.lookahead) <= self.steps:
+            return None
+        mark, lat, lon, tmag = self.lookahead.popleft()
+        lat1, lon1 = self.lookahead[-1][1], self.lookahead[-1][2]
+        bearing = self.cable.get_bearing(lat, lon, lat1, lon1)
+        if pd.isna(bearing):
+            return None
+        lat3, lon3 = self.cable.calculate_new_position(lat, lon, self.cable.wire_len, (bearing + 180) % 360)
+
+        dt = pd.Timestamp(mark)
+        return {"Year": dt.year, "Month": dt.month, "Day": dt.day, "Hour": dt.hour, "Minute": dt.minute,
+                "Second": dt.second, "Latitude": lat3, "Longitude": lon3, "Tmag": tmag, "time": mark}
+
+    # -- IGRF --------------------------------------------------------------------
+    def igrf(self, rows):
+        """Set ``anm`` of the new *rows*: one model pass (or lattice lookup) per poll."""
+        if not rows:
+            return
+        lon = np.array([row["Longitude"] for row in rows], dtype=np.float64)
+        lat = np.array([row["Latitude"] for row in rows], dtype=np.float64)
+        t = np.array([row["time"] for row in rows], dtype=np.int64)
+        if self.lattice_tolerance is None:
+            reference = igrf_total(lon, lat, self.wire_height, t)
+        else:
+            if self.lattice is None or not self.lattice.covers(lon, lat, t).all():
+                self.lattice = self.rolling_lattice(lon, lat, t)
+            reference = self.lattice(lon, lat, t)
+        for row, value in zip(rows, reference.tolist()):
+            row["anm"] = float(row["Tmag"]) - value
+
+    def rolling_lattice(self, lon, lat, t):
+        from .igrflattice import IGRFLattice
+
+        # box of _BOX_DEG around the new minutes, from their start to _BOX_SPAN after the newest
+        lattice = IGRFLattice.build(np.r_[lon - _BOX_DEG, lon + _BOX_DEG],
+                                    np.clip(np.r_[lat - _BOX_DEG, lat + _BOX_DEG], -90.0, 90.0),
+                                    np.r_[t, t + _BOX_SPAN], self.wire_height, tolerance=self.lattice_tolerance)
+        print(f"> {lattice.describe()}")
+        return lattice
+
+    # -- DV ----------------------------------------------------------------------
+    def reload_dv(self):
+        if self.obsc_file is None or not self.obsc_file.exists():
+            return
+        mtime = self.obsc_file.stat().st_mtime_ns
+        if mtime == self.dv_mtime:
+            return
+        df = pd.read_csv(self.obsc_file, sep=r"\s+", header=None,
+                         names=["year", "month", "day", "hour", "minute", "dv"])
+        df["second"] = 0
+        times = pd.to_datetime(df[["year", "month", "day", "hour", "minute", "second"]])
+        self.dv = {}
+        for t, dv in zip(times.astype("int64").tolist(), df["dv"].tolist()):
+            self.dv.setdefault(t, dv)  # first value of duplicated minutes, as DVCORRECTION
+        self.dv_mtime = mtime
+
+    def release_dv(self):
+        """Rows whose DV is known (or given up on) leave the pending queue in order."""
+        rows = []
+        newest = self.pending_dv[-1]["time"] if self.pending_dv else None
+        while self.pending_dv:
+            row = self.pending_dv[0]
+            if self.obsc_file is None:
+                dv = 0.0
+            else:
+                dv = self.dv.get(row["time"])
+            if dv is None:
+                if newest - row["time"] < self.dv_wait * _MINUTE:
+                    break
+                self.pending_dv.popleft()
+                self.stats["dv_dropped"] += 1
+                continue
+            self.pending_dv.popleft()
+            rows.append({"unixtime": row["time"] // 10**9, "lon": row["Longitude"],
+                         "lat": row["Latitude"], "mag": row["anm"] - dv})
+        return rows
+
+    def write(self, anm_rows, trk_rows):
+        if anm_rows:
+            write_fixed_width(self.anm_path, pd.DataFrame(anm_rows), ANM_CC_IGRF_FIELDS, mode="a")
+            self.stats["rows"] += len(anm_rows)
+        if trk_rows:
+            write_fixed_width(self.trk_path, pd.DataFrame(trk_rows), TRK_FIELDS, mode="a")
+            last = trk_rows[-1]
+            print(f"> {pd.Timestamp(last['unixtime'], unit='s')}  F_last={last['mag']:.1f} nT "
+                  f"(+{len(trk_rows)} row(s))")
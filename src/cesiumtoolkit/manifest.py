@@ -0,0 +1,211 @@
+"""
+manifest.py — Content-hash build manifest for incremental pipeline runs.
+
+Each stage asks the manifest for a :class:`BuildStep` per input file.  The
+step key is a SHA-256 over the stage name, the contents of its input files,
+the stage parameters and the source of the stage module together with the
+package modules it imports (``fixedwidth``, ``survey``, ``columnar`` ...).
+A step is *fresh* when the manifest holds the same key and every output it
+recorded is still present and unmodified; fresh steps are skipped.  Because
+a stage's inputs are the previous stage's outputs, changing one raw log or
+one parameter only reruns the steps downstream of that change.
+
+An output that a step no longer writes (e.g. a segment that disappeared) is
+deleted together with everything the manifest recorded downstream of it, so
+later stages globbing their inputs do not pick up stale files.
+
+File hashes are cached by ``(size, mtime_ns)`` so unchanged files are not
+re-read on every run.  Delete the manifest file to force a full rebuild.
+"""
+
+from __future__ import annotations
+
+import ast
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Mapping
+
+
+__all__ = ["MANIFEST_NAME", "BuildManifest", "BuildStep", "manifest_step"]
+
+MANIFEST_NAME = ".cesium_manifest.json"
+_VERSION = 1
+
+
+class BuildManifest:
+    """
+    Build cache stored as JSON, by default ``<directory>/.cesium_manifest.json``.
+
+    Parameters
+    ----------
+    path : str or Path
+        Manifest file, or a directory to hold :data:`MANIFEST_NAME`.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        path = Path(path)
+        self.path = path / MANIFEST_NAME if path.is_dir() else path
+        self.root = self.path.parent.resolve()
+        self.entries: dict[str, dict] = {}
+        self.files: dict[str, list] = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError) as exc:
+                print(f"!! Ignoring unreadable manifest {self.path.name}: {exc}")
+                data = {}
+            if data.get("version") == _VERSION:
+                self.entries = data.get("entries", {})
+                self.files = data.get("files", {})
+
+    def _rel(self, path: str | Path) -> str:
+        path = Path(path).resolve()
+        try:
+            return path.relative_to(self.root).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def _abs(self, rel: str) -> Path:
+        return self.root / rel
+
+    def file_hash(self, path: str | Path) -> str | None:
+        """SHA-256 of *path* (``"dir"`` for directories, ``None`` if missing)."""
+        path = Path(path)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        if path.is_dir():
+            return "dir"
+        rel = self._rel(path)
+        cached = self.files.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(16 << 20), b""):
+                digest.update(block)
+        self.files[rel] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def step(self, stage: str, inputs: Iterable[str | Path], params: Mapping | None = None,
+             code: str | Path | None = None) -> "BuildStep":
+        """
+        Build step of *stage* for *inputs* (the first input names the step).
+
+        *params* must be JSON-serialisable; *code* is the stage's source
+        file, so editing the stage or a module it imports also invalidates
+        its outputs.
+        """
+        inputs = [Path(p) for p in inputs]
+        digest = hashlib.sha256(stage.encode())
+        for path in inputs:
+            digest.update(f"\0{path.name}\0{self.file_hash(path)}".encode())
+        digest.update(json.dumps(dict(params or {}), sort_keys=True, default=str).encode())
+        if code is not None:
+            for path in code_files(code):
+                digest.update(f"\0{path.name}\0{self.file_hash(path)}".encode())
+        name = f"{stage}:{self._rel(inputs[0])}" if inputs else stage
+        return BuildStep(self, name, digest.hexdigest())
+
+    def discard(self, path: str | Path) -> None:
+        """
+        Delete the output *path* and, recursively, the outputs of the steps
+        run on it (steps are named after their first input).
+        """
+        rel = self._rel(path)
+        if self._abs(rel).is_file():
+            self._abs(rel).unlink()
+        self.files.pop(rel, None)
+        for name in [name for name in self.entries if name.split(":", 1)[-1] == rel]:
+            for output in self.entries.pop(name).get("outputs", {}):
+                self.discard(self._abs(output))
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".part")
+        tmp.write_text(json.dumps({"version": _VERSION, "entries": self.entries, "files": self.files},
+                                  indent=1, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+class BuildStep:
+    """One stage applied to one input; see :meth:`BuildManifest.step`."""
+
+    def __init__(self, manifest: BuildManifest | None, name: str, key: str) -> None:
+        self.manifest = manifest
+        self.name = name
+        self.key = key
+
+    @property
+    def outputs(self) -> list[Path]:
+        """Outputs recorded by the last successful run of this step."""
+        if self.manifest is None:
+            return []
+        entry = self.manifest.entries.get(self.name, {})
+        return [self.manifest._abs(rel) for rel in entry.get("outputs", {})]
+
+    @property
+    def fresh(self) -> bool:
+        if self.manifest is None:
+            return False
+        entry = self.manifest.entries.get(self.name)
+        if not entry or entry.get("key") != self.key:
+            return False
+        return all(self.manifest.file_hash(self.manifest._abs(rel)) == digest
+                   for rel, digest in entry["outputs"].items())
+
+    def done(self, outputs: Iterable[str | Path]) -> None:
+        """
+        Record a successful run and save the manifest.
+
+        Files recorded by the previous run of this step that were not
+        written again (e.g. a segment that no longer exists) are deleted,
+        with the outputs of later stages made from them, so later stages do
+        not pick up stale output.
+        """
+        if self.manifest is None:
+            return
+        manifest = self.manifest
+        outputs = [Path(p) for p in outputs]
+        new = {manifest._rel(p) for p in outputs}
+        for old in self.outputs:
+            if manifest._rel(old) not in new:
+                manifest.discard(old)
+        manifest.entries[self.name] = {
+            "key": self.key,
+            "outputs": {manifest._rel(p): manifest.file_hash(p) for p in outputs},
+        }
+        manifest.save()
+
+
+@lru_cache(maxsize=None)
+def _imports(path: Path) -> tuple[Path, ...]:
+    # package modules named by the relative imports of path (also those inside functions)
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    found = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.level == 1:
+            names = [node.module] if node.module else [alias.name for alias in node.names]
+            found += [path.with_name(name.split(".")[0] + ".py") for name in names]
+    return tuple(p for p in found if p.is_file())
+
+
+def code_files(code: str | Path) -> list[Path]:
+    """*code* and the package modules it imports, directly or through others (sorted)."""
+    seen, todo = set(), [Path(code).resolve()]
+    while todo:
+        path = todo.pop()
+        if path not in seen:
+            seen.add(path)
+            todo += _imports(path) if path.suffix == ".py" else ()
+    return sorted(seen)
+
+
+def manifest_step(manifest: BuildManifest | None, stage: str, inputs, params=None, code=None) -> BuildStep:
+    """:meth:`BuildManifest.step`, or a step that is never fresh when *manifest* is None."""
+    if manifest is None:
+        return BuildStep(None, stage, "")
+    return manifest.step(stage, inputs, params, code)
@@ -0,0 +1,213 @@
+"""
+obsstore.py — Persisted store of observatory minute series from IAGA-2002 ``.min`` files.
+
+Each ``.min`` file is parsed in a single read (:func:`parse_min_file`:
+header metadata and data from the same text), and many files are parsed
+in parallel worker processes (:func:`read_min_files`).
+
+:class:`ObservatoryStore` keeps what has been ingested in
+``<folder>/.obsstore/<IAGA CODE>.anmc``: one columnar file (see
+:mod:`columnar`) per station holding ``time`` (int64 ns, sorted, unique)
+and the data columns of the files (``KNYX`` … ``KNYF``) plus the id of
+the file each row came from, with the station metadata and the size/mtime
+and id of every ingested file in the header.
+:meth:`ObservatoryStore.update` parses only files that are new or changed
+since the last run; the rows of a changed or deleted file are dropped by
+their id, so the store always holds what parsing the folder's current
+files would give, overlapping files included (a minute in several files
+takes the value of the last file by name).  :meth:`ObservatoryStore.series`
+returns any time window as a slice of the memory-mapped columns instead of
+re-parsing years of files.
+"""
+
+from __future__ import annotations
+
+import io
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .columnar import read_columnar, write_columnar
+
+
+__all__ = ["STORE_DIR", "parse_min_file", "read_min_files", "ObservatoryStore"]
+
+STORE_DIR = ".obsstore"
+_PARALLEL_MIN_FILES = 8  # below this a process pool costs more than it saves
+_NUMBER = re.compile(r"[-+]?\d*\.\d+|\d+")
+_NOT_DATA = ("DATE", "TIME", "DOY", "|")
+_STORE_VERSION = 2  # rows carry the id of their source file
+
+
+def parse_min_file(filepath) -> tuple[pd.DataFrame, dict]:
+    """
+    Data and metadata of one IAGA-2002 file, from one read.
+
+    Returns ``(df, meta)``: *df* has ``datetime`` and the data columns of
+    the file header (``KNYX``, ``KNYY`` …) as float; *meta* holds
+    ``latitude``, ``longitude``, ``elevation``, ``station`` (IAGA code) and
+    ``name``.
+    """
+    text = Path(filepath).read_text()
+    lines = text.splitlines()
+    meta = {"latitude": None, "longitude": None, "elevation": None, "station": None, "name": None}
+    for header_line, line in enumerate(lines):
+        if line.startswith("DATE"):
+            break
+        if "Geodetic Latitude" in line:
+            meta["latitude"] = float(_NUMBER.findall(line)[0])
+        elif "Geodetic Longitude" in line:
+            meta["longitude"] = float(_NUMBER.findall(line)[0])
+        elif "Elevation" in line:
+            meta["elevation"] = float(_NUMBER.findall(line)[0])
+        elif "IAGA CODE" in line:
+            meta["station"] = line.split("|")[0].split()[-1]
+        elif "Station Name" in line:
+            meta["name"] = line.split("|")[0].split(None, 2)[-1].strip()
+    else:
+        raise ValueError(f"'DATE' line not found in file: {filepath}")
+    names = lines[header_line].strip().split()
+    # the readers use the <station>F column: without an IAGA CODE line (or one naming no column)
+    # the station comes from it (KNYF -> KNY), the file name only when there is no such column
+    total = [name[:-1] for name in names if name.endswith("F") and name not in _NOT_DATA and len(name) > 1]
+    if meta["station"] is None or (total and meta["station"] not in total):
+        meta["station"] = total[0] if total else (
+            meta["station"] or re.match(r"[A-Za-z]*", Path(filepath).name).group(0).upper() or Path(filepath).stem)
+    df = pd.read_csv(io.StringIO(text), sep=r'\s+', skiprows=header_line + 1, names=names)
+    data = {"datetime": pd.to_datetime(df["DATE"] + " " + df["TIME"])}
+    for name in names:
+        if name not in _NOT_DATA:
+            data[name] = df[name].astype(float)
+    return pd.DataFrame(data), meta
+
+
+def read_min_files(paths, jobs=None) -> list[tuple[pd.DataFrame, dict]]:
+    """:func:`parse_min_file` for every path (in order), over *jobs* worker processes (None = all cores)."""
+    paths = [str(p) for p in paths]
+    if len(paths) < _PARALLEL_MIN_FILES or jobs == 1:
+        return [parse_min_file(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(parse_min_file, paths, chunksize=max(len(paths) // 64, 1)))
+
+
+class ObservatoryStore:
+    """
+    Observatory series ingested from the ``.min`` files of *folder*, kept in
+    *store_dir* (default ``<folder>/.obsstore``).
+    """
+
+    def __init__(self, folder, store_dir=None, jobs=None):
+        self.folder = Path(folder)
+        self.store_dir = Path(store_dir) if store_dir else self.folder / STORE_DIR
+        self.jobs = jobs  # worker processes for parsing new files (None = all cores)
+
+    def path(self, station: str) -> Path:
+        return self.store_dir / f"{station}.anmc"
+
+    def stations(self) -> list[str]:
+        return sorted(p.stem for p in self.store_dir.glob("*.anmc"))
+
+    def metadata(self, station: str) -> dict:
+        """Station metadata (``latitude``, ``longitude``, ``elevation``, ``name`` …) and ingested ``files``."""
+        return read_columnar(self.path(station))[1]["meta"]
+
+    def update(self, files=None) -> dict:
+        """
+        Ingest new or changed ``.min`` files (default: all in the folder) and
+        forget files no longer in the folder; returns the number of files
+        ingested per station.
+        """
+        files = sorted(Path(f) for f in (self.folder.glob("*.min") if files is None else files))
+        known = {}  # file name -> (station, [size, mtime_ns, source id])
+        outdated = set()  # stations stored without per-row source ids: rebuilt from their files
+        for station in self.stations():
+            meta = self.metadata(station)
+            if meta.get("version") != _STORE_VERSION:
+                outdated.add(station)
+                continue
+            for name, entry in meta.get("files", {}).items():
+                known[name] = (station, entry)
+        if outdated:
+            files = sorted({*files, *self.folder.glob("*.min")})
+        stale = [f for f in files if f.name not in known
+                 or known[f.name][1][:2] != [f.stat().st_size, f.stat().st_mtime_ns]]
+        removed = [name for name in known if not (self.folder / name).exists()]
+        if not stale and not removed and not outdated:
+            return {}
+
+        by_station: dict[str, list] = {station: [] for station in outdated}
+        for name in removed:
+            by_station.setdefault(known[name][0], [])
+        for path in stale:  # a changed file also leaves the station it was stored under
+            if path.name in known:
+                by_station.setdefault(known[path.name][0], [])
+        for path, (df, meta) in zip(stale, read_min_files(stale, self.jobs)):
+            by_station.setdefault(meta["station"], []).append((path, df, meta))
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        ingested = {}
+        for station, parsed in by_station.items():
+            kept, old_meta = self._kept_rows(station, {path.name for path in stale} | set(removed), outdated)
+            file_index = dict(old_meta.get("files", {}))
+            next_id = max((entry[2] for entry in file_index.values()), default=-1) + 1
+            frames = [kept] if kept is not None else []
+            for path, df, meta in parsed:
+                stat = path.stat()
+                file_index[path.name] = [stat.st_size, stat.st_mtime_ns, next_id]
+                frames.append(df.assign(source=next_id))
+                next_id += 1
+            if not file_index:  # every file of the station is gone
+                self.path(station).unlink(missing_ok=True)
+                print(f"> Observatory store {station}: no files left, removed")
+                continue
+
+            # a minute in several files takes the value of the last file by name, whatever the ingestion order
+            merged = pd.concat(frames, ignore_index=True)
+            rank = {entry[2]: i for i, (_, entry) in enumerate(sorted(file_index.items()))}
+            merged["rank"] = merged["source"].map(rank)
+            merged = merged.sort_values(["datetime", "rank"], kind="stable").drop_duplicates("datetime", keep="last")
+            columns = {"time": merged["datetime"].to_numpy().view("int64")}
+            columns.update({name: merged[name].to_numpy(dtype=float) for name in merged
+                            if name not in ("datetime", "source", "rank")})
+            columns["source"] = merged["source"].to_numpy(dtype=np.int64)
+            station_meta = {k: v for k, v in {**old_meta, **(parsed[-1][2] if parsed else {})}.items()
+                            if k not in ("files", "version")}
+            write_columnar(self.path(station), columns, stage="obsstore",
+                           meta={**station_meta, "version": _STORE_VERSION, "files": file_index})
+            ingested[station] = len(parsed)
+            print(f"> Observatory store {station}: {len(parsed)} file(s) ingested, {len(merged):,} minutes "
+                  f"({pd.Timestamp(columns['time'][0])} – {pd.Timestamp(columns['time'][-1])})")
+        return ingested
+
+    def _kept_rows(self, station, dropped, outdated):
+        # stored rows of station except those of the files in dropped (by name), and its metadata
+        if not self.path(station).exists():
+            return None, {}
+        columns, header = read_columnar(self.path(station))
+        meta = header["meta"]
+        if station in outdated:
+            return None, {k: v for k, v in meta.items() if k != "files"}
+        meta = {**meta, "files": {name: entry for name, entry in meta["files"].items() if name not in dropped}}
+        live = {entry[2] for entry in meta["files"].values()}
+        keep = np.isin(columns["source"], list(live))
+        data = {"datetime": np.array(columns.pop("time"))[keep].view("datetime64[ns]")}
+        data.update({name: np.array(values)[keep] for name, values in columns.items()})
+        return pd.DataFrame(data), meta
+
+    def span(self, station: str) -> tuple[pd.Timestamp, pd.Timestamp]:
+        """First and last time stamp of *station* in the store."""
+        time = read_columnar(self.path(station))[0]["time"]
+        return pd.Timestamp(int(time[0])), pd.Timestamp(int(time[-1]))
+
+    def series(self, station: str, start=None, end=None) -> pd.DataFrame:
+        """Rows of *station* with ``start <= datetime <= end`` (either may be None), sliced from the store."""
+        columns, _ = read_columnar(self.path(station))
+        time = columns.pop("time")
+        lo = 0 if start is None else np.searchsorted(time, pd.Timestamp(start).value, side="left")
+        hi = len(time) if end is None else np.searchsorted(time, pd.Timestamp(end).value, side="right")
+        data = {"datetime": np.array(time[lo:hi]).view("datetime64[ns]")}
+        data.update({name: np.array(values[lo:hi]) for name, values in columns.items() if name != "source"})
+        return pd.DataFrame(data)
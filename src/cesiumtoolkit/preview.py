@@ -0,0 +1,133 @@
+"""
+preview.py — Downsampled WebGL previews for the HTML plots written by the stages.
+
+Every stage plot goes through this module so that preview size no longer
+grows with the survey:
+
+* series are reduced to at most ``max_points`` points with
+  Largest-Triangle-Three-Buckets (:func:`lttb_indices`, keeps the visual
+  shape of a line) or min/max per bucket (:func:`minmax_indices`, keeps
+  every extreme, e.g. spikes);
+* lines are drawn with ``Scattergl`` (WebGL) instead of SVG ``Scatter``;
+* :func:`write_html` references ``plotly.min.js`` in the output folder,
+  written once, instead of embedding 3.5 MB of JavaScript in every file.
+
+:func:`set_headless` (or ``CESIUMTOOLKIT_HEADLESS=1`` in the environment)
+turns off every HTML and PNG preview of the stages; plotting libraries are
+only imported when a preview is actually drawn.
+
+The point cap is set per stage (``preview_points=`` of ``ANMORG1MIN``,
+``DVCONVERT``, ``DVCORRECTION`` and ``splitter``; :data:`DEFAULT_MAX_POINTS`).
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+
+__all__ = ["DEFAULT_MAX_POINTS", "set_headless", "is_headless", "lttb_indices", "minmax_indices",
+           "downsample", "line_trace", "share_points", "write_html"]
+
+DEFAULT_MAX_POINTS = 5000
+
+_headless = os.environ.get("CESIUMTOOLKIT_HEADLESS", "").strip().lower() not in ("", "0", "false", "no")
+
+
+def set_headless(headless: bool = True) -> None:
+    """Skip (``True``) or draw (``False``) the HTML/PNG previews of all stages."""
+    global _headless
+    _headless = bool(headless)
+
+
+def is_headless() -> bool:
+    return _headless
+
+
+def _numeric(x) -> np.ndarray:
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").astype(np.int64)
+    x = x.astype(np.float64)
+    return x - x[0] if len(x) else x  # relative, so ns time stamps keep their precision
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """Indices of the *n_out* points Largest-Triangle-Three-Buckets keeps (first and last included)."""
+    x, y = _numeric(x), np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)  # n_out - 2 inner buckets
+    edges[-1] = n - 1
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        nhi = max(nhi, nlo + 1)
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(x, y, n_out: int) -> np.ndarray:
+    """Indices of the min and max of *y* in ``(n_out - 2) // 2`` equal-count buckets, plus both ends."""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    buckets = max((n_out - 2) // 2, 1)
+    if n_out >= n:
+        return np.arange(n)
+    bucket = np.arange(n) * buckets // n
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    ends = np.r_[starts[1:], n]
+    return np.unique(np.r_[order[starts], order[ends - 1], 0, n - 1])
+
+
+def downsample(x, y, max_points: int | None = DEFAULT_MAX_POINTS, method: str = "lttb") -> np.ndarray:
+    """
+    Indices of at most *max_points* finite points of ``(x, y)`` chosen by
+    *method* (``"lttb"`` or ``"minmax"``); ``None`` keeps every point.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.flatnonzero(np.isfinite(y))
+    if max_points is None or len(finite) <= max_points:
+        return finite
+    pick = {"lttb": lttb_indices, "minmax": minmax_indices}[method]
+    return finite[pick(np.asarray(x)[finite], y[finite], max_points)]
+
+
+def share_points(lengths, max_points: int | None) -> list:
+    """Split a stage's point budget over several series in proportion to their lengths."""
+    total = sum(lengths)
+    if max_points is None or total <= max_points:
+        return [None] * len(lengths)
+    return [max(int(max_points * n / total), 3) for n in lengths]
+
+
+def line_trace(x, y, *, max_points: int | None = DEFAULT_MAX_POINTS, method: str = "lttb",
+               **kwargs) -> go.Scattergl:
+    """``Scattergl`` line of ``(x, y)`` downsampled to *max_points*; *kwargs* go to the trace."""
+    import plotly.graph_objects as go
+
+    x, y = np.asarray(x), np.asarray(y)
+    index = downsample(x, y, max_points, method)
+    kwargs.setdefault("mode", "lines")
+    return go.Scattergl(x=x[index], y=y[index], **kwargs)
+
+
+def write_html(fig: go.Figure, path: str | Path) -> Path:
+    """Write *fig* referencing ``plotly.min.js`` next to it (copied there on first use)."""
+    path = Path(path)
+    fig.write_html(str(path), include_plotlyjs="directory")
+    return path
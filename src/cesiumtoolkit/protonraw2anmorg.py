@@ -3,11 +3,22 @@
 Keeps original file name plus extra suffix; no numeric index is added.
 """
 
+import contextlib
+import mmap
+import os
+import time
 from pathlib import Path
-import re
+
 import numpy as np
 import pandas as pd
 
+from .batchconvert import convert_many, print_summary
+from .columnar import ColumnarWriter, columnar_path
+from .manifest import manifest_step
+from .fixedwidth import PROTON_ANMORG_FIELDS, write_fixed_width
+from .survey import Survey
+from .timeindex import window_bytes
+
 class PROTONRAW2ANMORG:
     """
     Converter: ``file.dat`` → ``file.dat.anmorg`` .
@@ -19,87 +30,302 @@ class PROTONRAW2ANMORG:
         output_dir: str | Path | None = None,
         output_ext: str = ".anmorg",
         file_ext: str = ".dat",
+        block_bytes: int = 64 << 20,
+        binary: bool = False,
+        manifest=None,
+        time_window=None,
     ) -> None:
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir) if output_dir else self.input_dir
         self.output_ext = output_ext   # text appended after ".dat"
         self.file_ext = file_ext       # expected raw extension (usually ".dat")
+        self.block_bytes = block_bytes # bytes tokenized per block (cut at a line end)
+        self.binary = binary           # write a columnar .anmc intermediate instead of ASCII
+        self.manifest = manifest       # BuildManifest: skip files whose output is up to date
+        self.time_window = time_window # (start, end): convert only this span, via the .tidx index
 
-    def convert_all(self, start_number: int = 1, preview: bool = False) -> None:  # noqa: D401
+    def convert_all(self, start_number: int = 1, preview: bool = False, jobs: int | None = 1) -> list[dict]:  # noqa: D401
         """Convert every ``*.dat`` file found in *input_dir*.
 
         *Signature kept identical to previous version for drop‑in compatibility.*
         ``start_number`` is ignored now because no numeric suffix is added, but
         the argument remains so that existing calls do not break.
+        ``jobs > 1`` converts files in a process pool (``None``/``0``: every
+        core); per-file status and timing are printed as one summary.
         """
         files = sorted(self.input_dir.glob(f"*{self.file_ext}"))
         if not files:
             print("!! No input files found.")
-            return
+            return []
 
-        for old_file in files:
-            new_name = old_file.name + self.output_ext  # e.g. foo.dat.anmorg
-            new_path = self.output_dir / new_name
-            print(f"> Converting {old_file.name} → {new_name}")
+        pairs = [(old_file, self.output_dir / (old_file.name + self.output_ext))  # e.g. foo.dat.anmorg
+                 for old_file in files]
+        if self.binary:
+            pairs = [(old_file, columnar_path(new_path)) for old_file, new_path in pairs]
+        print(f"> Converting {len(pairs)} file(s) → *{self.file_ext}{self.output_ext}")
 
-            self.convert_file(old_file, new_path)
+        steps = {old_file: manifest_step(self.manifest, "anmorg", [old_file], code=__file__,
+                                         params={"output": new_path.name, "binary": self.binary,
+                                                 "time_window": self.time_window})
+                 for old_file, new_path in pairs}
+        todo = [(old_file, new_path) for old_file, new_path in pairs if not steps[old_file].fresh]
+        for old_file, new_path in pairs:
+            if steps[old_file].fresh:
+                print(f"> Up to date, skipped: {new_path.name}")
 
-            if preview and new_path.exists():
-                print("  Preview (first 5 lines):")
-                print("\n".join(new_path.read_text().splitlines()[:5]))
+        t0 = time.perf_counter()
+        results = convert_many(self, todo, jobs=jobs)
+        for result in results:
+            if result["status"] == "ok":
+                steps[result["input"]].done([result["output"]])
+        print_summary(results, time.perf_counter() - t0, jobs)
 
-    def convert_file(self, input_path: Path, output_path: Path) -> None:  # noqa: D401
-        """Convert a single raw file to anmorg format."""
-        try:
-            # 1) normalise delimiters and strip leading '$'
-            cleaned_lines: list[str] = [
-                re.sub(r"\s+", " ", re.sub(r"[,:/]", " ", ln.lstrip("$"))).strip()
-                for ln in input_path.read_text(encoding="utf-8").splitlines()
-            ]
-
-            # 2) split into columns
-            split_df = (
-                pd.DataFrame(cleaned_lines, columns=["raw"])["raw"].str.split(" ", expand=True)
-            )
-
-            # 3) construct datetime
-            dt = pd.to_datetime(
-                split_df[0] + " " + split_df[1] + " " + split_df[2] + " " +
-                split_df[3] + " " + split_df[4] + " " + split_df[5],
-                format="%Y %m %d %H %M %S",
-            )
-
-            # 4) latitude / longitude and magnetic intensity
-            lat = _parse_coord(split_df[26], split_df[27])
-            lon = _parse_coord(split_df[29], split_df[30])
-            mag = pd.to_numeric(split_df[6], errors="coerce")
-
-            # 5) assemble DataFrame and write text file
-            out_df = pd.DataFrame({
-                "year"  : dt.dt.year.astype(str).str.zfill(4),
-                "month" : dt.dt.month.astype(str).str.zfill(2),
-                "day"   : dt.dt.day.astype(str).str.zfill(2),
-                "hour"  : dt.dt.hour.astype(str).str.zfill(2),
-                "minute": dt.dt.minute.astype(str).str.zfill(2),
-                "second": (dt.dt.second + dt.dt.microsecond/1e6).map(
-                    lambda x: f"{int(x):02d}.{int(round((x-int(x))*1000)):03d}"
-                ),
-                "lat"   : lat.map("{:.7f}".format),
-                "lon"   : lon.map("{:.7f}".format),
-                "mag"   : mag.map("{:.6f}".format),
-            })
-
-            output_path.write_text("\n".join(out_df.agg(" ".join, axis=1)) + "\n")
+        if preview and not self.binary:
+            for result in results:
+                if result["status"] == "ok":
+                    print(f"  Preview of {result['output'].name} (first 5 lines):")
+                    with open(result["output"]) as f:
+                        print("".join(line for _, line in zip(range(5), f)), end="")
+        return results
+
+    def convert_file(self, input_path: Path, output_path: Path) -> int | None:  # noqa: D401
+        """Convert a single raw file to anmorg format.
 
+        The file is memory-mapped and tokenized block by block with
+        :func:`tokenize_proton`; malformed lines are dropped and reported
+        instead of aborting the whole file.  Returns the number of rows
+        written, or ``None`` if nothing was written.
+        """
+        input_path, output_path = Path(input_path), Path(output_path)
+        if self.binary:
+            output_path = columnar_path(output_path)
+        tmp_path = output_path.with_name(output_path.name + ".part")
+        n_rows, bad_lines = 0, []
+        writer = None
+        try:
+            if self.binary:
+                writer = ColumnarWriter(tmp_path, stage="anmorg", meta={"source": input_path.name})
+            else:
+                tmp_path.write_bytes(b"")
+            with open(input_path, "rb") as fh:
+                size = os.fstat(fh.fileno()).st_size
+                if size:
+                    if self.time_window is not None:  # only the lines of the window, via the .tidx index
+                        source = contextlib.nullcontext(window_bytes(input_path, *self.time_window))
+                    else:
+                        source = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                    with source as mm, memoryview(mm) as view:
+                        size = len(mm)
+                        first_line, start = 1, 0
+                        while start < size:
+                            stop = min(start + self.block_bytes, size)
+                            if stop < size:  # cut the block after its last complete line
+                                cut = mm.rfind(b"\n", start, stop)
+                                stop = cut + 1 if cut >= 0 else (mm.find(b"\n", stop) + 1 or size)
+                            records, bad, n_lines = tokenize_proton(view[start:stop], first_line)
+                            records = self.window_filter(records)
+                            if writer is not None:
+                                writer.append(_record_columns(records))
+                            else:
+                                write_fixed_width(tmp_path, records, PROTON_ANMORG_FIELDS, mode="a")
+                            n_rows += len(records)
+                            bad_lines += bad
+                            first_line += n_lines
+                            start = stop
+            if writer is not None:
+                writer.close()
         except Exception as exc:  # noqa: BLE001
+            if writer is not None:
+                writer.abort()
+            tmp_path.unlink(missing_ok=True)
             print(f"XXX Error while processing {input_path.name}: {exc}")
+            return None
+
+        if bad_lines:
+            shown = ", ".join(map(str, bad_lines[:5])) + (" ..." if len(bad_lines) > 5 else "")
+            print(f"!! {input_path.name}: skipped {len(bad_lines)} malformed line(s): {shown}")
+        if n_rows == 0:
+            tmp_path.unlink(missing_ok=True)
+            print(f"!! Skipped {input_path.name} (no valid records)")
+            return None
+
+        tmp_path.replace(output_path)
+        return n_rows
+
+
+    def window_filter(self, records: pd.DataFrame) -> pd.DataFrame:
+        """Keep the records inside ``time_window`` (all records when it is None)."""
+        if self.time_window is None or records.empty:
+            return records
+        dt = pd.to_datetime(records[["Year", "Month", "Day", "Hour", "Minute", "Second"]])
+        start, end = self.time_window
+        keep = np.ones(len(records), dtype=bool)
+        if start is not None:
+            keep &= (dt >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            keep &= (dt <= pd.Timestamp(end)).to_numpy()
+        return records[keep].reset_index(drop=True)
+
+    def load_survey(self, input_path: Path) -> Survey:
+        """Parse a whole raw file into an in-memory :class:`Survey` (malformed lines are dropped)."""
+        input_path = Path(input_path)
+        if self.time_window is not None:
+            buf = window_bytes(input_path, *self.time_window)
+        else:
+            buf = input_path.read_bytes()
+        records, bad_lines, _ = tokenize_proton(buf)
+        records = self.window_filter(records)
+        if bad_lines:
+            print(f"!! {input_path.name}: skipped {len(bad_lines)} malformed line(s)")
+        columns = _record_columns(records)
+        return Survey(time=columns["time"], lat=columns["Latitude"], lon=columns["Longitude"],
+                      field=columns["Tmag"], name=input_path.name,
+                      provenance=[{"stage": "anmorg", "source": input_path.name}])
+
+
+def _record_columns(records: pd.DataFrame) -> dict:
+    """Columnar (.anmc) view of :func:`tokenize_proton` records."""
+    dt = pd.to_datetime(records[["Year", "Month", "Day", "Hour", "Minute", "Second"]])
+    return {
+        "time": dt.dt.as_unit("ns").to_numpy().view("int64"),
+        "Latitude": records["Latitude"].to_numpy(dtype=float),
+        "Longitude": records["Longitude"].to_numpy(dtype=float),
+        "Tmag": records["Tmag"].to_numpy(dtype=float),
+    }
+
+
+# bytes treated as field delimiters: blanks, CSV ',', date '/', time ':' and the leading '$'
+_DELIMITER = np.zeros(256, dtype=bool)
+_DELIMITER[list(b" \t\r\n,:/$")] = True
+# fields kept after normalisation: date/time (0-5), total field (6),
+# latitude "N38 23.9884" (26, 27) and longitude "E141 55.6470" (28, 29)
+_TIME_FIELDS = (0, 1, 2, 3, 4, 5)
+_MAG_FIELD = 6
+_LAT_FIELDS = (26, 27)
+_LON_FIELDS = (28, 29)
+_MAX_TOKEN = 24
+
+
+def tokenize_proton(buf, first_line: int = 1) -> tuple[pd.DataFrame, list[int], int]:
+    """Parse proton ``.dat`` records from *buf* (bytes, memoryview or mmap slice).
+
+    Tokens are located with byte masks over the whole buffer and only the
+    fields listed above are decoded, straight from the bytes.  Returns the
+    records (``Year`` … ``Second``, ``Latitude``, ``Longitude``, ``Tmag``),
+    the line numbers (counted from *first_line*) that could not be decoded,
+    and the number of lines in *buf*.  Blank lines are ignored silently.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord("\n"))
+    line_start = np.concatenate(([0], newlines + 1))
+    if len(data) == 0 or data[-1] == ord("\n"):
+        line_start = line_start[:-1]
+    n_lines = len(line_start)
+
+    delim = _DELIMITER.take(data)
+    # token boundaries are the positions where delimiter/body alternate
+    edges = np.flatnonzero(delim[1:] != delim[:-1]) + 1
+    if len(data) and not delim[0]:
+        edges = np.concatenate(([0], edges))
+    if len(data) and not delim[-1]:
+        edges = np.append(edges, len(data))
+    starts, ends = edges[0::2], edges[1::2]
+    # the k-th field of line l is token first_tok[l] + k (tokens never span lines)
+    first_tok = np.searchsorted(starts, line_start)
+    n_tok = np.diff(np.append(first_tok, len(starts)))
+
+    def field(k):
+        pos = np.full((n_lines, 2), -1, dtype=np.int64)
+        has = n_tok > k
+        pos[has, 0] = starts[first_tok[has] + k]
+        pos[has, 1] = ends[first_tok[has] + k]
+        return _token_chars(data, pos)
+
+    year, month, day, hour, minute, second = (_parse_number(*field(k))[0] for k in _TIME_FIELDS)
+    mag, _ = _parse_number(*field(_MAG_FIELD))
+    lat = _parse_coord(field(_LAT_FIELDS[0]), field(_LAT_FIELDS[1]))
+    lon = _parse_coord(field(_LON_FIELDS[0]), field(_LON_FIELDS[1]))
+
+    with np.errstate(invalid="ignore"):
+        ok = ((year >= 1) & (year <= 9999) & (month >= 1) & (month <= 12) & (day >= 1)
+              & (hour >= 0) & (hour < 24) & (minute >= 0) & (minute < 60)
+              & (second >= 0) & (second < 60)
+              & np.isfinite(lat) & np.isfinite(lon))
+        for v in (year, month, day, hour, minute):
+            ok &= v == np.floor(v)
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    days_in_month = ((months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64)
+    ok &= day <= days_in_month
+
+    bad_lines = (np.flatnonzero(~ok & (n_tok > 0)) + first_line).tolist()
+
+    records = pd.DataFrame({
+        "Year": year[ok].astype(np.int64),
+        "Month": month[ok].astype(np.int64),
+        "Day": day[ok].astype(np.int64),
+        "Hour": hour[ok].astype(np.int64),
+        "Minute": minute[ok].astype(np.int64),
+        "Second": second[ok],
+        "Latitude": lat[ok],
+        "Longitude": lon[ok],
+        "Tmag": mag[ok],
+    })
+    return records, bad_lines, n_lines
+
+
+def _token_chars(data: np.ndarray, pos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gather tokens at ``pos[:, 0]:pos[:, 1]`` into a left-aligned byte matrix and validity mask."""
+    length = np.where(pos[:, 0] >= 0, pos[:, 1] - pos[:, 0], 0)
+    width = int(min(length.max(initial=1), _MAX_TOKEN))
+    idx = pos[:, :1] + np.arange(width)
+    valid = np.arange(width) < length[:, None]
+    chars = np.where(valid, data[np.clip(idx, 0, max(len(data) - 1, 0))] if len(data) else 0, 0).astype(np.uint8)
+    valid[length > _MAX_TOKEN] = False
+    return chars, valid
+
+
+def _parse_number(chars: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Decode ``[+-]digits[.digits]`` tokens; returns values (NaN if invalid) and the sign mask.
+
+    Mantissa and scale are exact integers, so the single division rounds
+    exactly like ``float(token)``.
+    """
+    n = len(chars)
+    mant = np.zeros(n, dtype=np.int64)
+    n_frac = np.zeros(n, dtype=np.int64)
+    n_digits = np.zeros(n, dtype=np.int64)
+    started = np.zeros(n, dtype=bool)
+    dotted = np.zeros(n, dtype=bool)
+    negative = np.zeros(n, dtype=bool)
+    bad = np.zeros(n, dtype=bool)
+    for j in range(chars.shape[1]):
+        c, v = chars[:, j], valid[:, j]
+        digit = v & (c >= ord("0")) & (c <= ord("9"))
+        dot = v & (c == ord("."))
+        sign = v & ~started & ((c == ord("+")) | (c == ord("-")))
+        bad |= v & ~(digit | dot | sign) | (dot & dotted)
+        mant = np.where(digit, mant * 10 + (c.astype(np.int64) - ord("0")), mant)
+        n_frac += digit & dotted
+        n_digits += digit
+        negative |= sign & (c == ord("-"))
+        dotted |= dot
+        started |= v
+    bad |= (n_digits == 0) | (n_digits > 15)
+    value = mant / 10.0 ** n_frac
+    value = np.where(negative, -value, value)
+    value[bad] = np.nan
+    return value, negative
 
 
-def _parse_coord(deg_col: pd.Series, min_col: pd.Series) -> pd.Series:
-    """Return decimal degrees from degree/minute + hemisphere columns."""
-    hemi = deg_col.str.extract(r"([NSEWnsew])", expand=False).str.upper()
-    deg_abs = pd.to_numeric(deg_col.str.extract(r"([0-9]+)", expand=False), errors="coerce")
-    minutes = pd.to_numeric(min_col, errors="coerce")
-    sign = np.where(hemi.isin(["S", "W"]), -1.0, 1.0)
-    sign = np.where(deg_col.str.contains(r"-"), -1.0, sign)
-    return sign * (deg_abs + minutes/60)
\ No newline at end of file
+def _parse_coord(deg_tok, min_tok) -> np.ndarray:
+    """Return decimal degrees from hemisphere+degree tokens (``N38``, ``E141``, ``-38``)
+    and a minutes token, decoded together in one vectorized step."""
+    chars, valid = deg_tok
+    hemi = valid[:, 0] & np.isin(chars[:, 0] & 0xDF, list(b"NSEW"))
+    south_west = hemi & np.isin(chars[:, 0] & 0xDF, list(b"SW"))
+    valid = valid.copy()
+    valid[:, 0] &= ~hemi
+    degrees, negative = _parse_number(chars, valid)
+    minutes, _ = _parse_number(*min_tok)
+    sign = np.where(south_west | negative, -1.0, 1.0)
+    return sign * (np.abs(degrees) + minutes / 60)
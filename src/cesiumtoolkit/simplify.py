@@ -0,0 +1,177 @@
+"""
+simplify.py — Iterative, vectorized Ramer–Douglas–Peucker line simplification.
+
+:func:`rdp_mask` gives the same keep-mask as ``rdp.rdp(points, epsilon,
+return_mask=True)`` of the ``rdp`` package, without its per-point Python
+loop: pending ranges are kept on an explicit stack (no recursion limit) and
+every pass computes the perpendicular distances of the interior points of
+all pending ranges in one array operation, so a full-rate track of
+millions of fixes is simplified in seconds.
+
+Breakpoints are bit-identical to ``rdp``: distances are evaluated with the
+same floating-point operations, and the few ranges whose split decision
+could depend on the last bit (a maximum within rounding of ``epsilon``, or
+near-ties for the farthest point) are re-evaluated exactly as ``rdp.pldist``
+does.
+
+Two options go beyond the ``rdp`` package:
+
+* :func:`radial_mask` — radial-distance pre-thinning: a point is kept only
+  if it lies at least a given distance from the previously kept one, which
+  makes the cost near-linear on densely sampled tracks;
+* :func:`local_metres` — lon/lat projected to metres on a local
+  equirectangular plane, so that ``epsilon`` can be given in metres.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+__all__ = ["rdp_mask", "radial_mask", "local_metres"]
+
+_EARTH_RADIUS_M = 6_371_000.0
+_ROUNDING = 1e-12       # relative margin within which a decision is re-checked exactly
+_RADIAL_WINDOW = 64     # points scanned at a time for the next radially distant one
+
+
+def _exact_range(points, start, end):
+    # farthest interior point of [start, end] and its distance, as rdp._rdp_iter / rdp.pldist
+    first, last, inner = points[start], points[end], points[start + 1:end]
+    if np.all(np.equal(first, last)):
+        d = np.array([np.linalg.norm(p - first) for p in inner])
+    else:
+        a, b = last - first, first - inner
+        c = a[0] * b[:, 1] - a[1] * b[:, 0]
+        d = np.sqrt(c * c) / np.linalg.norm(a)
+    d = np.where(np.isnan(d), -np.inf, d)
+    i = int(np.argmax(d)) if len(d) else 0
+    return (start + 1 + i, float(d[i])) if len(d) and d[i] > 0 else (start, 0.0)
+
+
+def rdp_mask(points, epsilon: float) -> np.ndarray:
+    """
+    Keep-mask of Ramer–Douglas–Peucker simplification of *points* (``n × 2``).
+
+    Parameters
+    ----------
+    points : array_like
+        Vertices of the line, e.g. ``column_stack([lon, lat])``.
+    epsilon : float
+        Largest perpendicular distance (in the units of *points*) of a
+        dropped vertex from the simplified line; must be >= 0.
+
+    Returns
+    -------
+    ndarray of bool
+        True for the kept vertices (first and last included); identical to
+        ``rdp.rdp(points, epsilon, return_mask=True)``.
+    """
+    if epsilon < 0:
+        raise ValueError(f"epsilon must be >= 0, got {epsilon}")
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    mask = np.zeros(n, dtype=bool)
+    if n == 0:
+        return mask
+    mask[[0, -1]] = True
+
+    starts, ends = np.array([0]), np.array([n - 1])
+    while len(starts):
+        inner = ends - starts - 1
+        starts, ends, inner = starts[inner > 0], ends[inner > 0], inner[inner > 0]
+        if not len(starts):
+            break
+
+        # interior points of every pending range, flattened; owner = their range
+        offsets = np.concatenate([[0], np.cumsum(inner)[:-1]])
+        owner = np.repeat(np.arange(len(starts)), inner)
+        idx = np.arange(inner.sum()) - offsets[owner] + starts[owner] + 1
+        first, last = points[starts], points[ends]
+        a = last - first
+        b = first[owner] - points[idx]
+        c = a[owner, 0] * b[:, 1] - a[owner, 1] * b[:, 0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            d = np.sqrt(c * c) / np.sqrt(a[:, 0] * a[:, 0] + a[:, 1] * a[:, 1])[owner]
+            degenerate = np.all(a == 0, axis=1)[owner]  # start == end: distance to the point
+            d[degenerate] = np.sqrt(b[degenerate, 0] ** 2 + b[degenerate, 1] ** 2)
+
+            dmax = np.fmax.reduceat(d, offsets)
+            hit = np.flatnonzero(d == dmax[owner])
+            ranges, first_hit = np.unique(owner[hit], return_index=True)  # first farthest point per range
+            index = np.array(starts)
+            index[ranges] = idx[hit[first_hit]]
+            near = np.add.reduceat(d >= dmax[owner] * (1 - _ROUNDING), offsets)
+
+        # ranges whose decision may depend on rounding: recomputed exactly, as rdp does
+        ambiguous = (dmax > 0) & ((near > 1) | (np.abs(dmax - epsilon) <= _ROUNDING * np.fmax(dmax, epsilon)))
+        for r in np.flatnonzero(ambiguous):
+            index[r], dmax[r] = _exact_range(points, starts[r], ends[r])
+
+        split = dmax > epsilon
+        mask[index[split]] = True
+        starts, ends = (np.concatenate([starts[split], index[split]]),
+                        np.concatenate([index[split], ends[split]]))
+    return mask
+
+
+def radial_mask(points, tolerance: float) -> np.ndarray:
+    """
+    Keep-mask of radial-distance thinning: from the first point on, the next
+    kept point is the first one at least *tolerance* (units of *points*)
+    from the previously kept one; the last point is always kept.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    mask = np.zeros(n, dtype=bool)
+    if n == 0:
+        return mask
+    mask[[0, -1]] = True
+    tol2 = float(tolerance) ** 2
+
+    # successor of every point (first one far enough), looked up _RADIAL_WINDOW offsets ahead
+    # for all points at once; n = none before the end, -1 = not within the window
+    successor = np.full(n, n, dtype=np.int64)
+    pending = np.arange(n - 1)
+    for k in range(1, _RADIAL_WINDOW + 1):
+        pending = pending[pending + k < n]
+        if not len(pending):
+            break
+        delta = points[pending + k] - points[pending]
+        far = delta[:, 0] ** 2 + delta[:, 1] ** 2 >= tol2
+        successor[pending[far]] = pending[far] + k
+        pending = pending[~far]
+    else:
+        successor[pending[pending + _RADIAL_WINDOW + 1 < n]] = -1
+
+    successor, kept = successor.tolist(), 0
+    while True:
+        nxt = successor[kept]
+        if nxt < 0:  # farther than the window: scan on in growing blocks
+            nxt, lo, window = n, kept + _RADIAL_WINDOW + 1, 2 * _RADIAL_WINDOW
+            while lo < n:
+                delta = points[lo:lo + window] - points[kept]
+                far = np.flatnonzero(delta[:, 0] ** 2 + delta[:, 1] ** 2 >= tol2)
+                if len(far):
+                    nxt = lo + int(far[0])
+                    break
+                lo, window = lo + window, window * 2
+        if nxt >= n:
+            return mask
+        mask[nxt] = True
+        kept = nxt
+
+
+def local_metres(lon, lat) -> np.ndarray:
+    """
+    ``n × 2`` east/north coordinates [m] of the points on an equirectangular
+    plane centred on them (longitudes unwrapped across 180°).
+    """
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    if not len(lon):
+        return np.zeros((0, 2))
+    lat0 = np.nanmean(lat)
+    lon0 = np.degrees(np.arctan2(np.nanmean(np.sin(np.radians(lon))), np.nanmean(np.cos(np.radians(lon)))))
+    east = np.radians((lon - lon0 + 180.0) % 360.0 - 180.0) * _EARTH_RADIUS_M * np.cos(np.radians(lat0))
+    north = np.radians(lat - lat0) * _EARTH_RADIUS_M
+    return np.column_stack([east, north])
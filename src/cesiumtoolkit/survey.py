@@ -0,0 +1,181 @@
+"""
+survey.py — In-memory survey model passed between the processing stages.
+
+Every stage exposes a ``process_survey(survey) -> Survey`` method; the
+directory methods (``process_directory``, ``run`` ...) only read a stage
+file into a :class:`Survey`, call it, and write the result.  A complete run
+can therefore stay in memory::
+
+    survey = CESIUMRAW2ANMORG(d).load_survey("Export.G-880.txt")
+    survey = ANMORG1MIN(d).process_survey(survey)
+    survey = CABLECORRECTION(d).process_survey(survey)
+    survey = IGRFCORRECTION(d).process_survey(survey)
+    survey = DVCORRECTION(d, d + "/dv").process_survey(survey)
+    tracks = splitter().split_survey(survey)
+"""
+
+from __future__ import annotations
+
+import dataclasses
+from dataclasses import dataclass, field as dc_field
+from pathlib import Path
+from typing import Iterator, Mapping
+
+import numpy as np
+import pandas as pd
+
+from .columnar import is_columnar, read_columnar, read_stage, write_stage
+
+
+__all__ = ["Survey"]
+
+# stage-file column names of the core Survey columns
+_CORE = {"DateTime": "time", "Latitude": "lat", "Longitude": "lon", "Tmag": "field", "segment": "segment"}
+
+
+@dataclass
+class Survey:
+    """
+    Magnetic survey held as equal-length column arrays.
+
+    Parameters
+    ----------
+    time : ndarray of int64
+        Nanoseconds since 1970-01-01 UTC (same as the ``.anmc`` ``time`` column).
+    lat, lon : ndarray of float64
+        Position in degrees; after cable correction this is the sensor position.
+    field : ndarray of float64
+        Observed total field [nT] (``Tmag``).
+    segment : ndarray of int64, optional
+        Gap/segment id per sample (``ANMORG1MIN`` splits on 1 h gaps,
+        ``splitter`` on RDP tracks).  Defaults to all zeros.
+    extra : dict of str to ndarray
+        Further per-sample columns added by the stages (``anm``, ``dv``,
+        ``F_last``, ``gps_lat`` ...).
+    provenance : list of dict
+        One entry per stage applied: ``{"stage": ..., **parameters}``.
+    name : str
+        Name of the file the survey was read from, used to name outputs.
+    """
+
+    time: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    field: np.ndarray
+    segment: np.ndarray | None = None
+    extra: dict[str, np.ndarray] = dc_field(default_factory=dict)
+    provenance: list[dict] = dc_field(default_factory=list)
+    name: str = ""
+
+    def __post_init__(self) -> None:
+        self.time = np.asarray(self.time, dtype=np.int64)
+        self.lat = np.asarray(self.lat, dtype=np.float64)
+        self.lon = np.asarray(self.lon, dtype=np.float64)
+        self.field = np.asarray(self.field, dtype=np.float64)
+        n = len(self.time)
+        self.segment = (np.zeros(n, dtype=np.int64) if self.segment is None
+                        else np.asarray(self.segment, dtype=np.int64))
+        self.extra = {name: np.asarray(values) for name, values in self.extra.items()}
+        for name, values in [("lat", self.lat), ("lon", self.lon), ("field", self.field),
+                             ("segment", self.segment), *self.extra.items()]:
+            if len(values) != n:
+                raise ValueError(f"column {name!r} has {len(values)} rows, expected {n}")
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @property
+    def datetime(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.time.view("datetime64[ns]"))
+
+    def column(self, name: str) -> np.ndarray:
+        """Return a core (``time``, ``lat``, ``lon``, ``field``, ``segment``) or extra column."""
+        if name in ("time", "lat", "lon", "field", "segment"):
+            return getattr(self, name)
+        return self.extra[name]
+
+    # -- derived surveys ------------------------------------------------------
+    def replace(self, **changes) -> "Survey":
+        """Copy with some core attributes replaced (``lat=...``, ``extra=...``)."""
+        return dataclasses.replace(self, **changes)
+
+    def with_columns(self, **columns: np.ndarray) -> "Survey":
+        """Copy with extra columns added or replaced."""
+        return self.replace(extra={**self.extra, **columns})
+
+    def with_step(self, stage: str, **params) -> "Survey":
+        """Copy with a provenance entry appended."""
+        return self.replace(provenance=[*self.provenance, {"stage": stage, **params}])
+
+    def take(self, index) -> "Survey":
+        """Rows selected by a boolean mask, slice or integer index array."""
+        return self.replace(time=self.time[index], lat=self.lat[index], lon=self.lon[index],
+                            field=self.field[index], segment=self.segment[index],
+                            extra={name: values[index] for name, values in self.extra.items()})
+
+    def segments(self) -> Iterator["Survey"]:
+        """Yield one survey per run of equal ``segment`` ids, in order."""
+        if not len(self):
+            return
+        cuts = np.flatnonzero(np.diff(self.segment)) + 1
+        for start, stop in zip(np.r_[0, cuts], np.r_[cuts, len(self)]):
+            yield self.take(slice(start, stop))
+
+    @classmethod
+    def concat(cls, surveys: list["Survey"]) -> "Survey":
+        """Join surveys with the same extra columns; provenance and name come from the first."""
+        if not surveys:
+            raise ValueError("no surveys to concatenate")
+        first = surveys[0]
+        return cls(
+            time=np.concatenate([s.time for s in surveys]),
+            lat=np.concatenate([s.lat for s in surveys]),
+            lon=np.concatenate([s.lon for s in surveys]),
+            field=np.concatenate([s.field for s in surveys]),
+            segment=np.concatenate([s.segment for s in surveys]),
+            extra={name: np.concatenate([s.extra[name] for s in surveys]) for name in first.extra},
+            provenance=list(first.provenance),
+            name=first.name,
+        )
+
+    # -- DataFrame / stage-file conversion ------------------------------------
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame with the stage-file column names (``DateTime``, ``Latitude`` ...)."""
+        df = pd.DataFrame({"DateTime": self.datetime, "Latitude": self.lat, "Longitude": self.lon,
+                           "Tmag": self.field, "segment": self.segment})
+        for name, values in self.extra.items():
+            df[name] = values
+        return df
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, *, name: str = "",
+                   provenance: list[dict] | None = None) -> "Survey":
+        """Inverse of :meth:`to_frame`; columns other than the core ones become ``extra``."""
+        time = pd.DatetimeIndex(df["DateTime"]).as_unit("ns").asi8
+        return cls(
+            time=time,
+            lat=df["Latitude"].to_numpy(dtype=np.float64),
+            lon=df["Longitude"].to_numpy(dtype=np.float64),
+            field=df["Tmag"].to_numpy(dtype=np.float64),
+            segment=df["segment"].to_numpy() if "segment" in df else None,
+            extra={col: df[col].to_numpy() for col in df.columns if col not in _CORE},
+            provenance=list(provenance or []),
+            name=name,
+        )
+
+    @classmethod
+    def read(cls, path: str | Path, fields) -> "Survey":
+        """Read an intermediate stage file (ASCII layout *fields*, or its ``.anmc`` twin)."""
+        path = Path(path)
+        provenance = []
+        if is_columnar(path):  # columnar files carry the provenance of the survey written
+            _, header = read_columnar(path)
+            provenance = list(header.get("meta", {}).get("provenance", []))
+        provenance.append({"stage": "read", "path": str(path)})
+        return cls.from_frame(read_stage(path, fields), name=path.name, provenance=provenance)
+
+    def write(self, path: str | Path, fields, *, binary: bool = False, stage: str = "",
+              meta: Mapping | None = None) -> Path:
+        """Write as the ASCII layout *fields* (or ``.anmc`` with *binary*); returns the path."""
+        meta = {"provenance": self.provenance, **(meta or {})}
+        return write_stage(path, self.to_frame(), fields, binary=binary, stage=stage, meta=meta)
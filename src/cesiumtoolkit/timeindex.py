@@ -0,0 +1,175 @@
+"""
+timeindex.py — Sidecar time → byte-offset index for raw G-880 ``.txt`` and proton ``.dat`` logs.
+
+``foo.txt`` gets ``foo.txt.tidx`` (a columnar ``.anmc``-format file, see
+:mod:`columnar`) holding the time and byte offset of every ``stride``-th
+data line.  It is built in one pass over a memory map and rebuilt
+automatically when the log's size or mtime changes.  A time window is then
+read by binary search over the index plus one seek, so only the lines of
+the window (rounded out to the nearest index entries) are touched.
+
+Logs are assumed to be in time order, as written by the loggers; lines of
+the window are filtered exactly by time after parsing.
+"""
+
+from __future__ import annotations
+
+import mmap
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .columnar import read_columnar, write_columnar
+
+
+__all__ = ["INDEX_SUFFIX", "index_path", "build_time_index", "load_time_index", "window_bytes", "extract_window"]
+
+INDEX_SUFFIX = ".tidx"
+_BLOCK = 64 << 20
+_STAMP_BYTES = 24  # "$2022/12/02 08:53:40" / "09/29/24 23:30:00.000"
+
+
+def index_path(path: str | Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def _is_proton(path: Path) -> bool:
+    return path.suffix == ".dat"
+
+
+def _parse_stamps(stamps: list[bytes], proton: bool) -> np.ndarray:
+    """int64 ns (``NaT`` → int64 min) of the line prefixes *stamps*."""
+    if proton:
+        text = [s.lstrip(b"$")[:19].decode("ascii", "replace") for s in stamps]
+        times = pd.to_datetime(text, format="%Y/%m/%d %H:%M:%S", errors="coerce")
+    else:
+        text = [b" ".join(s.split()[:2]).decode("ascii", "replace") for s in stamps]
+        times = pd.to_datetime(text, format="%m/%d/%y %H:%M:%S.%f", errors="coerce")
+    return pd.DatetimeIndex(times).as_unit("ns").asi8
+
+
+def build_time_index(path: str | Path, stride: int = 1000) -> Path:
+    """
+    Index every *stride*-th data line of *path* and write ``path + ".tidx"``.
+
+    Returns the index path.  Lines whose timestamp cannot be parsed are
+    left out of the index (they are still read as part of a window).
+    """
+    path = Path(path)
+    proton = _is_proton(path)
+    st = path.stat()
+    header_end, n_lines = 0, 0
+    offsets, stamps = np.empty(0, dtype=np.int64), []
+    if st.st_size:
+        with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if not proton:  # G-880 exports start with a column header line
+                header_end = mm.find(b"\n") + 1 or st.st_size
+            starts = [np.array([header_end], dtype=np.int64)]
+            for start in range(header_end, st.st_size, _BLOCK):
+                block = np.frombuffer(mm[start:start + _BLOCK], dtype=np.uint8)
+                starts.append(np.flatnonzero(block == ord("\n")).astype(np.int64) + start + 1)
+            line_start = np.concatenate(starts)
+            line_start = line_start[line_start < st.st_size]
+            n_lines = len(line_start)
+            offsets = line_start[::stride]
+            if n_lines and offsets[-1] != line_start[-1]:
+                offsets = np.append(offsets, line_start[-1])  # always index the last line
+            stamps = [mm[o:o + _STAMP_BYTES] for o in offsets.tolist()]
+    times = _parse_stamps(stamps, proton) if stamps else np.empty(0, dtype=np.int64)
+    ok = times != np.iinfo(np.int64).min
+    times, offsets = times[ok], offsets[ok]
+    if np.any(np.diff(times) < 0):
+        print(f"!! {path.name}: timestamps go backwards; time windows may miss lines")
+
+    out = index_path(path)
+    write_columnar(out, {"time": times, "offset": offsets}, stage="timeindex",
+                   meta={"source": path.name, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                         "stride": stride, "lines": int(n_lines),
+                         "header_end": header_end})
+    return out
+
+
+def load_time_index(path: str | Path, stride: int = 1000) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Return ``(times, offsets, meta)`` for *path*, (re)building the sidecar
+    when it is missing or older than the log.
+    """
+    path = Path(path)
+    sidecar = index_path(path)
+    st = path.stat()
+    meta = None
+    if sidecar.exists():
+        try:
+            columns, header = read_columnar(sidecar, mmap=False)
+            meta = header["meta"]
+        except (OSError, ValueError, KeyError):
+            meta = None
+    if meta is None or meta.get("size") != st.st_size or meta.get("mtime_ns") != st.st_mtime_ns:
+        print(f"> Building time index {sidecar.name}")
+        columns, header = read_columnar(build_time_index(path, stride), mmap=False)
+        meta = header["meta"]
+    return columns["time"], columns["offset"], meta
+
+
+def _to_ns(value) -> int | None:
+    return None if value is None else pd.Timestamp(value).value
+
+
+def window_bytes(path: str | Path, start=None, end=None, with_header: bool = True) -> bytes:
+    """
+    Bytes of the lines of *path* that may fall in ``[start, end]``.
+
+    The range is rounded out to index entries, so it can contain up to
+    ``stride`` lines on either side; callers filter by time after parsing.
+    For G-880 exports the header line is prepended unless *with_header* is
+    false.  *start*/*end* accept anything ``pandas.Timestamp`` does;
+    ``None`` leaves that side open.
+    """
+    path = Path(path)
+    times, offsets, meta = load_time_index(path)
+    size, header_end = meta["size"], meta["header_end"]
+    t0, t1 = _to_ns(start), _to_ns(end)
+
+    lo = header_end
+    if t0 is not None and len(times):
+        i = np.searchsorted(times, t0, side="left") - 1
+        lo = int(offsets[i]) if i >= 0 else header_end
+    hi = size
+    if t1 is not None and len(times):
+        j = np.searchsorted(times, t1, side="right")
+        hi = int(offsets[j]) if j < len(offsets) else size
+
+    with open(path, "rb") as fh:
+        header = fh.read(header_end) if with_header else b""
+        fh.seek(lo)
+        body = fh.read(max(hi - lo, 0))
+    if body and not body.endswith(b"\n"):
+        body += b"\n"
+    return header + body
+
+
+def extract_window(path: str | Path, output_path: str | Path, start=None, end=None) -> int:
+    """
+    Copy the lines of *path* with timestamps in ``[start, end]`` to
+    *output_path* (header line included for G-880 exports).  Returns the
+    number of data lines written.
+    """
+    path = Path(path)
+    proton = _is_proton(path)
+    data = window_bytes(path, start, end, with_header=False)
+    lines = data.splitlines(keepends=True)
+    times = _parse_stamps([line[:_STAMP_BYTES] for line in lines], proton) if lines else np.empty(0, np.int64)
+    keep = times != np.iinfo(np.int64).min
+    if start is not None:
+        keep &= times >= _to_ns(start)
+    if end is not None:
+        keep &= times <= _to_ns(end)
+
+    with open(path, "rb") as fh:
+        header = b"" if proton else fh.readline()
+    with open(output_path, "wb") as out:
+        out.write(header)
+        out.writelines(line for line, k in zip(lines, keep) if k)
+    return int(keep.sum())
@@ -11,12 +11,18 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
-from rdp import rdp
+
+from .fixedwidth import TRK_FIELDS, subsecond, write_fixed_width
+from .manifest import BuildManifest, manifest_step
+from .preview import DEFAULT_MAX_POINTS, is_headless, lttb_indices, share_points, write_html
+from .simplify import local_metres, radial_mask, rdp_mask
+from .survey import Survey
 
 
 __all__ = ["TRKSplitter", "splitter"]
 
+EPSILON_UNITS = ("deg", "m")
+
 
 class splitter:
     """
@@ -25,14 +31,30 @@ class splitter:
     Parameters
     ----------
     epsilon : float, default 0.001
-        Epsilon parameter (degrees) for the RDP algorithm.
+        Epsilon parameter for the RDP algorithm, in *units*.
+    units : {"deg", "m"}, default "deg"
+        ``"deg"``: RDP on raw lon/lat degrees (as the ``rdp`` package was
+        used); ``"m"``: on metres of a local projection of each segment.
+    radial : float or None, default None
+        Radial-distance pre-thinning (in *units*) before RDP: only points
+        at least this far from the previously kept one are candidates.
+        Near-linear cost on dense full-rate tracks; None = off.
     min_distance_km : float, default 2.0
         Threshold: segments shorter than this are tagged as ``skipped``.
+    preview_points : int or None, default 5000
+        Cap on points in the HTML map, shared by the tracks (None = all).
     """
 
-    def __init__(self, *, epsilon: float = 0.001, min_distance_km: float = 2.0) -> None:
+    def __init__(self, *, epsilon: float = 0.001, min_distance_km: float = 2.0,
+                 preview_points: int | None = DEFAULT_MAX_POINTS, units: str = "deg",
+                 radial: float | None = None) -> None:
+        if units not in EPSILON_UNITS:
+            raise ValueError(f"unknown units {units!r}; expected one of {EPSILON_UNITS}")
         self.epsilon = float(epsilon)
+        self.units = units
+        self.radial = radial
         self.min_distance_km = float(min_distance_km)
+        self.preview_points = preview_points
 
     def split(self, filepath: str | Path) -> Path:
         """
@@ -65,16 +87,12 @@ class splitter:
             print("!!  input file is empty – nothing to do.")
             return fp.parent
 
-        coords = df[["lon", "lat"]].to_numpy()
-
-        # -- 2) RDP split --
-        mask = rdp(coords, epsilon=self.epsilon, return_mask=True)
-        idx = np.flatnonzero(mask)
-        if idx[0] != 0:
-            idx = np.insert(idx, 0, 0)
-        if idx[-1] != len(df) - 1:
-            idx = np.append(idx, len(df) - 1)
-        boundaries = np.append(idx, len(df))
+        unixtime = df["unixtime"].to_numpy()
+        # full-rate .trk files (DVCORRECTION(full_rate=True)) carry fractional seconds
+        trk_fields = subsecond(TRK_FIELDS) if np.any(unixtime % 1) else TRK_FIELDS
+        survey = Survey(time=np.round(unixtime * 10**9), lat=df["lat"].to_numpy(),
+                        lon=df["lon"].to_numpy(), field=df["mag"].to_numpy(), name=fp.name)
+        tracks = self.split_survey(survey)
 
         # -- 3) Output dirs --
         tag       = _dt.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -85,49 +103,107 @@ class splitter:
         skip_dir.mkdir(exist_ok=True)
 
         # -- 4) Save --
-        track_id      = 0
-        track_vec     = np.full(len(df), -1, dtype=int)
-        category_vec  = np.empty(len(df), dtype=object)
-
-        for s, e in zip(boundaries[:-1], boundaries[1:]):
-            seg = df.iloc[s:e]
-            seg_len = _segment_length(seg[["lon", "lat"]].to_numpy())
-            is_main = seg_len >= self.min_distance_km * 1_000.0
-            outdir  = main_dir if is_main else skip_dir
-            category = "main" if is_main else "skipped"
-
-            (outdir / f"track{track_id:02d}.trk").write_text(
-                "\n".join(
-                    f"{int(t):d} {lon:.7f} {lat:.7f} {mag:.1f}"
-                    for t, lon, lat, mag in seg.to_numpy()
-                ),
-                encoding="utf-8",
+        track_vec     = tracks.segment
+        category_vec  = np.where(tracks.extra["main"], "main", "skipped").astype(object)
+
+        for seg in tracks.segments():
+            track_id = int(seg.segment[0])
+            category = "main" if seg.extra["main"][0] else "skipped"
+            outdir  = main_dir if seg.extra["main"][0] else skip_dir
+
+            write_fixed_width(
+                outdir / f"track{track_id:02d}.trk",
+                {"unixtime": unixtime[seg.extra["row"]], "lon": seg.lon,
+                 "lat": seg.lat, "mag": seg.field},
+                trk_fields,
+                final_newline=False,
             )
+            print(f" > Saved {category}: track{track_id:02d}.trk ({seg.extra['length_m'][0]/1000:.2f} km)")
 
-            track_vec[s:e]    = track_id
-            category_vec[s:e] = category
-            print(f" > Saved {category}: track{track_id:02d}.trk ({seg_len/1000:.2f} km)")
-            track_id += 1
-
-        df_plot = df.assign(track=track_vec, category=category_vec)
-        _save_plot(df_plot, base_dir / f"{fp.stem}.html")
-        print(f"\n > HTML visualisation → {base_dir / (fp.stem + '.html')}\n")
+        if not is_headless():
+            df_plot = df.assign(track=track_vec, category=category_vec)
+            _save_plot(df_plot, base_dir / f"{fp.stem}.html", self.preview_points)
+            print(f"\n > HTML visualisation → {base_dir / (fp.stem + '.html')}\n")
 
         return base_dir
 
+    def split_survey(self, survey: Survey) -> Survey:
+        """
+        Split *survey* into straight tracks without touching the disk.
+
+        Each incoming segment is simplified with RDP on its own; the result
+        has ``segment`` set to consecutive track ids and the extra columns
+        ``main`` (track at least ``min_distance_km`` long), ``length_m`` (track
+        length) and ``row`` (index of the sample in *survey*).  When the
+        survey carries ``F_last`` (after DVCORRECTION) it becomes ``field``,
+        as in the ``.trk`` files.
+        """
+        if "F_last" in survey.extra:
+            survey = survey.replace(field=survey.extra["F_last"])
+        survey = survey.with_columns(row=np.arange(len(survey)))
+
+        parts, track_id = [], 0
+        for part in survey.segments():
+            coords = np.column_stack([part.lon, part.lat])
+
+            # -- RDP split --
+            idx = np.flatnonzero(self.breakpoints(coords))
+            if idx[0] != 0:
+                idx = np.insert(idx, 0, 0)
+            if idx[-1] != len(part) - 1:
+                idx = np.append(idx, len(part) - 1)
+            boundaries = np.append(idx, len(part))
+
+            for s, e in zip(boundaries[:-1], boundaries[1:]):
+                seg = part.take(slice(s, e))
+                seg_len = _segment_length(coords[s:e])
+                n = len(seg)
+                parts.append(seg.replace(segment=np.full(n, track_id)).with_columns(
+                    main=np.full(n, seg_len >= self.min_distance_km * 1_000.0),
+                    length_m=np.full(n, seg_len)))
+                track_id += 1
+
+        if not parts:
+            return survey.with_columns(main=np.zeros(0, dtype=bool), length_m=np.zeros(0))
+        return Survey.concat(parts).with_step("split", epsilon=self.epsilon, units=self.units,
+                                              radial=self.radial, min_distance_km=self.min_distance_km)
+
+    def breakpoints(self, coords: np.ndarray) -> np.ndarray:
+        """RDP keep-mask of the ``(lon, lat)`` rows *coords*, in ``units``, after optional radial thinning."""
+        points = coords if self.units == "deg" else local_metres(coords[:, 0], coords[:, 1])
+        if self.radial is None:
+            return rdp_mask(points, self.epsilon)
+        candidates = np.flatnonzero(radial_mask(points, self.radial))
+        mask = np.zeros(len(points), dtype=bool)
+        mask[candidates[rdp_mask(points[candidates], self.epsilon)]] = True
+        return mask
+
 
 def TRKSplitter(
     input_dir: str | Path,
     *,
     epsilon: float = 0.001,
     min_distance_km: float = 2.0,
+    manifest: BuildManifest | None = None,
+    preview_points: int | None = DEFAULT_MAX_POINTS,
+    units: str = "deg",
+    radial: float | None = None,
 ) -> Path:
-    splitter_core = splitter(epsilon=epsilon, min_distance_km=min_distance_km)
+    splitter_core = splitter(epsilon=epsilon, min_distance_km=min_distance_km, preview_points=preview_points,
+                             units=units, radial=radial)
     input_dir = Path(input_dir).expanduser()
 
     base_dir = None
     for trk in sorted(input_dir.glob("*.trk")):
+        step = manifest_step(manifest, "split", [trk], code=__file__,
+                             params={"epsilon": epsilon, "min_distance_km": min_distance_km,
+                                     "units": units, "radial": radial})
+        if step.fresh:
+            base_dir = step.outputs[0]
+            print(f" > Up to date, skipped: {trk.name} → {base_dir.name}")
+            continue
         base_dir = splitter_core.split(trk)
+        step.done([base_dir])
 
     if base_dir is None:
         raise RuntimeError("No .trk files were found for splitting.")
@@ -136,25 +212,30 @@ def TRKSplitter(
 
 
 # -- helper functions outside class --
-def _haversine(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+def _haversine(lon1, lat1, lon2, lat2):
+    # great-circle distance [m]; array arguments give the distances element-wise
     R = 6_371_000.0
-    φ1, φ2 = math.radians(lat1), math.radians(lat2)
-    Δφ = math.radians(lat2 - lat1)
-    Δλ = math.radians(lon2 - lon1)
-    a = math.sin(Δφ / 2) ** 2 + math.cos(φ1) * math.cos(φ2) * math.sin(Δλ / 2) ** 2
-    return 2.0 * R * math.asin(math.sqrt(a))
+    φ1, φ2 = np.radians(lat1), np.radians(lat2)
+    Δφ = np.radians(np.subtract(lat2, lat1))
+    Δλ = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(Δφ / 2) ** 2 + np.cos(φ1) * np.cos(φ2) * np.sin(Δλ / 2) ** 2
+    return 2.0 * R * np.arcsin(np.sqrt(a))
 
 
 def _segment_length(coords: np.ndarray) -> float:
     if len(coords) < 2:
         return 0.0
-    return sum(
-        _haversine(lon1, lat1, lon2, lat2)
-        for (lon1, lat1), (lon2, lat2) in zip(coords[:-1], coords[1:])
-    )
+    return math.fsum(_haversine(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]))
+
 
+def _save_plot(df: pd.DataFrame, html_path: Path, max_points: int | None = DEFAULT_MAX_POINTS) -> None:
+    import plotly.express as px
 
-def _save_plot(df: pd.DataFrame, html_path: Path) -> None:
+    # each track keeps its share of max_points, chosen by LTTB on (lon, lat) to keep the track shape
+    groups = [np.flatnonzero(df["track"].to_numpy() == track) for track in pd.unique(df["track"])]
+    keep = [rows[lttb_indices(df["lon"].to_numpy()[rows], df["lat"].to_numpy()[rows], n)] if n else rows
+            for rows, n in zip(groups, share_points([len(rows) for rows in groups], max_points))]
+    df = df.iloc[np.sort(np.concatenate(keep))] if keep else df
     fig = px.scatter_geo(
         df,
         lat="lat",
@@ -165,4 +246,4 @@ def _save_plot(df: pd.DataFrame, html_path: Path) -> None:
         projection="natural earth",
     )
     fig.update_traces(marker=dict(size=4, opacity=0.8))
-    fig.write_html(html_path, include_plotlyjs="cdn")
+    write_html(fig, html_path)
@@ -1,11 +1,35 @@
-from .llaconverter import LLAConverter
-from .lsdconverter import LSDConverter
-from .ishiharahoupipeline import IshiharaPipeline
-from .lncorrection import LWTCorrector
-
-__all__ = [
-    "LLAConverter",
-    "LSDConverter",
-    "IshiharaPipeline",
-    "LWTCorrector",
-]
+"""
+Classes are imported on first use, so ``import ishiharautils`` does not load
+plotly or pygmt until a converter or corrector is actually needed.
+"""
+
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .llaconverter import LLAConverter
+    from .lsdconverter import LSDConverter
+    from .ishiharahoupipeline import IshiharaPipeline
+    from .lncorrection import LWTCorrector
+
+# public name -> submodule defining it
+_LAZY = {
+    "LLAConverter": "llaconverter",
+    "LSDConverter": "lsdconverter",
+    "IshiharaPipeline": "ishiharahoupipeline",
+    "LWTCorrector": "lncorrection",
+}
+
+__all__ = ["LLAConverter", "LSDConverter", "IshiharaPipeline", "LWTCorrector"]  # the keys of _LAZY
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
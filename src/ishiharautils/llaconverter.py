@@ -4,7 +4,10 @@ from datetime import datetime
 import math
 from pathlib import Path
 #
-import plotly.express as px
+import numpy as np
+
+from cesiumtoolkit.fixedwidth import LLA_FIELDS, write_fixed_width
+from cesiumtoolkit.preview import is_headless
 
 class LLAConverter:
     def __init__(self, epsilon=0.001, min_distance_km=2):
@@ -42,20 +45,21 @@ class LLAConverter:
             print(f"Skipped: {Path(filepath).name} (distance < {self.min_distance_km} km)")
             return None
 
-        output_lines = []
-        for _, row in df.iterrows():
-            yymmdd, timestr = self.convert_unix_to_lla_format(row["unixtime"])
-            lon360 = row["lon"] if row["lon"] >= 0 else row["lon"] + 360
-            line = f"{track_number:4d} {yymmdd} {timestr}  {lon360:9.5f} {row['lat']:9.5f} {row['anomaly']:8.2f}"
-            output_lines.append(line)
+        dt = pd.to_datetime(df["unixtime"], unit="s")
+        columns = {
+            "track": np.full(len(df), track_number),
+            "yyyymmdd": dt.dt.year * 10000 + dt.dt.month * 100 + dt.dt.day,
+            "hhmmss": dt.dt.hour * 10000 + dt.dt.minute * 100 + dt.dt.second,
+            "lon": df["lon"].where(df["lon"] >= 0, df["lon"] + 360),
+            "lat": df["lat"],
+            "anomaly": df["anomaly"],
+        }
 
         output_dir = Path(output_dir) if output_dir else Path(filepath).parent / "llaconverted"
         output_dir.mkdir(parents=True, exist_ok=True)
         outpath = output_dir / (Path(filepath).stem + '.lla')
 
-        with open(outpath, 'w') as f:
-            for line in output_lines:
-                f.write(line + '\n')
+        write_fixed_width(outpath, columns, LLA_FIELDS)
 
         print(f" - Saved: {Path(filepath).stem + '.lla'}")
 
@@ -78,6 +82,10 @@ class LLAConverter:
 
 
     def plot_lla(self, filepath):
+        if is_headless():
+            return None
+        import plotly.express as px
+
         df = pd.read_csv(filepath, sep='\s+', header=None,
                          names=["track", "date", "time", "lon", "lat", "anomaly"])
         df["datetime"] = pd.to_datetime(df["date"].astype(str) + df["time"].astype(str),
@@ -1,14 +1,13 @@
 from pathlib import Path
 import pandas as pd
-import plotly.io as pio
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
 import numpy as np
 # import xarray as xr
-import pygmt
 # import rioxarray
 # import rasterio
 
+from cesiumtoolkit.fixedwidth import LNCOR_FIELDS, write_fixed_width
+from cesiumtoolkit.preview import is_headless
+
 class LWTCorrector:
     '''
     Applies leveling corrections to magnetic anomaly data based on line crossing analysis.
@@ -55,20 +54,7 @@ class LWTCorrector:
         offset_map = lwt.groupby(["cruise", "line"])["mag2"].mean().to_dict()
         weight_map = lwt.groupby(["cruise", "line"])["weight"].mean().to_dict()
 
-        results = []
-        for _, row in lsd.iterrows():
-            key = (row["cruise"], row["line"])
-            offset = offset_map.get(key, 0.0)
-            weight = weight_map.get(key, 0.0)
-            corrected_mag = row["mag"] + offset
-
-            result_line = f"{int(row['cruise'])} {int(row['year'])}{int(row['doy_time']):06.0f} 000000" \
-                          f" {row['lon']:.5f} {row['lat']:.5f} {row['mag']:8.2f}" \
-                          f" {corrected_mag:8.2f} {offset:8.4f} {weight:10.5f}"
-            results.append(result_line)
-
-        with open(output_path, "w") as f:
-            f.write("\n".join(results) + "\n")
+        self._write_lncor(lsd, offset_map, weight_map, output_path)
         print(f" - {output_path.name} written.")
 
     def run_iterative(self, output_path: Path = None, max_iter: int = 10, tol: float = 1e-4):
@@ -95,25 +81,32 @@ class LWTCorrector:
                 break
             offset_map.update(updates.to_dict())
 
-        results = []
-        for _, row in lsd.iterrows():
-            key = (row["cruise"], row["line"])
-            offset = offset_map.get(key, 0.0)
-            weight = weight_map.get(key, 0.0)
-            corrected_mag = row["mag"] + offset
-            result_line = f"{int(row['cruise'])} {int(row['year'])}{int(row['doy_time']):06.0f} 000000" \
-                          f" {row['lon']:.5f} {row['lat']:.5f} {row['mag']:8.2f}" \
-                          f" {corrected_mag:8.2f} {offset:8.4f} {weight:10.5f}"
-            results.append(result_line)
-
-        with open(output_path, "w") as f:
-            f.write("\n".join(results) + "\n")
+        self._write_lncor(lsd, offset_map, weight_map, output_path)
         print(f"> {output_path.name} written after {i+1} iterations.")
         self.output_path_default = output_path
 
+    def _write_lncor(self, lsd, offset_map, weight_map, output_path):
+        # Looks up the per-line offset/weight and writes the corrected table in one block.
+        keys = list(zip(lsd["cruise"], lsd["line"]))
+        offset = np.array([offset_map.get(key, 0.0) for key in keys], dtype=float)
+        weight = np.array([weight_map.get(key, 0.0) for key in keys], dtype=float)
+        write_fixed_width(output_path, {
+            "cruise": lsd["cruise"], "year": lsd["year"], "doy": lsd["doy_time"],
+            "stub": np.zeros(len(lsd), dtype=np.int64),
+            "lon": lsd["lon"], "lat": lsd["lat"], "mag": lsd["mag"],
+            "corr_mag": lsd["mag"] + offset, "offset": offset, "weight": weight,
+        }, LNCOR_FIELDS)
+
     def plot(self, output_path: Path = None, spacing="0.01", tension=0.2, maxradius='2k',csvexport: bool = False, netcdfexport: bool = False):
         if not self.output_dir:
             raise ValueError("'output_dir' must be provided when initializing the class.")
+        if is_headless():
+            return None
+        # plotting and gridding need plotly and pygmt (libgmt); import them only here
+        import plotly.io as pio
+        from plotly.subplots import make_subplots
+        import plotly.graph_objects as go
+        import pygmt
 
         lsd_cols = ["cruise", "line", "year", "doy_time", "lon", "lat", "mag", "dist"]
         lncor_cols = ["cruise", "datetime", "dummy", "lon", "lat", "mag", "corr_mag", "offset", "weight"]
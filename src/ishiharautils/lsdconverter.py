@@ -2,6 +2,11 @@ from pathlib import Path
 import pandas as pd
 import math
 import csv
+from itertools import accumulate
+
+import numpy as np
+
+from cesiumtoolkit.fixedwidth import LSD_FIELDS, format_block
 
 class LSDConverter:
     # Converts one or more .lla files to a unified .lsd format with distance calculation.
@@ -53,19 +58,18 @@ class LSDConverter:
             df["dec_time"] = df["hour"] + df["minute"] / 60 + df["second"] / 3600
             df["doy_time"] = df["doy"] + df["dec_time"] / 24
 
-            df["distance_km"] = 0.0
-            for i in range(1, len(df)):
-                dist = self.haversine(df.iloc[i - 1]["lon"], df.iloc[i - 1]["lat"],
-                                       df.iloc[i]["lon"], df.iloc[i]["lat"])
-                df.at[df.index[i], "distance_km"] = df.at[df.index[i - 1], "distance_km"] + dist
+            lon, lat = df["lon"].to_numpy(), df["lat"].to_numpy()
+            steps = [self.haversine(lon[i - 1], lat[i - 1], lon[i], lat[i]) for i in range(1, len(df))]
+            df["distance_km"] = list(accumulate(steps, initial=0.0))
 
-            df["lon_west"] = df["lon"].apply(lambda x: x - 360 if x > 180 else x)
+            df["lon_west"] = df["lon"].where(df["lon"] <= 180, df["lon"] - 360)
 
-            lsd_lines = []
-            for _, row in df.iterrows():
-                line = f"{row['track']:4d} {line_number:5d} {row['year']:4d} {row['doy_time']:12.7f} " \
-                       f"{row['lon_west']:10.5f} {row['lat']:9.5f} {row['anomaly']:8.2f} {row['distance_km']:10.2f}"
-                lsd_lines.append(line)
+            block = format_block({
+                "track": df["track"], "line": np.full(len(df), line_number), "year": df["year"],
+                "doy_time": df["doy_time"], "lon": df["lon_west"], "lat": df["lat"],
+                "anomaly": df["anomaly"], "distance_km": df["distance_km"],
+            }, LSD_FIELDS)
+            lsd_lines = block.decode("ascii").splitlines()
 
             return lsd_lines
 